@@ -85,7 +85,10 @@ setup(
     labeled-image=vergeml.sources.labeled_image:LabeledImageSource[Pillow]
     labeled-image-features=vergeml.sources.features:LabeledImageFeaturesSource[Pillow]
     image-features=vergeml.sources.features:ImageFeaturesSource[Pillow]
-    mnist=vergeml.sources.mnist:plugin[Pillow]
+    mnist=vergeml.sources.mnist:plugin
+    array=vergeml.sources.array:ArraySource
+    image-archive=vergeml.sources.archive:ImageArchiveSource[Pillow]
+    manifest=vergeml.sources.manifest:ManifestSource[Pillow]
 
     [vergeml.model]
     imagenet=vergeml.models.imagenet:ImageNetModelPlugin
@@ -0,0 +1,87 @@
+"""
+Tests the image archive source.
+"""
+import io
+import tarfile
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from vergeml.sources.archive import ImageArchiveSource
+
+# pylint: disable=C0111
+
+def test_read_tar(tmpdir):
+    _write_tar(str(tmpdir.join("shard0.tar")), range(0, 5))
+    _write_tar(str(tmpdir.join("shard1.tar")), range(5, 10))
+    src = ImageArchiveSource(_args(tmpdir))
+    src.begin_read_samples()
+    samples = src.read_samples('train', 0, src.num_samples('train'))
+    assert len(samples) == 10
+    colors = sorted(s.x.getpixel((0, 0))[0] for s in samples)
+    assert colors == list(range(10))
+
+def test_read_zip(tmpdir):
+    for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        path = str(tmpdir.join("shard{}.zip".format(compression)))
+        with zipfile.ZipFile(path, "w", compression) as archive:
+            for i in range(4):
+                archive.writestr("img{}.png".format(i), _png(i))
+    src = ImageArchiveSource(_args(tmpdir))
+    src.begin_read_samples()
+    samples = src.read_samples('train', 0, src.num_samples('train'))
+    assert sorted(s.x.getpixel((0, 0))[0] for s in samples) == [0, 0, 1, 1, 2, 2, 3, 3]
+
+def test_samples_are_grouped_by_shard(tmpdir):
+    for shard in range(3):
+        _write_tar(str(tmpdir.join("shard{}.tar".format(shard))), range(shard * 10, shard * 10 + 10))
+    src = ImageArchiveSource(_args(tmpdir))
+    src.begin_read_samples()
+    samples = src.read_samples('train', 0, src.num_samples('train'))
+    shards = [s.meta['filename'].split("/")[0] for s in samples]
+    # every shard is read in one run
+    assert len([i for i in range(1, len(shards)) if shards[i] != shards[i-1]]) == 2
+
+def test_shard_order_is_fixed(tmpdir):
+    for shard in range(4):
+        _write_tar(str(tmpdir.join("shard{}.tar".format(shard))), range(shard * 5, shard * 5 + 5))
+
+    def _filenames():
+        src = ImageArchiveSource(_args(tmpdir))
+        src.begin_read_samples()
+        return [s.meta['filename'] for s in src.read_samples('train', 0, src.num_samples('train'))]
+
+    # the shards are shuffled once with random-seed, so every epoch and every run reads the same order
+    assert _filenames() == _filenames()
+
+def test_labeled(tmpdir):
+    path = str(tmpdir.join("shard.tar"))
+    with tarfile.open(path, "w") as archive:
+        for i, label in enumerate(("cat", "dog", "cat")):
+            _add(archive, "{}/img{}.png".format(label, i), _png(i))
+    src = ImageArchiveSource(dict(_args(tmpdir), labeled=True))
+    src.begin_read_samples()
+    assert list(src.meta['labels']) == ["cat", "dog"]
+    sample = src.transform(src.read_samples('train', 0)[0])
+    assert sample.y.tolist() in ([1., 0.], [0., 1.])
+    assert isinstance(sample.x, np.ndarray)
+
+def _args(tmpdir):
+    return {'samples-dir': str(tmpdir), 'cache-dir': str(tmpdir.join(".cache")),
+            'input-patterns': ["**/*.tar", "**/*.zip"], 'val-split': 0, 'test-split': 0}
+
+def _png(value):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), (value, 0, 0)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def _add(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+def _write_tar(path, values):
+    with tarfile.open(path, "w") as archive:
+        for i in values:
+            _add(archive, "img{}.png".format(i), _png(i))
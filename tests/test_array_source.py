@@ -0,0 +1,63 @@
+"""
+Tests the array source.
+"""
+import numpy as np
+
+from vergeml.data import Data
+from vergeml.loader import LiveLoader
+from vergeml.sources.array import ArraySource
+
+# pylint: disable=C0111
+
+def test_read_npy(tmpdir):
+    xs = np.arange(100 * 4, dtype='float32').reshape(100, 4)
+    np.save(str(tmpdir.join("x.npy")), xs)
+    src = ArraySource({'path': str(tmpdir.join("x.npy"))})
+    src.begin_read_samples()
+    assert src.num_samples('train') == 80
+    assert src.num_samples('val') == 10
+    assert src.num_samples('test') == 10
+    samples = src.read_samples('val', 0, 10)
+    assert [s.meta['index'] for s in samples] == sorted(s.meta['index'] for s in samples)
+    for sample in samples:
+        assert np.array_equal(sample.x, xs[sample.meta['index']])
+        assert sample.y is None
+
+def test_read_npz(tmpdir):
+    xs = np.arange(20 * 3, dtype='uint8').reshape(20, 3)
+    ys = np.arange(20)
+    for name, save in (("stored.npz", np.savez), ("compressed.npz", np.savez_compressed)):
+        save(str(tmpdir.join(name)), x=xs, y=ys)
+        src = ArraySource({'path': str(tmpdir.join(name)), 'val-split': 0, 'test-split': 0})
+        src.begin_read_samples()
+        xbatch, ybatch = src.read_arrays('train', 5, 10)
+        assert np.array_equal(xbatch, xs[5:15])
+        assert np.array_equal(ybatch, ys[5:15])
+
+def test_stored_npz_is_memory_mapped(tmpdir):
+    np.savez(str(tmpdir.join("data.npz")), x=np.zeros((10, 2)))
+    src = ArraySource({'path': str(tmpdir.join("data.npz")), 'val-split': 0, 'test-split': 0})
+    src.begin_read_samples()
+    xbatch, _ = src.read_arrays('train', 0, 10)
+    assert isinstance(xbatch, np.memmap)
+
+def test_hash_changes_with_file(tmpdir):
+    path = str(tmpdir.join("x.npy"))
+    np.save(path, np.zeros((10, 2)))
+    hash_value = ArraySource({'path': path}).hash("abc")
+    assert ArraySource({'path': path}).hash("abc") == hash_value
+    np.save(path, np.zeros((11, 2)))
+    assert ArraySource({'path': path}).hash("abc") != hash_value
+
+def test_load_arrays_without_samples(tmpdir, monkeypatch):
+    xs = np.arange(20 * 3, dtype='uint8').reshape(20, 3)
+    np.savez(str(tmpdir.join("data.npz")), x=xs, y=np.arange(20))
+    src = ArraySource({'path': str(tmpdir.join("data.npz")), 'val-split': 0, 'test-split': 0})
+    data = Data(input=src, output=src, cache_dir=str(tmpdir.join(".cache")), cache_input=False)
+
+    def _fail(*args):
+        raise AssertionError("samples created")
+    monkeypatch.setattr(LiveLoader, 'read_samples', _fail)
+
+    xbatch, ybatch = data.load('train', layout='arrays')
+    assert np.array_equal(xbatch, xs) and np.array_equal(ybatch, np.arange(20))
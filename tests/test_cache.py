@@ -1,4 +1,5 @@
-from vergeml.cache import FileCache, MemoryCache, SerializedFileCache, _NUMPY, _PICKLE, _BYTES
+from vergeml.cache import FileCache, MemoryCache, SerializedFileCache, MetaStore, _NUMPY, _PICKLE, _BYTES, \
+    _FLOAT16, _INT8, _UINT8, _CLASS_IDS
 import numpy as np
 
 # TODO test composite values
@@ -114,3 +115,79 @@ def test_memory():
     assert res[0][1] == dict(meta=5)
     assert res[4][0] == dict(x=9)
     assert res[4][1] == dict(meta=9)
+
+def test_file_dedup(tmpdir):
+    path = str(tmpdir.join("cache.dat"))
+    cache = SerializedFileCache(path, "w", dedup=True)
+    xs = [np.zeros((8, 8)), np.ones((8, 8)), np.zeros((8, 8))]
+    for i, x in enumerate(xs):
+        cache.write((x, i % 2), dict(meta=i))
+    cache.link(1, dict(meta=3))
+    cache.close()
+
+    rcache = SerializedFileCache(path, "r")
+    assert len(rcache) == 4
+    assert rcache.cnt.index[0] == rcache.cnt.index[2]
+    assert rcache.cnt.index[1] == rcache.cnt.index[3]
+
+    res = rcache.read(0, 4)
+    assert [m for _, m in res] == [dict(meta=i) for i in range(4)]
+    assert np.all(res[2][0][0] == 0) and res[2][0][1] == 0
+    assert np.all(res[3][0][0] == 1) and res[3][0][1] == 1
+
+def test_storage_dtypes(tmpdir):
+    path = str(tmpdir.join("cache.dat"))
+    rng = np.random.RandomState(0)
+    features = rng.randn(256).astype('float32')
+    image = rng.randint(0, 255, (8, 8, 3)).astype('float64')
+    onehot = np.eye(5)[3]
+
+    items = [((features, onehot), ('float16', 'class-ids'), (_FLOAT16, _CLASS_IDS)),
+             ((features, onehot), ('int8', None), (_INT8, _NUMPY)),
+             ((image, onehot * 2), ('uint8', 'class-ids'), (_UINT8, _NUMPY)),
+             ((image + 0.5, None), ('uint8', 'class-ids'), (_NUMPY, _PICKLE))]
+
+    for i, (data, dtypes, _) in enumerate(items):
+        cache = SerializedFileCache(path + str(i), "w", dtypes=dtypes)
+        cache.write(data, dict(meta=1))
+        cache.close()
+
+    for i, (data, _, types) in enumerate(items):
+        rcache = SerializedFileCache(path + str(i), "r")
+        assert rcache.cnt.info[0] == types
+        (x, y), _ = rcache.read(0, 1)[0]
+        assert x.dtype == data[0].dtype
+        assert np.abs(x - data[0]).max() <= (0.02 if types[0] == _INT8 else 0.001)
+        assert y is None if data[1] is None else np.array_equal(y, data[1]) and y.dtype == data[1].dtype
+
+def test_meta_store():
+    metas = [dict(split='train', filename='cats/{}.jpg'.format(i), size=i) for i in range(5)]
+    metas += [None, dict(split='train', filename='dogs/5.png', size=[5])]
+    store = MetaStore(metas)
+
+    assert len(store) == 7
+    assert [store[i] for i in range(7)] == metas
+    assert store.query(filename='cats/*').tolist() == [0, 1, 2, 3, 4]
+    assert store.query(filename=['*.png', 'cats/1.jpg']).tolist() == [1, 6]
+    assert store.query(split='train', size=lambda size: size == 2).tolist() == [2]
+    assert store.column('size').tolist() == [0, 1, 2, 3, 4, None, [5]]
+    assert list(store.take([6, 5, 0])) == [metas[6], None, metas[0]]
+
+    # changes to a sample's metadata don't change the store
+    meta = store[0]
+    meta['label'] = 'cat'
+    del meta['size']
+    assert meta.copy() == dict(split='train', filename='cats/0.jpg', label='cat')
+    assert store[0] == metas[0]
+
+def test_read_write_meta_store(tmpdir):
+    path = str(tmpdir.join("test.cache"))
+    wcache = SerializedFileCache(path, "w")
+    for i in range(10):
+        wcache.write(data=i, meta=(dict(filename="{}.jpg".format(i)), i) if i != 5 else None)
+    wcache.close()
+
+    rcache = SerializedFileCache(path, "r")
+    assert isinstance(rcache.cnt.meta.store.columns['filename'], np.ndarray)
+    assert [m for _, m in rcache.read(4, 3)] == [(dict(filename='4.jpg'), 4), None, (dict(filename='6.jpg'), 6)]
+    assert rcache.cnt.meta.store.query(filename='[1-3].jpg').tolist() == [1, 2, 3]
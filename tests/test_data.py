@@ -5,10 +5,17 @@ Test the data loading interface.
 import random
 from pathlib import Path
 
-from vergeml.data import Data
+import numpy as np
+import pytest
+
+from vergeml.data import Data, Labels, LabelIndex
+from vergeml.utils import VergeMLError
+from vergeml.loader import FileCachedLoader, LiveLoader
 from vergeml.io import source, SourcePlugin, Sample
-from vergeml.operation import operation, OperationPlugin
+from vergeml.operation import operation, OperationPlugin, FusedOperation
 from vergeml.operations.augment import AugmentOperation
+from vergeml.operations.crop import CropOperation
+from vergeml.operations.flip_horizontal import FlipHorizontalOperation
 
 # pylint: disable=C0111
 
@@ -263,8 +270,116 @@ def test_data_disk_loader_with_multiplier_ops_between(tmpdir):
                 cache_input='disk', cache_output=False)
     _test_data_read_samples_x2_between(data)
 
+# --------------------------------------------------
+
+def test_label_index():
+    index = LabelIndex(Labels(['cat', 'dog', 'mouse']))
+    ids = index.encode(['mouse', 'cat'])
+    assert ids.dtype == 'int32'
+    assert index.decode(ids) == ['mouse', 'cat']
+    assert index.onehot(ids).tolist() == [1., 0., 1.]
+
+def test_label_index_of_source():
+    src = SourceTest({})
+    src.meta['labels'] = Labels(['cat', 'dog'])
+    index = LabelIndex.of(src)
+    assert LabelIndex.of(src) is index
+
+    # the index follows the labels when meta is replaced
+    src.meta['labels'] = Labels(['cat', 'dog', 'mouse'])
+    assert LabelIndex.of(src).encode(['mouse']).tolist() == [2]
+
 # ---------------------------------------------------------------------------------
 
+
+def test_data_load_arrays(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem')
+    digit = lambda x: np.array([int(x[7])] * 3)
+
+    for randomize in (False, True):
+        samples = data.load('train', randomize=randomize, transform_x=digit)
+        xs, ys = data.load('train', layout='arrays', randomize=randomize, transform_x=digit)
+        assert xs.shape == (len(samples), 3)
+        assert xs.tolist() == [x.tolist() for x, _ in samples]
+        assert ys.tolist() == [None] * len(samples)
+
+    xs, _, meta = data.load('train', layout='arrays', with_meta=True)
+    assert xs.tolist() == [x for x, _, _ in data.load('train', with_meta=True)]
+    assert meta == [m for _, _, m in data.load('train', with_meta=True)]
+
+def test_data_load_transform_batch(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem')
+    digits = [int(x[7]) for x, _ in data.load('train')]
+
+    xs, _ = data.load('train', layout='arrays', transform_x=lambda x: int(x[7]),
+                      transform_batch_x=lambda xs: xs / 10.)
+    assert xs.tolist() == [d / 10. for d in digits]
+
+    samples = data.load('train', transform_batch_x=lambda xs: [x.upper() for x in xs])
+    assert [x for x, _ in samples] == [x.upper() for x, _ in data.load('train')]
+
+    samples = data.load('train', transform_batch_y=lambda ys: [1] * len(ys))
+    assert samples == [(x, 1) for x, _ in data.load('train')]
+    assert all(isinstance(sample, tuple) for sample in data.load('train', with_meta=True))
+
+def test_data_fuse_ops(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    ops = [CropOperation(10, 10), FlipHorizontalOperation(), AppendStringOperation()]
+
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem', ops=ops)
+    assert isinstance(data.loader.ops[0], FusedOperation)
+
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem', ops=ops, fuse_ops=False)
+    assert data.loader.ops == ops
+
+def test_data_hybrid_cache(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    ops = [CropOperation(10, 10), AugmentOperation(2), AppendStringOperation()]
+
+    data = Data(input=src, cache_dir=cache_dir, cache_input=False, cache_output='hybrid', ops=ops)
+    assert isinstance(data.loader, LiveLoader) and data.loader.ops == ops[1:]
+    assert isinstance(data.loader.input, FileCachedLoader) and data.loader.input.ops == ops[:1]
+
+    expected = Data(input=src, cache_dir=cache_dir, cache_input=False, ops=ops).load('train')
+    assert data.load('train') == expected
+    assert len(expected) == 16 and expected[0][0].endswith('-hello-transformed')
+
+    # without random operations, all output is cached
+    data = Data(input=src, cache_dir=cache_dir, cache_input=False, cache_output='hybrid', ops=ops[:1])
+    assert isinstance(data.loader, FileCachedLoader) and data.loader.transform
+
+def test_data_load_arrays_memmap(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem')
+    digit = lambda x: np.array([int(x[7])] * 3, dtype='uint8')
+    xs, _ = data.load('train', layout='arrays', memmap=True, transform_x=digit)
+    assert isinstance(xs, np.memmap)
+    assert xs.tolist() == [x.tolist() for x, _ in data.load('train', transform_x=digit)]
+
+def test_data_load_arrays_mixed_dtypes(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir)})
+    data = Data(input=src, cache_dir=cache_dir, cache_input='mem')
+    # odd digits are floats, even digits integers
+    mixed = lambda x: np.array([int(x[7]) / 2] * 3) if int(x[7]) % 2 else np.array([int(x[7]) // 2] * 3)
+    expected = np.array([x for x, _ in data.load('train', transform_x=mixed)])
+
+    for memmap in (False, True):
+        xs, _ = data.load('train', layout='arrays', memmap=memmap, transform_x=mixed)
+        assert xs.dtype == expected.dtype == np.float64
+        assert xs.tolist() == expected.tolist()
+
+    ragged = lambda x: np.zeros(int(x[7]))
+    with pytest.raises(VergeMLError, match="Can't load samples of shape"):
+        data.load('train', layout='arrays', transform_x=ragged)
+
 def _test_data_meta(data):
     assert data.meta['some-meta'] == 'meta-value'
 
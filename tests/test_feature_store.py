@@ -0,0 +1,59 @@
+"""
+Tests the content-addressed feature store.
+"""
+import numpy as np
+from PIL import Image
+
+from vergeml.sources import features
+from vergeml.sources.features import FeatureStore
+
+# pylint: disable=C0111
+
+def test_put_get(tmpdir):
+    store = FeatureStore(str(tmpdir), ['resnet-50', 'auto', 224, 1.0, 'last'])
+    key = FeatureStore.image_key(Image.new('RGB', (10, 10), (1, 2, 3)))
+    assert store.get(key) is None
+    store.put(key, np.arange(5, dtype='float32'))
+    assert np.array_equal(store.get(key), np.arange(5, dtype='float32'))
+    store.flush()
+    assert np.array_equal(store.get(key), np.arange(5, dtype='float32'))
+
+def test_shards(tmpdir, monkeypatch):
+    monkeypatch.setattr(features, '_SHARD_SIZE', 10)
+    config = ['resnet-50', 'auto', 224, 1.0, 'last']
+    store = FeatureStore(str(tmpdir), config)
+    keys = [FeatureStore.image_key(Image.new('RGB', (10, 10), (i, 0, 0))) for i in range(25)]
+    vectors = np.arange(75, dtype='float32').reshape(25, 3)
+    for i in range(0, 25, 5):
+        store.put_many(keys[i:i+5], vectors[i:i+5])
+
+    # full shards are written while putting, the rest on flush
+    assert len(tmpdir.listdir()[0].listdir()) == 4
+    store.flush()
+    assert len(tmpdir.listdir()[0].listdir()) == 6
+
+    other = FeatureStore(str(tmpdir), config)
+    found = other.get_many(keys[::-1] + [FeatureStore.image_key(Image.new('RGB', (1, 1)))])
+    assert [vec.tolist() for vec in found[:-1]] == vectors[::-1].tolist()
+    assert found[-1] is None
+
+def test_shared_between_instances(tmpdir):
+    config = ['resnet-50', 'auto', 224, 1.0, 'last']
+    key = FeatureStore.image_key(Image.new('RGB', (10, 10), (1, 2, 3)))
+    store = FeatureStore(str(tmpdir), config)
+    store.put(key, np.ones(3))
+    store.flush()
+    assert np.array_equal(FeatureStore(str(tmpdir), config).get(key), np.ones(3))
+
+def test_config_separates_vectors(tmpdir):
+    key = FeatureStore.image_key(Image.new('RGB', (10, 10), (1, 2, 3)))
+    FeatureStore(str(tmpdir), ['resnet-50', 'auto', 224, 1.0, 'last']).put(key, np.ones(3))
+    assert FeatureStore(str(tmpdir), ['xception', 'auto', 299, 1.0, 'last']).get(key) is None
+
+def test_image_key():
+    img1 = Image.new('RGB', (10, 10), (1, 2, 3))
+    img2 = Image.new('RGB', (10, 10), (1, 2, 3))
+    img3 = Image.new('RGB', (10, 10), (1, 2, 4))
+    assert FeatureStore.image_key(img1) == FeatureStore.image_key(img2)
+    assert FeatureStore.image_key(img1) != FeatureStore.image_key(img3)
+    assert FeatureStore.image_key(img1) != FeatureStore.image_key(img1.convert('L'))
@@ -0,0 +1,174 @@
+"""
+Tests the image feature sources with a stub model.
+"""
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from vergeml.io import Sample
+from vergeml.option import option, Option
+from vergeml.utils import VergeMLError
+from vergeml.sources import features
+from vergeml.sources.features import ImageFeaturesSource, LabeledImageFeaturesSource
+
+# pylint: disable=C0111
+
+class StubModel:
+    """Returns the mean color of each image and counts the images it has seen."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, xs):
+        self.calls.append(len(xs))
+        return xs.mean(axis=(1, 2))
+
+
+class _Result:
+
+    def __init__(self, fun, args):
+        self.fun, self.args = fun, args
+
+    def get(self):
+        return self.fun(*self.args)
+
+
+class SyncPool:
+    """Runs the tasks of a worker pool in this process when their results are requested."""
+
+    def __init__(self, initargs):
+        features._init_worker(*initargs)
+
+    def apply_async(self, fun, args):
+        return _Result(fun, args)
+
+
+def _samples(num):
+    return [Sample(Image.new('RGB', (8, 8), (i, 2 * i, 3 * i)), None, {'split': 'train'}, None)
+            for i in range(num)]
+
+def _source(tmpdir, monkeypatch, **args):
+    model = StubModel()
+    monkeypatch.setattr(features, '_load_model', lambda *config: (lambda x: x, model))
+    defaults = {'cache-dir': str(tmpdir.join('.cache')), 'architecture': 'resnet-50',
+                'variant': 'auto', 'size': 'auto', 'alpha': 1.0, 'output-layer': 'last'}
+    args = dict(defaults, **args)
+    return ImageFeaturesSource(args), model
+
+def test_extract_features(tmpdir, monkeypatch):
+    src, model = _source(tmpdir, monkeypatch)
+    samples = _samples(20)
+    res = list(src.extract_features(samples))
+
+    assert [sample for sample, _ in res] == samples
+    assert [vec.tolist() for _, vec in res] == [[i, 2 * i, 3 * i] for i in range(20)]
+
+    # images are passed through the model in batches
+    assert model.calls == [16, 4]
+
+def test_features_are_read_from_store(tmpdir, monkeypatch):
+    src, model = _source(tmpdir, monkeypatch, **{'feature-store': 'on'})
+    samples = _samples(20)
+    first = [vec.tolist() for _, vec in src.extract_features(samples)]
+
+    # the vectors of one extraction are written to a single shard
+    store_dir = tmpdir.join('.cache', 'features').listdir()[0]
+    assert sorted(path.basename.split('.', 1)[1] for path in store_dir.listdir()) == \
+        ['keys.npy', 'vectors.npy']
+
+    # a second source with the same configuration finds every vector in the store
+    other, other_model = _source(tmpdir, monkeypatch, **{'feature-store': 'on'})
+    assert [vec.tolist() for _, vec in other.extract_features(samples)] == first
+    assert other_model.calls == []
+    assert model.calls == [16, 4]
+
+def test_feature_store_is_off_by_default(tmpdir, monkeypatch):
+    src, model = _source(tmpdir, monkeypatch)
+    samples = _samples(4)
+    list(src.extract_features(samples))
+    list(src.extract_features(samples))
+
+    assert model.calls == [4, 4]
+    assert not os.path.exists(str(tmpdir.join('.cache', 'features')))
+
+def test_missing_custom_model(tmpdir, monkeypatch):
+    src, _ = _source(tmpdir, monkeypatch, **{'trainings-dir': str(tmpdir.join('trainings')),
+                                             'feature-store': str(tmpdir.join('store'))})
+    src.architecture = '@mymodel'
+
+    with pytest.raises(VergeMLError, match="Can't find the model of @mymodel"):
+        list(src.extract_features(_samples(1)))
+
+def test_extract_features_with_workers(tmpdir, monkeypatch):
+    src, model = _source(tmpdir, monkeypatch, workers=3, threads=2)
+    monkeypatch.setattr(features, '_set_backend_threads', lambda threads: None)
+    monkeypatch.setattr(ImageFeaturesSource, '_get_pool',
+                        lambda self: SyncPool((self._model_config(), self.image_size, self.threads)))
+
+    samples = _samples(50)
+    res = list(src.extract_features(samples))
+
+    # the results of the workers are merged in the order of the samples
+    assert [sample for sample, _ in res] == samples
+    assert [vec.tolist() for _, vec in res] == [[i, 2 * i, 3 * i] for i in range(50)]
+    assert model.calls == [16, 16, 16, 2]
+    assert features._WORKER['threads'] == 2
+
+def test_chunks():
+    assert list(features._chunks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(features._chunks(iter([]), 3)) == []
+
+def test_runtime_options_are_not_hashed(tmpdir, monkeypatch):
+    Image.new('RGB', (8, 8)).save(str(tmpdir.join('img.png')))
+    src, _ = _source(tmpdir, monkeypatch, **{'samples-dir': str(tmpdir)})
+    other, _ = _source(tmpdir, monkeypatch, workers=4, threads=2, **{'samples-dir': str(tmpdir)})
+    src.begin_read_samples()
+    other.begin_read_samples()
+
+    assert 'workers' not in src.configuration() and 'threads' not in src.configuration()
+    assert src.configuration() == other.configuration()
+    assert src.hash("abc") == other.hash("abc")
+
+def test_set_backend_threads(monkeypatch):
+    calls = []
+    keras = types.ModuleType('keras')
+    keras.backend = types.SimpleNamespace(backend=lambda: 'tensorflow',
+                                          set_session=lambda session: calls.append(('session', session)))
+    monkeypatch.setitem(sys.modules, 'keras', keras)
+
+    # TensorFlow 2
+    tf2 = types.ModuleType('tensorflow')
+    tf2.config = types.SimpleNamespace(threading=types.SimpleNamespace(
+        set_intra_op_parallelism_threads=lambda n: calls.append(('intra', n)),
+        set_inter_op_parallelism_threads=lambda n: calls.append(('inter', n))))
+    monkeypatch.setitem(sys.modules, 'tensorflow', tf2)
+    features._set_backend_threads(3)
+    assert calls == [('intra', 3), ('inter', 1)]
+
+    # TensorFlow 1
+    del calls[:]
+    tf1 = types.ModuleType('tensorflow')
+    tf1.ConfigProto = dict
+    tf1.Session = lambda config: config
+    monkeypatch.setitem(sys.modules, 'tensorflow', tf1)
+    features._set_backend_threads(3)
+    assert calls == [('session', dict(intra_op_parallelism_threads=3, inter_op_parallelism_threads=1))]
+
+def test_options_are_not_added_to_parent():
+    names = lambda cls: [opt.name for opt in Option.discover(cls)]
+    assert 'workers' in names(ImageFeaturesSource) and 'workers' in names(LabeledImageFeaturesSource)
+
+    @option('first')
+    class Parent: # pylint: disable=R0903
+        pass
+
+    @option('second')
+    class Child(Parent): # pylint: disable=R0903,W0612
+        pass
+
+    assert names(Parent) == ['first']
+    assert sorted(names(Child)) == ['first', 'second']
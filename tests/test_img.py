@@ -0,0 +1,65 @@
+import timeit
+
+import numpy as np
+from PIL import Image
+from vergeml.img import resize_image, resize_batch, grayscale_batch, rgb_batch, images_to_batch
+
+
+def _image(shape, seed=0):
+    return np.random.RandomState(seed).randint(0, 256, shape).astype('uint8')
+
+
+def test_resize_batch_like_pil():
+    arr = _image((37, 53, 3))
+
+    for method in ('nearest', 'bilinear', 'bicubic', 'antialias'):
+        for mode in ('fill', 'aspect-fill'):
+            for width, height in ((20, 15), (80, 70)):
+                expected = np.asarray(resize_image(Image.fromarray(arr), width, height, method, mode))
+                res = resize_batch(arr[np.newaxis], width, height, method, mode)[0]
+                assert res.shape == expected.shape
+                assert res.dtype == np.uint8
+                assert np.abs(res.astype(int) - expected.astype(int)).max() <= (0 if method == 'nearest' else 2)
+
+
+def test_resize_batch_float():
+    arr = np.random.RandomState(0).rand(2, 10, 10).astype('float32')
+    res = resize_batch(arr, 5, 4, 'bilinear', 'fill')
+    assert res.shape == (2, 4, 5)
+    assert res.dtype == np.float32
+
+    res = resize_batch(arr, 8, 4, 'bilinear', 'aspect-fit')
+    assert res.shape == (2, 4, 8)
+    assert np.all(res[:, :, :2] == 0.)
+
+
+def test_resize_batch_speed():
+    # each output pixel is computed from its filter support only, so downscaling
+    # a large image takes about as long as with PIL (a dense weight matrix took seconds)
+    arr = _image((1, 1024, 1024, 3))
+    elapsed = min(timeit.repeat(lambda: resize_batch(arr, 224, 224, 'antialias', 'fill'), number=1, repeat=3))
+    expected = np.asarray(Image.fromarray(arr[0]).resize((224, 224), Image.LANCZOS))
+    assert elapsed < 1.
+    assert np.abs(resize_batch(arr, 224, 224, 'antialias', 'fill')[0].astype(int) - expected).max() <= 2
+
+
+def test_grayscale_rgb_batch_like_pil():
+    for shape in ((12, 10, 3), (12, 10, 4)):
+        arr = _image(shape)
+        expected = np.asarray(Image.fromarray(arr).convert('L'))
+        assert np.array_equal(grayscale_batch(arr[np.newaxis])[0, :, :, 0], expected)
+
+        expected = np.asarray(Image.fromarray(arr).convert('RGB'))
+        assert np.array_equal(rgb_batch(arr[np.newaxis])[0], expected)
+
+    arr = _image((12, 10))
+    assert np.array_equal(rgb_batch(arr[np.newaxis])[0], np.asarray(Image.fromarray(arr).convert('RGB')))
+    assert grayscale_batch(arr[np.newaxis]).shape == (1, 12, 10)
+
+
+def test_images_to_batch_arrays():
+    arrs = [_image((4, 5), seed) for seed in range(3)]
+    assert images_to_batch(arrs).shape == (3, 4, 5)
+    assert images_to_batch(arrs + [_image((5, 4))]) is None
+    assert images_to_batch(arrs + [arrs[0].astype('float32')]) is None
+    assert images_to_batch(arrs[:2] + [Image.fromarray(arrs[2])]) is None
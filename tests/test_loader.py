@@ -1,14 +1,32 @@
 """
 Tests data loading (cached + direct).
 """
+import io
+import json
 import random
 
 from pathlib import Path
 
-from vergeml.loader import MemoryCachedLoader, LiveLoader, FileCachedLoader
+import numpy as np
+from PIL import Image
+
+from vergeml import loader as loader_module
+from vergeml.loader import MemoryCachedLoader, LiveLoader, FileCachedLoader, PyramidCachedLoader, \
+    _process_batch, _process_samples
 from vergeml.io import SourcePlugin, source, Sample
-from vergeml.operation import OperationPlugin, operation
+from vergeml.operation import OperationPlugin, operation, fuse_ops, FusedOperation, Pipeline, pyramid_target
 from vergeml.operations.augment import AugmentOperation
+from vergeml.operations.crop import CropOperation
+from vergeml.operations.flip_horizontal import FlipHorizontalOperation
+from vergeml.operations.flip_vertical import FlipVerticalOperation
+from vergeml.operations.random_crop import RandomCropOperation
+from vergeml.operations.grayscale import GrayscaleOperation
+from vergeml.operations.rgb import RGBOperation
+from vergeml.operations.resize import ResizeOperation
+from vergeml.rng import CounterRandom
+from vergeml.display import DISPLAY
+from vergeml.sources.image import ImageSource
+from vergeml.sources.labeled_image import LabeledImageSource
 
 # pylint: disable=C0111
 
@@ -370,6 +388,271 @@ def _test_loader_with_rng_no_reset(loader):
     assert rnum != sample.rng.randint(1, 1000000)
     loader.end_read_samples()
 
+def test_process_batch():
+    ops = [CropOperation(24, 16, position='bottom-left'), FlipHorizontalOperation(chance=0.5),
+           FlipVerticalOperation(chance=0.5), RandomCropOperation(10, 12)]
+
+    assert _process_batch(ops, _random_samples(), 'train') is not None
+
+    # counter generators give each operation its own stream, in batches as well
+    for make_rng in (random.Random, lambda i: CounterRandom(0, i)):
+        batch, single = _random_samples(make_rng=make_rng), _random_samples(make_rng=make_rng)
+        processed = _process_samples(Pipeline(ops), batch, 'train')
+        for (sample,), other in zip(processed, single):
+            expected, = ops[0].process(other, ops[1:])
+            assert np.array_equal(np.asarray(sample.x), np.asarray(expected.x))
+
+    # fall back to processing single samples
+    assert _process_batch(ops + [AppendStringOperation()], _random_samples(), 'train') is None
+
+
+def test_process_batch_arrays():
+    arrays = dict(to_image=lambda arr: arr, make_y=lambda i, rng: np.array([1, 2]))
+    ops = [RandomCropOperation(16, 12), CropOperation(10, 10), FlipHorizontalOperation(chance=0.5),
+           FlipVerticalOperation(chance=0.5), GrayscaleOperation(), RGBOperation()]
+
+    assert _process_batch(ops, _random_samples(**arrays), 'train') is not None
+
+    batch, single = _random_samples(**arrays), _random_samples(**arrays)
+    processed = _process_samples(Pipeline(ops), batch, 'train')
+    for (sample,), other in zip(processed, single):
+        expected, = ops[0].process(other, ops[1:])
+        assert isinstance(expected.x, np.ndarray)
+        assert expected.x.shape == (10, 10, 3)
+        assert np.array_equal(sample.x, expected.x)
+        assert np.array_equal(sample.y, [1, 2])
+
+    # crops and flips of single arrays don't copy
+    sample = _random_samples(**arrays)[0]
+    cropped, = CropOperation(10, 10).process(sample, [])
+    flipped, = FlipHorizontalOperation().process(sample, [])
+    assert np.shares_memory(cropped.x, sample.x)
+    assert np.shares_memory(flipped.x, sample.x)
+
+
+def test_pipeline():
+    # odd samples have an image as y
+    make_y = lambda i, rng: Image.fromarray(rng.randint(0, 255, (20, 30)).astype('uint8')) if i % 2 else i
+
+    ops = [CropOperation(24, 16, apply='val'), AugmentOperation(3), RandomCropOperation(10, 12),
+           FlipHorizontalOperation(chance=0.5), GrayscaleOperation(apply='x'), AppendStringOperation()]
+    pipeline = Pipeline(ops)
+
+    for sample, other in zip(_random_samples(6, make_y=make_y), _random_samples(6, make_y=make_y)):
+        expected = list(ops[0].process(sample, ops[1:]))
+        res = pipeline.process(other, 'train')
+        assert len(res) == len(expected) == 3
+
+        for sample1, sample2 in zip(res, expected):
+            for data1, data2 in ((sample1.x, sample2.x), (sample1.y, sample2.y)):
+                assert type(data1) == type(data2) # pylint: disable=C0123
+                assert np.array_equal(np.asarray(data1), np.asarray(data2))
+
+        assert sample.rng.getstate() == other.rng.getstate()
+
+    assert [len(stages) for stages in pipeline.stages.values()] == [5]
+
+
+def test_live_loader_variants(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir), 'test-split': 2, 'val-split': 2})
+    ops = [AppendRandomOperation(), AugmentOperation(variants=3), AppendRandomOperation()]
+
+    loader = MemoryCachedLoader(cache_dir, src, ops=ops, output=src)
+    loader.begin_read_samples()
+    expected = [sample.x for sample in loader.read_samples('train', 0, loader.num_samples('train'))]
+
+    loader = LiveLoader(cache_dir, src, ops=ops, output=src)
+    loader.begin_read_samples()
+    assert loader.num_samples('train') == len(expected) == 18
+    assert [sample.x for sample in loader.read_samples('train', 0, 18)] == expected
+    assert [sample.x for sample in loader.read_samples('train', 4, 6)] == expected[4:10]
+    assert [loader.read_samples('train', i)[0].x for i in range(18)] == expected
+
+    # the variants share the first random operation only
+    assert len({x.split('-')[1] for x in expected[:3]}) == 1
+    assert len({x.split('-')[2] for x in expected[:3]}) == 3
+
+
+def test_compat_variants_are_unchanged(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir), 'test-split': 2, 'val-split': 2})
+    ops = [AppendRandomOperation(), AugmentOperation(variants=3), AppendRandomOperation()]
+
+    # the random numbers of 'compat' mode, where the variants share the generator of the sample
+    expected = ['content6-822852-455701-transformed', 'content6-822852-737589-transformed',
+                'content6-822852-38091-transformed', 'content5-551717-673547-transformed',
+                'content5-551717-666485-transformed', 'content5-551717-902538-transformed']
+
+    for cls in (MemoryCachedLoader, LiveLoader):
+        loader = cls(cache_dir, src, ops=ops, output=src)
+        loader.begin_read_samples()
+        assert [sample.x for sample in loader.read_samples('train', 0, 6)] == expected
+
+    loader = LiveLoader(cache_dir, src, ops=ops, output=src)
+    loader.begin_read_samples()
+    assert [loader.read_samples('train', i)[0].x for i in range(4, -1, -1)] == expected[4::-1]
+
+def test_live_loader_epochs(tmpdir):
+    cache_dir = _prepare_dir(tmpdir)
+    src = SourceTest({'samples-dir': str(tmpdir), 'test-split': 2, 'val-split': 2, 'rng': 'counter'})
+    ops = [AppendRandomOperation(), AugmentOperation(variants=3), AppendRandomOperation()]
+
+    loader = MemoryCachedLoader(cache_dir, src, ops=ops, output=src)
+    loader.begin_read_samples()
+    expected = [sample.x for sample in loader.read_samples('train', 0, 18)]
+    assert len({x.split('-')[1] for x in expected[:3]}) == 1
+    assert len({x.split('-')[2] for x in expected[:3]}) == 3
+
+    # the first epoch of a live loader matches the cache, later epochs get new random numbers
+    loader = LiveLoader(cache_dir, src, ops=ops, output=src)
+    loader.begin_read_samples()
+    assert [sample.x for sample in loader.read_samples('train', 0, 18)] == expected
+    second = [sample.x for sample in loader.read_samples('train', 0, 18)]
+    assert all(x != other for x, other in zip(second, expected))
+
+    # the loader only keeps the integer state of the generators
+    assert all(isinstance(state, tuple) for state in loader.rngs['train'])
+    assert isinstance(loader.read_samples('train', 0)[0].rng, CounterRandom)
+
+
+def test_pyramid_cached_loader(tmpdir):
+    cache_dir = str(tmpdir.mkdir('.cache'))
+    rng = np.random.RandomState(0)
+    for i in range(4):
+        img = Image.fromarray(rng.randint(0, 255, (30, 40, 3)).astype('uint8')).resize((400, 300))
+        img.save(str(tmpdir.join("img{}.png".format(i))))
+
+    src = ImageSource({'samples-dir': str(tmpdir), 'val-split': 1, 'test-split': 1})
+    ops = [FlipHorizontalOperation(), ResizeOperation(100, 80)]
+    assert pyramid_target(ops) == (100, 80, 'fill')
+    assert pyramid_target([CropOperation(50, 50)] + ops) is None
+
+    loader = PyramidCachedLoader(cache_dir, src, levels=(256, 128, 64), target=pyramid_target(ops))
+    loader.begin_read_samples()
+    assert [loader.num_samples(split) for split in ('train', 'val', 'test')] == [2, 1, 1]
+    samples = loader.read_samples('train', 0, 2)
+    assert [sample.x.size for sample in samples] == [(171, 128)] * 2
+
+    loader.target = (300, 300, 'aspect-fill')
+    assert loader.read_samples('val', 0)[0].x.size == (400, 300)
+
+    # the output is close to the output for the original image
+    live = LiveLoader(cache_dir, loader, ops=ops, output=src)
+    live.begin_read_samples()
+    loader.target = pyramid_target(ops)
+    expected = _process_samples(Pipeline(ops), src.read_samples('train', 0, 2), 'train')
+    for sample, (other,) in zip(live.read_samples('train', 0, 2), expected):
+        assert np.abs(sample.x.astype(int) - np.asarray(other.x).astype(int)).mean() < 2
+
+def test_loader_query(tmpdir):
+    cache_dir = str(tmpdir.mkdir('.cache'))
+    samples_dir = tmpdir.mkdir('samples')
+    for label, ext in (('cat', 'jpg'), ('dog', 'png')):
+        label_dir = samples_dir.mkdir(label)
+        for i in range(4):
+            Image.new('RGB', (8, 8)).save(str(label_dir.join("{}.{}".format(i, ext))))
+
+    src = LabeledImageSource({'samples-dir': str(samples_dir), 'val-split': 0, 'test-split': 0})
+    ops = [AugmentOperation(2)]
+
+    for loader in (LiveLoader(cache_dir, src, ops=ops), MemoryCachedLoader(cache_dir, src, ops=ops),
+                   FileCachedLoader(cache_dir, src, ops=ops)):
+        loader.begin_read_samples()
+        cats = loader.query('train', label='cat')
+        assert len(cats) == 8
+        assert all('cat' in sample.meta['filename'] for i in cats for sample in loader.read_samples('train', i))
+        assert loader.query('train', filename='*.png').tolist() == loader.query('train', label='dog').tolist()
+        assert loader.query('train', label=['cat', 'dog'], filename='*/[01].*').tolist() == \
+            [i for i in range(16) if loader.sample_meta('train')[i]['filename'][-5] in '01']
+        assert len(loader.query('val')) == 0
+
+def test_read_samples_meta_is_dict(tmpdir):
+    cache_dir = str(tmpdir.mkdir('.cache'))
+    samples_dir = tmpdir.mkdir('samples').mkdir('cat')
+    for i in range(2):
+        Image.new('RGB', (8, 8)).save(str(samples_dir.join("{}.jpg".format(i))))
+
+    src = LabeledImageSource({'samples-dir': str(tmpdir.join('samples')), 'val-split': 0, 'test-split': 0})
+    src.begin_read_samples()
+    assert all(type(sample.meta) is dict for sample in src.read_samples('train', 0, 2)) # pylint: disable=C0123
+
+    for loader in (LiveLoader(cache_dir, src), MemoryCachedLoader(cache_dir, src), FileCachedLoader(cache_dir, src)):
+        loader.begin_read_samples()
+        for sample in loader.read_samples('train', 0, 2):
+            assert isinstance(sample.meta, dict)
+            assert json.loads(json.dumps(sample.meta))['filename'] == sample.meta['filename']
+
+def test_fuse_ops():
+
+    ops = [CropOperation(36, 30), ResizeOperation(24, 20, method='bilinear'),
+           FlipHorizontalOperation(chance=0.5), RandomCropOperation(16, 12)]
+
+    fused = fuse_ops(ops)
+    assert len(fused) == 1 and isinstance(fused[0], FusedOperation)
+    assert not fused[0].deterministic
+
+    for to_image in (Image.fromarray, lambda arr: arr):
+        samples = [_random_samples(shape=(40, 50, 3), to_image=to_image) for _ in range(2)]
+        for sample, other in zip(*samples):
+            expected, = ops[0].process(sample, ops[1:])
+            res, = fused[0].process(other, [])
+            diff = np.asarray(res.x).astype(int) - np.asarray(expected.x).astype(int)
+            assert np.abs(diff).max() <= 1
+            assert sample.rng.getstate() == other.rng.getstate()
+
+    # runs hold at most one resize and end at other operations
+    ops = [CropOperation(30, 30), ResizeOperation(20, 20), ResizeOperation(10, 10),
+           FlipHorizontalOperation(), AppendStringOperation(), FlipVerticalOperation()]
+    assert [type(op) for op in fuse_ops(ops)] == \
+        [FusedOperation, FusedOperation, AppendStringOperation, FlipVerticalOperation]
+
+    # batches of crops and flips are processed as one array instead
+    ops = [CropOperation(30, 30), FlipHorizontalOperation()]
+    assert fuse_ops(ops) == ops
+
+
+def test_identical_samples_are_processed_once(tmpdir, monkeypatch):
+    for name, content in (("a", "same"), ("b", "same"), ("c", "same"), ("d", "other")):
+        tmpdir.join("{}.test".format(name)).write(content)
+    cache_dir = str(tmpdir.mkdir('.cache'))
+    src = LabeledSourceTest({'samples-dir': str(tmpdir), 'test-split': 0, 'val-split': 0})
+    op = CountingOperation()
+    output = io.StringIO()
+    monkeypatch.setattr(DISPLAY, 'stdout', output)
+
+    loader = MemoryCachedLoader(cache_dir, src, ops=[op])
+    loader.begin_read_samples()
+    samples = loader.read_samples('train', 0, loader.num_samples('train'))
+    res = {s.meta['filename']: (s.x, s.y) for s in samples}
+
+    # a and c are identical, b has the same content but another label
+    assert res == {'a.test': ('same-seen', 0), 'b.test': ('same-seen', 1),
+                   'c.test': ('same-seen', 0), 'd.test': ('other-seen', 0)}
+    assert sorted(op.seen) == ['other', 'same', 'same']
+    assert "1 train samples have the same content as a sample with a different label" in output.getvalue()
+
+    # duplicates are found across chunks
+    monkeypatch.setattr(loader_module, '_CHUNK_SIZE', 1)
+    op.seen = []
+    loader = MemoryCachedLoader(cache_dir, src, ops=[op])
+    loader.begin_read_samples()
+    samples = loader.read_samples('train', 0, loader.num_samples('train'))
+    assert {s.meta['filename']: (s.x, s.y) for s in samples} == res
+    assert sorted(op.seen) == ['other', 'same', 'same']
+
+def _random_samples(num=8, shape=(20, 30, 3), to_image=Image.fromarray, make_y=lambda i, rng: 1, # pylint: disable=R0913
+                    make_rng=random.Random):
+    """Return num training samples with random uint8 images of shape.
+
+    to_image converts the arrays, make_y(i, rng) returns the y of sample i and
+    make_rng(i) its random generator.
+    """
+    rng = np.random.RandomState(0)
+    return [Sample(to_image(rng.randint(0, 255, shape).astype('uint8')), make_y(i, rng),
+                   {'split': 'train'}, make_rng(i)) for i in range(num)]
+
+
 def _prepare_dir(tmpdir):
     for i in range(0, 10):
         path = tmpdir.join(f"file{i}.test")
@@ -402,7 +685,7 @@ class SourceTest(SourcePlugin):
 
         res = []
         for item, meta in items:
-            rng = random.Random(str(self.random_seed) + meta['filename'])
+            rng = self.sample_rng(meta['filename'])
             res.append(Sample(item, None, meta.copy(), rng))
 
         return res
@@ -416,9 +699,40 @@ class SourceTest(SourcePlugin):
         return super().hash(state + self.hash_files(self.files))
 
 
+class LabeledSourceTest(SourceTest): # pylint: disable=W0223
+    """Labels every file with class 0, except b.test which has class 1."""
+
+    def read_samples(self, split, index, n=1):
+        res = super().read_samples(split, index, n)
+        for sample in res:
+            sample.y = 1 if sample.meta['filename'] == 'b.test' else 0
+        return res
+
+
+class CountingOperation(OperationPlugin):
+    type = str
+    deterministic = True
+
+    def __init__(self):
+        super().__init__()
+        self.seen = []
+
+    def transform(self, data, rng):
+        self.seen.append(data)
+        return data + "-seen"
+
+
 @operation('append')
 class AppendStringOperation(OperationPlugin):
     type = str
 
     def transform(self, data, rng):
         return data + "-hello"
+
+
+@operation('append-random')
+class AppendRandomOperation(OperationPlugin):
+    type = str
+
+    def transform(self, data, rng):
+        return data + "-" + str(rng.randint(0, 1000000))
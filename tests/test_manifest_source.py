@@ -0,0 +1,72 @@
+"""
+Tests the manifest source.
+"""
+import json
+import os
+
+from PIL import Image
+
+from vergeml.sources import manifest
+from vergeml.sources.manifest import ManifestSource
+
+# pylint: disable=C0111
+
+def test_read_csv(tmpdir):
+    _prepare_images(tmpdir, 10)
+    rows = ["img{}.png,{}".format(i, "cat|dog" if i == 0 else ("cat" if i % 2 else "dog")) for i in range(10)]
+    tmpdir.join("manifest.csv").write("path,labels\n" + "\n".join(rows) + "\n")
+    src = ManifestSource(_args(tmpdir, val=1, test=1))
+    src.begin_read_samples()
+    assert list(src.meta['labels']) == ['cat', 'dog']
+    assert [src.num_samples(split) for split in ('train', 'val', 'test')] == [8, 1, 1]
+    samples = src.read_samples('train', 0, 8) + src.read_samples('val', 0) + src.read_samples('test', 0)
+    for sample in samples:
+        i = int(sample.meta['filename'][3:-4])
+        assert sample.x.getpixel((0, 0))[0] == i
+        assert sample.y.dtype == 'int32'
+        labels = [src.meta['labels'][label_id] for label_id in sample.y]
+        assert labels == (['cat', 'dog'] if i == 0 else (['cat'] if i % 2 else ['dog']))
+
+def test_read_jsonl_with_splits(tmpdir):
+    _prepare_images(tmpdir, 4)
+    entries = [dict(path="img0.png", labels="a"),
+               dict(path="img1.png", labels=["b"], split="val"),
+               dict(path="img2.png", labels="a", split="test"),
+               dict(path="img3.png", labels="b", split="train")]
+    tmpdir.join("manifest.jsonl").write("\n".join(map(json.dumps, entries)))
+    src = ManifestSource(_args(tmpdir))
+    src.begin_read_samples()
+    assert [src.num_samples(split) for split in ('train', 'val', 'test')] == [2, 1, 1]
+    assert src.read_samples('val', 0)[0].meta['filename'] == "img1.png"
+    assert src.transform(src.read_samples('test', 0)[0]).y.tolist() == [1., 0.]
+
+def test_split_column_with_only_train(tmpdir):
+    _prepare_images(tmpdir, 10)
+    rows = ["img{}.png,a,train".format(i) for i in range(10)]
+    tmpdir.join("manifest.csv").write("path,labels,split\n" + "\n".join(rows) + "\n")
+    src = ManifestSource(_args(tmpdir, val=2, test=2))
+    src.begin_read_samples()
+    assert [src.num_samples(split) for split in ('train', 'val', 'test')] == [10, 0, 0]
+
+def test_index_is_cached(tmpdir, monkeypatch):
+    _prepare_images(tmpdir, 2)
+    tmpdir.join("manifest.csv").write("path,labels\nimg0.png,a\nimg1.png,b\n")
+    ManifestSource(_args(tmpdir)).begin_read_samples()
+    assert len(os.listdir(str(tmpdir.join(".cache")))) == 1
+
+    def _fail(path):
+        raise AssertionError("manifest parsed again")
+    monkeypatch.setattr(manifest, '_parse_manifest', _fail)
+
+    src = ManifestSource(_args(tmpdir))
+    src.begin_read_samples()
+    assert list(src.meta['labels']) == ['a', 'b']
+    assert src.num_samples('train') == 2
+
+def _args(tmpdir, val=0, test=0):
+    return {'samples-dir': str(tmpdir), 'cache-dir': str(tmpdir.join(".cache")),
+            'val-split': val, 'test-split': test}
+
+def _prepare_images(tmpdir, num):
+    for i in range(num):
+        Image.new('RGB', (2, 2), (i, 0, 0)).save(str(tmpdir.join("img{}.png".format(i))))
@@ -0,0 +1,122 @@
+"""
+Tests the MNIST source.
+"""
+import gzip
+import os
+import struct
+
+import numpy as np
+
+from vergeml.data import Data
+from vergeml.loader import LiveLoader
+from vergeml.sources import mnist
+from vergeml.sources.mnist import InputMnist
+
+# pylint: disable=C0111
+
+def _write_idx(samples_dir, name, rng, num):
+    images = rng.randint(0, 256, (num, 4, 5)).astype('uint8')
+    labels = rng.randint(0, 10, num).astype('uint8')
+
+    with gzip.open(str(samples_dir.join(name + "-images-idx3-ubyte.gz")), "wb") as file:
+        file.write(struct.pack('>IIII', 2051, num, 4, 5) + images.tobytes())
+
+    with gzip.open(str(samples_dir.join(name + "-labels-idx1-ubyte.gz")), "wb") as file:
+        file.write(struct.pack('>II', 2049, num) + labels.tobytes())
+
+    return images, labels
+
+def _prepare_dir(tmpdir):
+    rng = np.random.RandomState(0)
+    samples_dir = tmpdir.mkdir('samples')
+    train = _write_idx(samples_dir, "train", rng, 30)
+    test = _write_idx(samples_dir, "t10k", rng, 10)
+    return str(samples_dir), str(tmpdir.join('.cache')), train, test
+
+def _source(samples_dir, cache_dir, **args):
+    args.update({'samples-dir': samples_dir, 'cache-dir': cache_dir})
+    return InputMnist(args)
+
+def test_images_are_decompressed_once(tmpdir, monkeypatch):
+    samples_dir, cache_dir, (images, _), _ = _prepare_dir(tmpdir)
+    src = _source(samples_dir, cache_dir)
+    src.begin_read_samples()
+
+    assert len(os.listdir(cache_dir)) == 2
+    assert isinstance(src.arrays['train'][0], np.memmap)
+    assert np.array_equal(src.arrays['train'][0], images)
+
+    # the decompressed files are reused
+    def _fail(*args):
+        raise AssertionError("decompressed again")
+    monkeypatch.setattr(mnist.os, 'replace', _fail)
+
+    src = _source(samples_dir, cache_dir)
+    src.begin_read_samples()
+    assert np.array_equal(src.arrays['train'][0], images)
+
+def test_split_indices(tmpdir):
+    samples_dir, cache_dir, _, _ = _prepare_dir(tmpdir)
+    src = _source(samples_dir, cache_dir, **{'val-split': 5, 'test-split': 3})
+    src.begin_read_samples()
+
+    assert [src.num_samples(split) for split in ('train', 'val', 'test')] == [25, 5, 3]
+    assert src.indices['val'][0] == 'train' and src.indices['test'][0] == 'test'
+    train, val = src.indices['train'][1], src.indices['val'][1]
+    assert sorted(np.concatenate([train, val]).tolist()) == list(range(30))
+
+    src = _source(samples_dir, cache_dir, **{'val-split': '0%', 'test-split': '10%'})
+    src.begin_read_samples()
+    assert [src.num_samples(split) for split in ('train', 'val', 'test')] == [30, 0, 10]
+
+def test_read_arrays(tmpdir):
+    samples_dir, cache_dir, (images, labels), _ = _prepare_dir(tmpdir)
+    src = _source(samples_dir, cache_dir, **{'val-split': 5})
+    src.begin_read_samples()
+
+    xs, ys = src.read_arrays('train', 2, 4)
+    ixs = src.indices['train'][1][2:6]
+    assert xs.shape == (4, 4, 5) and xs.dtype == np.uint8
+    assert ys.dtype == np.int32
+    assert np.array_equal(xs, images[ixs]) and np.array_equal(ys, labels[ixs])
+
+    samples = src.read_samples('train', 2, 4)
+    assert [sample.meta['index'] for sample in samples] == ixs.tolist()
+    assert [sample.y for sample in samples] == labels[ixs].tolist()
+
+def test_sample_labels(tmpdir):
+    samples_dir, cache_dir, _, (_, labels) = _prepare_dir(tmpdir)
+    src = _source(samples_dir, cache_dir, **{'test-split': 4})
+    src.begin_read_samples()
+
+    ids, offsets = src.sample_labels('test')
+    assert np.array_equal(ids, labels[src.indices['test'][1]])
+    assert offsets.tolist() == list(range(5))
+
+def test_load_arrays_without_samples(tmpdir, monkeypatch):
+    samples_dir, cache_dir, _, _ = _prepare_dir(tmpdir)
+    src = _source(samples_dir, cache_dir, **{'val-split': 5})
+    data = Data(input=src, output=src, cache_dir=cache_dir, cache_input=False)
+    expected = data.load('train', layout='arrays', with_meta=True)[:2]
+
+    # without operations, the arrays are read without creating samples
+    def _fail(*args):
+        raise AssertionError("samples created")
+    monkeypatch.setattr(LiveLoader, 'read_samples', _fail)
+
+    xs, ys = data.load('train', layout='arrays')
+    assert np.array_equal(xs, expected[0])
+    assert np.array_equal(ys, expected[1]) and ys.shape == (25, 10)
+
+    # so do the list layouts
+    tuples = data.load('train')
+    assert np.array_equal(np.array([x for x, _ in tuples]), expected[0])
+    assert np.array_equal(np.array([y for _, y in tuples]), expected[1])
+
+def test_hash_changes_with_files(tmpdir):
+    samples_dir, cache_dir, _, _ = _prepare_dir(tmpdir)
+    hash_value = _source(samples_dir, cache_dir).hash("abc")
+    assert _source(samples_dir, cache_dir).hash("abc") == hash_value
+
+    _write_idx(tmpdir.join('samples'), "t10k", np.random.RandomState(1), 12)
+    assert _source(samples_dir, cache_dir).hash("abc") != hash_value
@@ -1,7 +1,10 @@
 """Test Utitlity function
 """
+import zipfile
+
 from vergeml.utils import dict_set_path, dict_get_path, dict_del_path, dict_has_path
 from vergeml.utils import dict_merge, dict_paths, parse_trained_models
+from vergeml.utils import file_state, zip_data_offset
 
 # pylint: disable=C0111
 
@@ -68,3 +71,25 @@ def test_parse_trained_model():
                          (["touchy-automaton", "evil-skynet"], ["run", "tensorboard"])
     assert parse_trained_models(["train", "--epochs=20"]) == \
                          ([], ["train", "--epochs=20"])
+
+def test_file_state(tmpdir):
+    path = str(tmpdir.join("file"))
+    with open(path, "w") as file:
+        file.write("abc")
+    state = file_state(path)
+    assert file_state(path) == state
+
+    with open(path, "a") as file:
+        file.write("d")
+    assert file_state(path) != state
+
+def test_zip_data_offset(tmpdir):
+    path = str(tmpdir.join("archive.zip"))
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("a.txt", b"first")
+        archive.writestr("dir/b.txt", b"second")
+
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for info, data in zip(archive.infolist(), (b"first", b"second")):
+            file.seek(zip_data_offset(file, info.header_offset))
+            assert file.read(info.compress_size) == data
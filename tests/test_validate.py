@@ -72,6 +72,42 @@ def test_validate_preprocess():
     }
 
 
+def test_validate_fuse_ops():
+    assert parse_data({'fuse-ops': False}) == {
+        'cache': 'auto',
+        'fuse-ops': False,
+        'preprocess': []
+    }
+
+    with pytest.raises(VergeMLError, match=r".*fuse-ops.*"):
+        parse_data({'fuse-ops': 'no'})
+
+
+def test_validate_rng():
+    assert parse_data({'rng': 'counter'}) == {
+        'cache': 'auto',
+        'rng': 'counter',
+        'preprocess': []
+    }
+
+    with pytest.raises(VergeMLError, match=r".*data\.rng.*"):
+        parse_data({'rng': 'counte'})
+
+
+def test_validate_cache_dtypes():
+    assert parse_data({'cache-dtypes': {'x': 'float16', 'y': 'class-ids'}}) == {
+        'cache': 'auto',
+        'cache-dtypes': {'x': 'float16', 'y': 'class-ids'},
+        'preprocess': []
+    }
+
+    with pytest.raises(VergeMLError, match=r".*cache-dtypes\.x.*"):
+        parse_data({'cache-dtypes': {'x': 'float15'}})
+
+    with pytest.raises(VergeMLError, match=r".*cache-dtypes\.z.*"):
+        parse_data({'cache-dtypes': {'z': 'float16'}})
+
+
 def test_validate_preprocess_invalid():
     plugins = _DictPluginManager()
     plugins.set('vergeml.operation', 'augment', AugmentOperation)
@@ -5,7 +5,10 @@ Tests views.
 import random
 import itertools
 
-from vergeml.views import IteratorView
+import numpy as np
+import pytest
+
+from vergeml.views import IteratorView, BatchView
 from vergeml.loader import LiveLoader
 from vergeml.io import SourcePlugin, source, Sample
 
@@ -68,6 +71,179 @@ def test_iterview_random2():
     assert list(map(lambda tp: tp[0], itertools.islice(iterview2, 10))) \
         != list(map(lambda tp: tp[0], itertools.islice(iterview, 10)))
 
+def test_iterview_repeats():
+    loader = LiveLoader('.cache', LabeledSourceTest())
+    iterview = IteratorView(loader, 'val')
+    assert len(iterview) == 13
+    assert list(map(lambda tp: tp[0], iterview)) == [0, 0, 1, 2, 3, 4, 4, 5, 6, 7, 8, 8, 9]
+
+def test_iterview_balanced_sampler():
+    loader = LiveLoader('.cache', LabeledSourceTest())
+    iterview = IteratorView(loader, 'train', sampler='balanced', infinite=True)
+    items = [tp[0] for tp in itertools.islice(iterview, 4000)]
+    assert 0.45 < np.mean([item % 4 == 0 for item in items]) < 0.55
+
+def test_iterview_weighted_sampler():
+    loader = LiveLoader('.cache', LabeledSourceTest())
+    iterview = IteratorView(loader, 'train', sampler='weighted', label_weights={'rare': 3.}, infinite=True)
+    items = [tp[0] for tp in itertools.islice(iterview, 4000)]
+    assert 0.45 < np.mean([item % 4 == 0 for item in items]) < 0.55
+
+def test_batchview_stratified_sampler():
+    loader = LiveLoader('.cache', LabeledSourceTest())
+    batchview = BatchView(loader, 'train', batch_size=20, sampler='stratified')
+    batches = list(batchview)
+    assert len(batches) == 5
+    items = [x for batch in batches for x, _ in batch]
+    assert sorted(items) == list(range(100))
+    for batch in batches:
+        assert 4 <= len([x for x, _ in batch if x % 4 == 0]) <= 6
+
+def test_stratified_sampler_without_labels():
+    loader = LiveLoader('.cache', UnlabeledSourceTest())
+    batchview = BatchView(loader, 'train', batch_size=20, sampler='stratified')
+    items = [x for batch in batchview for x, _ in batch]
+    assert sorted(items) == list(range(100))
+
+
+def test_batchview_random_fetch_size():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', batch_size=16, fetch_size=8, randomize=True)
+    batches = list(batchview)
+    assert len(batches) == 6
+    for batch in batches:
+        items = [x for x, _ in batch]
+        assert len(items) == 16
+        # samples are fetched in runs of consecutive samples
+        assert sum(b - a != 1 for a, b in zip(items, items[1:])) <= 2
+
+def test_batchview_shuffle_sample():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', batch_size=20, randomize=True, shuffle='sample')
+    items = [x for batch in batchview for x, _ in batch]
+    assert sorted(items) == list(range(100))
+    assert sum(b - a == 1 for a, b in zip(items, items[1:])) < 10
+
+def test_iterview_shuffle_sample():
+    loader = LiveLoader('.cache', SourceTest())
+    iterview = IteratorView(loader, 'train', randomize=True, fetch_size=10, shuffle='sample')
+    items = [x for x, _ in iterview]
+    assert sorted(items) == list(range(100))
+    assert items != list(range(100))
+
+
+def test_batchview_shuffle_buffer():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', batch_size=10, fetch_size=5, randomize=True,
+                          shuffle='buffer', window_size=20, buffer_size=30, infinite=True)
+    items = [x for batch in itertools.islice(batchview, 100) for x, _ in batch]
+    assert items[:10] != list(range(10))
+    assert 8 <= min(np.bincount(items)) and max(np.bincount(items)) <= 12
+    # the buffer only holds samples of nearby windows
+    assert len(set(x // 20 for x in items[:10])) <= 2
+
+def test_iterview_shuffle_buffer():
+    loader = LiveLoader('.cache', SourceTest())
+    iterview = IteratorView(loader, 'train', randomize=True, shuffle='buffer',
+                            window_size=10, buffer_size=10)
+    items = [x for x, _ in iterview]
+    assert len(items) == 100
+    assert items != list(range(100))
+
+
+def test_batchview_arrays():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', layout='arrays', batch_size=10, with_meta=True,
+                          transform_x=lambda x: np.full((2, 2), x, dtype='float32'))
+    xs, ys, meta = next(batchview)
+    assert xs.shape == (10, 2, 2) and xs.dtype == np.float32
+    assert xs[:, 0, 0].tolist() == list(range(10))
+    assert ys.tolist() == list(range(5, 15))
+    assert meta[3] == {'meta': 3}
+
+def test_batchview_arrays_batch_buffers():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', layout='arrays', batch_size=10, batch_buffers=2)
+    batches = list(batchview)
+    assert batches[0][0] is batches[2][0]
+    assert batches[0][0] is not batches[1][0]
+    assert batches[9][0].tolist() == list(range(90, 100))
+
+def test_batchview_arrays_fallback():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', layout='arrays', batch_size=3, transform_y=str)
+    xs, ys = next(batchview)
+    assert xs.tolist() == [0, 1, 2]
+    assert ys.tolist() == ['5', '6', '7']
+
+
+def test_iterview_fetch_size():
+    src = SourceTest()
+    reads = []
+    read_samples = src.read_samples
+    src.read_samples = lambda split, index, n=1: reads.append(n) or read_samples(split, index, n)
+    loader = LiveLoader('.cache', src)
+    iterview = IteratorView(loader, 'train', fetch_size=10)
+    assert [x for x, _ in iterview] == list(range(100))
+    assert set(reads) == {10}
+
+def test_views_independent_pumps():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', batch_size=10, randomize=True)
+    iterview = IteratorView(loader, 'train')
+    iterview2 = IteratorView(loader, 'train', randomize=True)
+    batch = next(batchview)
+    assert [x for x, _ in itertools.islice(iterview, 5)] == list(range(5))
+    assert sorted(x for x, _ in iterview2) == list(range(100))
+    assert len(next(batchview)) == len(batch)
+    assert [s.x for s in loader.read_samples('train', 0, 3)] == [0, 1, 2]
+
+def test_views_stop_pump():
+    loader = LiveLoader('.cache', SourceTest())
+    iterview = IteratorView(loader, 'train')
+    pump = loader.pumps[iterview.pump]
+    del iterview
+    assert not loader.pumps
+    pump.join(5)
+    assert not pump.is_alive()
+
+
+def test_batchview_transform_batch():
+    loader = LiveLoader('.cache', SourceTest())
+    for layout in ('tuples', 'lists', 'arrays'):
+        batchview = BatchView(loader, 'train', layout=layout, batch_size=10,
+                              transform_batch_x=lambda xs: [x * 2 for x in xs],
+                              transform_batch_y=lambda ys: np.asarray(ys) - 5)
+        batch = next(batchview)
+        if layout == 'tuples':
+            batch = tuple(map(list, zip(*batch)))
+        assert list(batch[0]) == list(range(0, 20, 2))
+        assert list(batch[1]) == list(range(10))
+
+def test_batchview_tuples_without_transform_batch():
+    loader = LiveLoader('.cache', SourceTest())
+    batch = next(BatchView(loader, 'train', batch_size=10, with_meta=True))
+    assert batch == [(i, i + 5, {'meta': i}) for i in range(10)]
+
+def test_batchview_transform_on_pump():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', layout='arrays', batch_size=10, with_meta=True,
+                          transform_on_pump=True, batch_buffers=1,
+                          transform_batch_x=lambda xs: xs / 100.)
+    items = []
+    for xs, ys, meta in batchview:
+        # reused buffers stay valid until the consumer has copied them
+        assert [m['meta'] for m in meta] == (ys - 5).tolist()
+        items.extend(xs.tolist())
+    assert items == [i / 100. for i in range(100)]
+
+def test_batchview_transform_on_pump_error():
+    loader = LiveLoader('.cache', SourceTest())
+    batchview = BatchView(loader, 'train', batch_size=10, transform_on_pump=True,
+                          transform_batch_x=lambda xs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        next(batchview)
+
 
 @source('test-source', 'A test source.') # pylint: disable=W0223
 class SourceTest(SourcePlugin):
@@ -87,3 +263,31 @@ class SourceTest(SourcePlugin):
         items = self.data[split][index: index+n]
         return [Sample(item, item+5, {'meta': item}, random.Random(self.random_seed + item))
                 for item in items]
+
+
+class LabeledSourceTest(SourceTest):
+    """Every fourth sample is labeled 'rare', the other samples 'common'."""
+
+    def __init__(self, args=None):
+        super().__init__(args)
+        self.meta['labels'] = ['common', 'rare']
+
+    def sample_labels(self, split):
+        ids = np.array([int(item % 4 == 0) for item in self.data[split]], dtype='int32')
+        return ids, np.arange(len(ids) + 1)
+
+    def sample_repeats(self, split):
+        if split != 'val':
+            return None
+        return np.array([2 if item % 4 == 0 else 1 for item in self.data[split]])
+
+
+class UnlabeledSourceTest(SourceTest):
+    """A source with labels, none of which is assigned to a sample."""
+
+    def __init__(self, args=None):
+        super().__init__(args)
+        self.meta['labels'] = ['common', 'rare']
+
+    def sample_labels(self, split):
+        return np.zeros(0, dtype='int32'), np.zeros(len(self.data[split]) + 1, dtype='int64')
@@ -91,7 +91,7 @@ def _prepare_args(args):
                                "--random-seed must be an integer value.",
                                ('value', 'random-seed'))
 
-    cache_opts = ('none', 'disk', 'mem', 'disk-in', 'mem-in')
+    cache_opts = ('none', 'disk', 'mem', 'disk-in', 'mem-in', 'hybrid', 'pyramid')
 
     if 'cache' in args:
         if args['cache'] not in cache_opts:
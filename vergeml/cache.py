@@ -6,6 +6,9 @@ import struct
 import pickle
 import mmap
 import io
+import hashlib
+import fnmatch
+from collections.abc import Mapping, MutableMapping
 import numpy as np
 import lz4.frame
 
@@ -25,6 +28,11 @@ class Cache:
         """
         raise NotImplementedError
 
+    def link(self, index, meta):
+        """Add an entry with metadata meta sharing the data of the entry at index.
+        """
+        raise NotImplementedError
+
 class MemoryCache(Cache):
     """Cache samples in memory.
     """
@@ -41,6 +49,321 @@ class MemoryCache(Cache):
     def read(self, index, n_samples):
         return self.data[index:index+n_samples]
 
+    def link(self, index, meta):
+        self.data.append((self.data[index][0], meta))
+
+class _Missing: # pylint: disable=R0903
+    """Marks a key missing from the metadata of a sample."""
+
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self):
+        return '_MISSING'
+
+_MISSING = _Missing()
+
+# The kinds of columns of a MetaStore.
+_STR, _INT, _OBJECT = range(3)
+
+# strings are stored as codes into a list of interned strings, -1 when missing
+_COLUMN_DTYPES = {_STR: np.int32, _INT: np.int64}
+
+class MetaStore:
+    """Store the metadata dicts of samples column by column.
+
+    Strings are interned and stored as int32 codes and ints as int64 arrays. Other
+    values are kept in lists. Indexing returns a SampleMeta, which only decodes
+    the fields which are accessed. query() finds samples by their metadata without
+    decoding it.
+    """
+
+    def __init__(self, metas=()):
+        """
+        :param metas: an iterable of dicts (or None) to append
+        """
+        self.size = 0
+
+        # entries which are None instead of a dict
+        self.nones = []
+
+        # the kind (_STR, _INT or _OBJECT) and values of each key
+        self.kinds = {}
+        self.columns = {}
+
+        # the interned strings of _STR columns
+        self.strings = {}
+        self._codes = {}
+
+        for meta in metas:
+            self.append(meta)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if not -self.size <= index < self.size:
+            raise IndexError("MetaStore index out of range")
+        index = index % self.size
+        return None if index in self._none_set() else SampleMeta(self, index)
+
+    def __iter__(self):
+        return (self[i] for i in range(self.size))
+
+    def __getstate__(self):
+        self._pack()
+        return {k: v for k, v in self.__dict__.items() if k not in ('_codes', '_nones')}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._codes = {}
+
+    def append(self, meta):
+        """Append the metadata dict meta, or None."""
+        self._unpack()
+
+        if meta is None:
+            self.nones.append(self.size)
+            meta = {}
+
+        for key in self.columns.keys() - meta.keys():
+            self._append_value(key, _MISSING)
+
+        for key, value in meta.items():
+            if key not in self.columns:
+                self._add_column(key, value)
+            self._append_value(key, value)
+
+        self.size += 1
+
+    def get(self, index, key, default=None):
+        """Return the value of key in the metadata at index, or default."""
+        if key not in self.columns:
+            return default
+
+        kind, value = self.kinds[key], self.columns[key][index]
+
+        if kind == _STR:
+            value = self.strings[key][value] if value >= 0 else _MISSING
+        elif kind == _INT:
+            value = int(value)
+
+        return default if value is _MISSING else value
+
+    def keys(self, index):
+        """Return the keys of the metadata at index."""
+        return [key for key in self.columns if self.get(index, key, _MISSING) is not _MISSING]
+
+    def column(self, key) -> np.ndarray:
+        """Return the values of key for all samples as an array, with None for missing values."""
+        if key not in self.columns:
+            return np.full(self.size, None, dtype=object)
+
+        kind, values = self.kinds[key], self.columns[key]
+
+        if kind == _INT:
+            return np.array(values, dtype=np.int64)
+
+        if kind == _STR:
+            strings = np.array(self.strings[key] + [None], dtype=object)
+            return strings[np.asarray(values, dtype=np.int64)]
+
+        res = np.empty(self.size, dtype=object)
+        res[:] = [None if v is _MISSING else v for v in self.columns[key]]
+        return res
+
+    def query(self, **conditions) -> np.ndarray:
+        """Return the indices of the samples whose metadata matches all conditions.
+
+        A condition maps a key to a value, a list of values, or a function returning
+        True for matching values. String values are glob patterns, for example
+
+            store.query(split='train', filename='cats/*.jpg')
+        """
+        mask = np.ones(self.size, dtype=bool)
+
+        for key, cond in conditions.items():
+            mask &= self._match(key, cond)
+
+        return np.flatnonzero(mask)
+
+    def take(self, indices) -> 'MetaStore':
+        """Return a MetaStore with the metadata at indices."""
+        res = MetaStore()
+        res.size = len(indices)
+        res.kinds = dict(self.kinds)
+        res.strings = {k: list(v) for k, v in self.strings.items()}
+        nones = self._none_set()
+        res.nones = [i for i, index in enumerate(indices) if index in nones]
+
+        for key, values in self.columns.items():
+            if self.kinds[key] == _OBJECT:
+                res.columns[key] = [values[i] for i in indices]
+            else:
+                res.columns[key] = np.asarray(values, dtype=_COLUMN_DTYPES[self.kinds[key]])[indices]
+
+        return res
+
+    def _match(self, key, cond):
+        if key not in self.columns:
+            return np.zeros(self.size, dtype=bool)
+
+        kind, values = self.kinds[key], self.columns[key]
+
+        if kind == _STR:
+            # match each distinct string once
+            codes = [code for code, string in enumerate(self.strings[key]) if _matches(string, cond)]
+            return np.isin(np.asarray(values), codes)
+
+        if kind == _INT and not callable(cond):
+            conds = cond if isinstance(cond, (list, tuple, set)) else [cond]
+            return np.isin(np.asarray(values), [c for c in conds if isinstance(c, int)])
+
+        values = values.tolist() if isinstance(values, np.ndarray) else values
+        return np.array([value is not _MISSING and _matches(value, cond) for value in values], dtype=bool)
+
+    def _add_column(self, key, value):
+        if isinstance(value, str):
+            self.kinds[key], self.strings[key], self._codes[key] = _STR, [], {}
+            self.columns[key] = [-1] * self.size
+        elif isinstance(value, int) and not isinstance(value, bool) and not self.size:
+            self.kinds[key], self.columns[key] = _INT, []
+        else:
+            self.kinds[key], self.columns[key] = _OBJECT, [_MISSING] * self.size
+
+    def _append_value(self, key, value):
+        kind = self.kinds[key]
+
+        if kind == _STR and (isinstance(value, str) or value is _MISSING):
+            self.columns[key].append(self._intern(key, value) if value is not _MISSING else -1)
+        elif kind == _INT and isinstance(value, int) and not isinstance(value, bool):
+            self.columns[key].append(value)
+        else:
+            # the value doesn't fit the column, store all values as objects
+            if kind != _OBJECT:
+                self.columns[key] = [self.get(i, key, _MISSING) for i in range(len(self.columns[key]))]
+                self.kinds[key] = _OBJECT
+            self.columns[key].append(value)
+
+    def _intern(self, key, string):
+        codes = self._codes.setdefault(key, {})
+
+        if not codes and self.strings[key]:
+            codes.update((s, i) for i, s in enumerate(self.strings[key]))
+
+        if string not in codes:
+            codes[string] = len(self.strings[key])
+            self.strings[key].append(string)
+
+        return codes[string]
+
+    def _none_set(self):
+        if getattr(self, '_nones', None) is None or len(self._nones) != len(self.nones):
+            self._nones = set(self.nones)
+        return self._nones
+
+    def _pack(self):
+        """Convert the columns of strings and ints to compact arrays."""
+        for key, values in self.columns.items():
+            if isinstance(values, list) and self.kinds[key] in _COLUMN_DTYPES:
+                self.columns[key] = np.array(values, dtype=_COLUMN_DTYPES[self.kinds[key]])
+
+    def _unpack(self):
+        for key, values in self.columns.items():
+            if isinstance(values, np.ndarray):
+                self.columns[key] = values.tolist()
+
+def _matches(value, cond):
+    if callable(cond):
+        return bool(cond(value))
+    if isinstance(cond, (list, tuple, set)):
+        return any(_matches(value, c) for c in cond)
+    if isinstance(cond, str) and isinstance(value, str):
+        return fnmatch.fnmatchcase(value, cond)
+    return value == cond
+
+class SampleMeta(MutableMapping):
+    """The metadata of a sample in a MetaStore.
+
+    Values are read from the store when accessed. Changes are kept in the SampleMeta
+    object and don't change the store.
+    """
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.changes = {}
+
+    def __getitem__(self, key):
+        if key in self.changes:
+            value = self.changes[key]
+        else:
+            value = self.store.get(self.index, key, _MISSING)
+
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def __delitem__(self, key):
+        self[key] # pylint: disable=W0104
+        self.changes[key] = _MISSING
+
+    def __iter__(self):
+        keys = self.store.keys(self.index) + [k for k in self.changes if k not in self.store.columns]
+        return (k for k in keys if self.changes.get(k) is not _MISSING)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def copy(self):
+        """Return the metadata as a dict."""
+        return dict(self)
+
+class _CacheMeta:
+    """The metadata entries of a cache file.
+
+    Entries are lists like (meta, rng) or None. The meta dicts of the entries are
+    stored in a MetaStore and the remaining values in a list.
+    """
+
+    def __init__(self):
+        self.store = MetaStore()
+        self.rest = []
+
+    def __len__(self):
+        return len(self.rest)
+
+    def __getitem__(self, index):
+        entry = self.rest[index]
+
+        if not isinstance(entry, tuple) or entry[:1] != (Ellipsis,):
+            return entry
+
+        meta = self.store[index % len(self.rest)]
+        return (meta,) + entry[1:]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def append(self, entry):
+        """Append the metadata entry."""
+        if isinstance(entry, tuple) and entry and isinstance(entry[0], Mapping):
+            self.store.append(entry[0])
+            entry = (Ellipsis,) + entry[1:]
+        else:
+            self.store.append(None)
+
+        self.rest.append(entry)
+
 class _CacheFileContent:
 
     def __init__(self):
@@ -49,7 +372,7 @@ class _CacheFileContent:
         self.index = []
 
         # Sample metadata.
-        self.meta = []
+        self.meta = _CacheMeta()
 
         # Info (Used to store data types)
         self.info = None
@@ -77,7 +400,12 @@ class FileCache(Cache):
     """Cache raw bytes in a mmapped file.
     """
 
-    def __init__(self, path, mode):
+    def __init__(self, path, mode, dedup=False):
+        """
+        :param path: path of the cache file
+        :param mode: "r" or "w"
+        :param dedup: when writing, store identical data only once
+        """
         assert mode in ("r", "w")
 
         self.path = path
@@ -86,6 +414,9 @@ class FileCache(Cache):
         self.mode = mode
         self.cnt = _CacheFileContent()
 
+        # maps the digest of data already written to its position in the file
+        self.extents = {} if dedup and mode == "w" else None
+
         if mode == "r":
             # Read the last part of the file which contains the contents of the
             # cache.
@@ -103,22 +434,50 @@ class FileCache(Cache):
     def write(self, data, meta):
         assert self.mode == "w"
 
-        pos = self.file.tell()
-        entry = (pos, pos + len(data))
+        entry = None
+
+        if self.extents is not None:
+            # when the same data was written before, point to it instead
+            digest = hashlib.md5(data).digest()
+            entry = self.extents.get(digest)
+
+        if entry is None:
+            pos = self.file.tell()
+            entry = (pos, pos + len(data))
+            self.file.write(data)
+
+            if self.extents is not None:
+                self.extents[digest] = entry
 
         # write position and metadata of the data to the content index
         self.cnt.index.append(entry)
         self.cnt.meta.append(meta)
-        self.file.write(data)
+
+    def link(self, index, meta):
+        assert self.mode == "w"
+
+        self.cnt.index.append(self.cnt.index[index])
+        self.cnt.meta.append(meta)
 
     def read(self, index, n_samples):
         assert self.mode == "r"
 
         c_ix = self.cnt.index
+        entries = c_ix[index:index+n_samples]
 
         # get the absolute start and end adresses of the whole chunk
-        abs_start, _ = c_ix[index]
-        _, abs_end = c_ix[index+n_samples-1]
+        abs_start, _ = entries[0]
+        _, abs_end = entries[-1]
+
+        if any(entries[i][1] != entries[i+1][0] for i in range(len(entries) - 1)):
+            # the entries are not stored consecutively because the data was deduplicated
+            abs_start = min(start for start, _ in entries)
+            abs_end = max(end for _, end in entries)
+
+            if abs_end - abs_start > sum(end - start for start, end in entries):
+                # avoid reading unrelated data in between
+                return [(memoryview(self.mmfile[start:end]), self.cnt.meta[index+i])
+                        for i, (start, end) in enumerate(entries)]
 
         # read the bytes and wrap in memory view to avoid copying
         chunk = memoryview(self.mmfile[abs_start:abs_end])
@@ -152,25 +511,114 @@ class FileCache(Cache):
 # raw bytes, numpy format or python pickle.
 _BYTES, _NUMPY, _PICKLE = range(3)
 
+# Numpy arrays stored with a smaller dtype, see STORAGE_DTYPES.
+_UINT8, _FLOAT16, _INT8, _CLASS_IDS = range(3, 7)
+
+# The dtypes numpy arrays can be stored with:
+#
+# - uint8: arrays holding whole numbers from 0 to 255, e.g. images (lossless)
+# - float16: floating point arrays at half precision
+# - int8: floating point arrays quantized to 255 steps between -max and max
+# - class-ids: one-hot vectors stored as the id of the class (lossless)
+#
+# Arrays which don't fit the dtype are stored unchanged.
+STORAGE_DTYPES = ('uint8', 'float16', 'int8', 'class-ids')
+
+# The original dtype and a parameter (scale or number of classes) of an encoded array.
+_ARRAY_HEADER = struct.Struct('<8sd')
+
+def _encode_array(arr, dtype):
+    """Encode arr with the storage dtype, or return None when it does not fit arr.
+    """
+    param = 0.
+
+    if not arr.size or arr.dtype.kind not in 'uif':
+        return None
+
+    if dtype == 'uint8':
+        if arr.dtype == np.uint8 or arr.min() < 0 or arr.max() > 255 \
+                or not np.array_equal(np.rint(arr), arr):
+            return None
+        type_, enc = _UINT8, arr.astype(np.uint8)
+
+    elif dtype in ('float16', 'int8'):
+        # only floating point arrays within the range of float16 are stored with less precision
+        if arr.dtype.kind != 'f' or arr.dtype.itemsize <= 2:
+            return None
+
+        maxabs = float(np.abs(arr).max())
+
+        if not maxabs <= np.finfo(np.float16).max:
+            return None
+
+        if dtype == 'float16':
+            type_, enc = _FLOAT16, arr.astype(np.float16)
+        else:
+            param = maxabs / 127. or 1.
+            type_, enc = _INT8, np.rint(arr / param).astype(np.int8)
+
+    elif dtype == 'class-ids':
+        if arr.ndim != 1 or np.count_nonzero(arr) != 1 or arr.max() != 1:
+            return None
+        header = _ARRAY_HEADER.pack(arr.dtype.str.encode(), len(arr))
+        return _CLASS_IDS, header + struct.pack('<Q', int(np.argmax(arr)))
+
+    else:
+        return None
+
+    buf = io.BytesIO()
+    buf.write(_ARRAY_HEADER.pack(arr.dtype.str.encode(), param))
+    np.save(buf, enc)
+    return type_, buf.getvalue()
+
+def _decode_array(data, type_):
+    """Decode an array encoded by _encode_array() to its original dtype.
+    """
+    dtype, param = _ARRAY_HEADER.unpack_from(data)
+    dtype = np.dtype(dtype.rstrip(b'\0').decode())
+    data = data[_ARRAY_HEADER.size:]
+
+    if type_ == _CLASS_IDS:
+        res = np.zeros(int(param), dtype=dtype)
+        res[struct.unpack('<Q', data)[0]] = 1
+        return res
+
+    arr = np.load(io.BytesIO(data)).astype(dtype)
+
+    if type_ == _INT8:
+        arr *= dtype.type(param)
+
+    return arr
+
 class SerializedFileCache(FileCache):
     """Cache serialized objects in a mmapped file.
     """
 
-    def __init__(self, path, mode, compress=True):
+    def __init__(self, path, mode, compress=True, dedup=False, dtypes=None): # pylint: disable=R0913
         """Create an optionally compressed serialized cache.
+
+        :param dtypes: when writing, a tuple (x, y) of the storage dtypes of numpy
+                       arrays (see STORAGE_DTYPES) or None to store arrays unchanged.
+                       Single items are stored like x.
         """
-        super().__init__(path, mode)
+        super().__init__(path, mode, dedup)
 
         # we use info to store type information
         self.cnt.info = self.cnt.info or []
         self.compress = compress
+        self.dtypes = dtypes or (None, None)
 
-    def _serialize_data(self, data):
+    def _serialize_data(self, data, dtype=None):
 
         # Default to raw bytes
         type_ = _BYTES
+        encoded = _encode_array(data, dtype) if dtype and isinstance(data, np.ndarray) else None
+
+        if encoded:
+        # Store the array with a smaller dtype
+            type_, data = encoded
 
-        if isinstance(data, np.ndarray):
+        elif isinstance(data, np.ndarray):
         # When the data is a numpy array, use the more compact native
         # numpy format.
             buf = io.BytesIO()
@@ -204,6 +652,10 @@ class SerializedFileCache(FileCache):
         # deserialize other python objects
             data = pickle.loads(data)
 
+        elif type_ in (_UINT8, _FLOAT16, _INT8, _CLASS_IDS):
+        # expand arrays stored with a smaller dtype
+            data = _decode_array(data, type_)
+
         else:
         # Otherwise we just return data as it is (bytes)
             pass
@@ -216,8 +668,8 @@ class SerializedFileCache(FileCache):
             # write (x,y) pairs
 
             # serialize independent from each other
-            type1, data1 = self._serialize_data(data[0])
-            type2, data2 = self._serialize_data(data[1])
+            type1, data1 = self._serialize_data(data[0], self.dtypes[0])
+            type2, data2 = self._serialize_data(data[1], self.dtypes[1])
 
             pos = len(data1)
             data = io.BytesIO()
@@ -234,11 +686,15 @@ class SerializedFileCache(FileCache):
             type_ = (type1, type2)
 
         else:
-            type_, data = self._serialize_data(data)
+            type_, data = self._serialize_data(data, self.dtypes[0])
 
         super().write(data, meta)
         self.cnt.info.append(type_)
 
+    def link(self, index, meta):
+        super().link(index, meta)
+        self.cnt.info.append(self.cnt.info[index])
+
     def read(self, index, n_samples):
 
         # get the entries as raw bytes from the superclass implementation
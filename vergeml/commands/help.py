@@ -69,8 +69,26 @@ mem:         Cache sample data in memory (default).
 mem-out:     Cache data in memory after preprocessing.
 disk:        Cache data on disk in a format optimized for fast access.
 disk-out:    Cache data on disk after preprocessing.
+hybrid:      Cache data on disk after the leading preprocessing steps which don't use
+             random numbers and run the remaining steps live.
+pyramid:     Cache images on disk together with downscaled copies. Images are read
+             from the smallest copy which is large enough for the first resize step,
+             so changing the size images are resized to is cheap.
 none:        Don't cache.
 
+When caching output on disk, numpy arrays can be stored with a smaller dtype:
+
+  data:
+    cache: disk
+    cache-dtypes:
+      x: float16
+      y: class-ids
+
+uint8:       Arrays of whole numbers from 0 to 255, e.g. images (lossless).
+float16:     Floating point arrays at half precision.
+int8:        Floating point arrays quantized to 255 steps.
+class-ids:   One-hot vectors, stored as the class id (lossless).
+
 You can configure the cache from your project file or on the command line via the --cache option.
 """
 
@@ -88,6 +106,9 @@ To change and augment your samples data during training, you can define a prepro
        - op: random-crop
          width: 128
          height: 128
+
+Consecutive crop, flip and resize operations are run as a single crop or resize
+per image. To run them one by one, e.g. for debugging, set data.fuse-ops to false.
 """
 
 _DATA_HELP = """
@@ -109,6 +130,10 @@ preprocess:    Transform and augment sample data.
 output:        Set the final transformation before training.
 cache:         Use cache to speed up the training process.
 
+The random generators of samples are compatible with earlier versions by default. Set
+rng to 'counter' for generators which are faster to create and smaller to store. They
+give each operation its own random numbers, and live loaded samples new ones per epoch.
+
 To learn more, see 'ml help <subsection>', e.g. 'ml help preprocess'.
 """
 
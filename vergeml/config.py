@@ -10,6 +10,8 @@ from vergeml.utils import VergeMLError, did_you_mean
 from vergeml.plugins import PLUGINS
 from vergeml.io import Source
 from vergeml.operation import Operation
+from vergeml.rng import RNG_MODES
+from vergeml.cache import STORAGE_DTYPES
 
 def parse_device(section, device_id=None, device_memory=None):
     """Parse the device section of the config file.
@@ -131,11 +133,18 @@ def parse_data(section, cache=None, plugins=PLUGINS):
     }
 
     # Raise an error if an unknown option is encountered
-    _raise_unknown_option('data', ('input', 'output', 'cache', 'preprocess'),
+    _raise_unknown_option('data', ('input', 'output', 'cache', 'preprocess', 'fuse-ops', 'rng',
+                                   'cache-dtypes'),
                           section.keys(), 'data')
 
     _parse_data_cache(res, section)
 
+    _parse_data_fuse_ops(res, section)
+
+    _parse_data_rng(res, section)
+
+    _parse_data_cache_dtypes(res, section)
+
     _parse_data_source(res, section, 'input', plugins)
 
     _parse_data_source(res, section, 'output', plugins)
@@ -145,7 +154,7 @@ def parse_data(section, cache=None, plugins=PLUGINS):
     return res
 
 
-_VALID_CACHE_VALUES = ('none', 'mem', 'disk', 'mem-in', 'disk-in', 'auto')
+_VALID_CACHE_VALUES = ('none', 'mem', 'disk', 'mem-in', 'disk-in', 'hybrid', 'pyramid', 'auto')
 def _parse_data_cache(res, section):
 
     if 'cache' in section:
@@ -158,6 +167,45 @@ def _parse_data_cache(res, section):
         res['cache'] = value
 
 
+def _parse_data_fuse_ops(res, section):
+
+    if 'fuse-ops' in section:
+        value = section['fuse-ops']
+
+        if not isinstance(value, bool):
+            raise _invalid_option('data.fuse-ops', help_topic='data')
+        res['fuse-ops'] = value
+
+
+def _parse_data_rng(res, section):
+
+    if 'rng' in section:
+        value = section['rng']
+
+        if not value in RNG_MODES:
+            suggestion = did_you_mean(RNG_MODES, value) if isinstance(value, str) else None
+            raise _invalid_option('data.rng', help_topic='data', suggestion=suggestion)
+        res['rng'] = value
+
+
+def _parse_data_cache_dtypes(res, section):
+
+    if 'cache-dtypes' in section:
+        value = section['cache-dtypes']
+
+        if not isinstance(value, dict):
+            raise _invalid_option('data.cache-dtypes', help_topic='cache')
+
+        _raise_unknown_option('data.cache-dtypes', ('x', 'y'), value.keys(), 'cache')
+
+        for k, dtype in value.items():
+            if not dtype in STORAGE_DTYPES:
+                suggestion = did_you_mean(STORAGE_DTYPES, dtype) if isinstance(dtype, str) else None
+                raise _invalid_option('data.cache-dtypes.' + k, help_topic='cache', suggestion=suggestion)
+
+        res['cache-dtypes'] = value
+
+
 def _parse_data_source(res, section, key, plugins):
 
     if key in section:
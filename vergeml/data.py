@@ -2,15 +2,18 @@
 """
 
 from typing import List, Any, Union, Callable, Optional
+import os
+import itertools
 import random
+import tempfile
 
 import numpy as np
 
 from vergeml.utils import VergeMLError
-from vergeml.views import BatchView, IteratorView
+from vergeml.views import BatchView, IteratorView, Sampler, SAMPLERS, SHUFFLES
 from vergeml.io import SourcePlugin
-from vergeml.operation import BaseOperation
-from vergeml.loader import FileCachedLoader, LiveLoader, MemoryCachedLoader
+from vergeml.operation import BaseOperation, fuse_ops, split_ops, pyramid_target
+from vergeml.loader import FileCachedLoader, LiveLoader, MemoryCachedLoader, PyramidCachedLoader
 from vergeml.plugins import PLUGINS
 from vergeml.utils import introspect
 from vergeml.display import DISPLAY
@@ -23,6 +26,44 @@ class Labels(list):
     pass
 
 
+class LabelIndex:
+    """Map label names to int32 class ids and class ids to one-hot vectors.
+    """
+
+    def __init__(self, labels: List[str]):
+        self.labels = labels
+        self.ids = {label: i for i, label in enumerate(self.labels)}
+
+    @classmethod
+    def of(cls, source) -> 'LabelIndex':
+        """Return the label index of a source, cached in source.label_index.
+
+        The output source shares meta with the input source, so the index is created
+        lazily and recreated when meta['labels'] is replaced.
+        """
+        index = getattr(source, 'label_index', None)
+        if index is None or index.labels is not source.meta['labels']:
+            index = source.label_index = cls(source.meta['labels'])
+        return index
+
+    def encode(self, labels: List[str]) -> np.ndarray:
+        """Return the class ids of a list of label names.
+        """
+        return np.array([self.ids[label] for label in labels], dtype='int32')
+
+    def decode(self, ids) -> Labels:
+        """Return the label names of a list of class ids.
+        """
+        return Labels(self.labels[i] for i in ids)
+
+    def onehot(self, ids, dtype='float64') -> np.ndarray:
+        """Return the one-hot (or multi-hot) vector for a list of class ids.
+        """
+        res = np.zeros(len(self.labels), dtype=dtype)
+        res[ids] = 1.
+        return res
+
+
 class BoundingBoxes(list):
     """A list of bounding boxes.
     """
@@ -65,6 +106,8 @@ class Data:
                  cache_dir: str = '.cache',
                  cache_input: Union[str, bool] = 'mem',
                  cache_output: Union[str, bool] = False,
+                 fuse_ops: bool = True,
+                 cache_dtypes: Optional[dict] = None,
                  plugins=PLUGINS):
 
         """For automatic configuration, pass in an env object. To
@@ -83,9 +126,24 @@ class Data:
         :param random_seed: the random seed to use
 
         :param cache_input: config of input caching, default: False.
-                            possible values: 'mem', 'disk' or False
+                            possible values: 'mem', 'disk', 'pyramid' or False.
+                            'pyramid' stores images together with
+                            downscaled copies on disk and reads the
+                            smallest copy large enough for the first
+                            resize op.
 
         :param cache_output: config of output caching, default: 'disk'
+                             possible values: 'mem', 'disk', 'hybrid' or False.
+                             'hybrid' caches the output of the leading
+                             deterministic ops on disk and runs the
+                             remaining ops live.
+
+        :param fuse_ops: run consecutive geometric ops as a single crop or
+                         resize per image, default: True
+
+        :param cache_dtypes: the dtypes x and y arrays are stored with when
+                             caching output on disk, e.g. {'x': 'float16',
+                             'y': 'class-ids'}. See vergeml.cache.STORAGE_DTYPES.
         """
 
         self.cache_dir = cache_dir
@@ -99,6 +157,8 @@ class Data:
         self.random_seed = random_seed
         self.cache_input = cache_input
         self.cache_output = cache_output
+        self.fuse_ops = fuse_ops
+        self.cache_dtypes = cache_dtypes
 
         self.plugins = plugins
         self.loader = None
@@ -112,8 +172,8 @@ class Data:
         else:
 
             # Sanity check
-            assert cache_input in ('mem', 'disk', False)
-            assert cache_output in ('mem', 'disk', False)
+            assert cache_input in ('mem', 'disk', 'pyramid', False)
+            assert cache_output in ('mem', 'disk', 'hybrid', False)
             assert self.input is not None
 
             self.loader = self._get_loader(cache_input, cache_output)
@@ -128,22 +188,62 @@ class Data:
             loader_class = FileCachedLoader if cache_input == 'disk' else MemoryCachedLoader
             input_loader = loader_class(self.cache_dir, self.input)
             input_loader.progress_callback = self._progress_callback
+        elif cache_input == 'pyramid':
+
+            # cache images at several resolutions and read the one
+            # needed for resizing
+            input_loader = PyramidCachedLoader(self.cache_dir, self.input,
+                                               target=pyramid_target(self.ops))
+            input_loader.progress_callback = self._progress_callback
         else:
 
             # otherwise, use the input object directly
             input_loader = self.input
 
+        if cache_output == 'hybrid':
+            return self._get_hybrid_loader(input_loader)
+
         if cache_output in ('disk', 'mem'):
 
             # set up output caching
 
-            loader_class = FileCachedLoader if cache_output == 'disk' else MemoryCachedLoader
-            loader = loader_class(self.cache_dir, input_loader, self.ops, self.output)
+            if cache_output == 'disk':
+                loader = FileCachedLoader(self.cache_dir, input_loader, self._loader_ops(), self.output,
+                                          dtypes=self.cache_dtypes)
+            else:
+                loader = MemoryCachedLoader(self.cache_dir, input_loader, self._loader_ops(), self.output)
             loader.progress_callback = self._progress_callback
 
             return loader
 
-        return LiveLoader(self.cache_dir, input_loader, self.ops, self.output)
+        return LiveLoader(self.cache_dir, input_loader, self._loader_ops(), self.output)
+
+    def _get_hybrid_loader(self, input_loader):
+        """Cache the output of deterministic ops on disk and run the remaining ops live.
+        """
+        prefix, suffix = split_ops(self.ops)
+
+        if not suffix:
+            # everything can be cached
+            cached_loader = FileCachedLoader(self.cache_dir, input_loader, self._loader_ops(prefix),
+                                             self.output, dtypes=self.cache_dtypes)
+            cached_loader.progress_callback = self._progress_callback
+            return cached_loader
+
+        if prefix:
+            # cache samples processed by the prefix, but not yet transformed to output
+            cached_loader = FileCachedLoader(self.cache_dir, input_loader, self._loader_ops(prefix),
+                                             self.output, transform=False)
+        else:
+            # cache the input
+            cached_loader = FileCachedLoader(self.cache_dir, input_loader)
+
+        cached_loader.progress_callback = self._progress_callback
+        return LiveLoader(self.cache_dir, cached_loader, self._loader_ops(suffix), self.output)
+
+    def _loader_ops(self, ops=None):
+        ops = self.ops if ops is None else ops
+        return fuse_ops(ops) if self.fuse_ops else ops
 
     @property
     def meta(self):
@@ -164,7 +264,17 @@ class Data:
              with_meta: bool = False,
              randomize: bool = False,
              transform_x: Callable[[Any], Any] = lambda x: x,
-             transform_y: Callable[[Any], Any] = lambda y: y):
+             transform_y: Callable[[Any], Any] = lambda y: y,
+             sampler: Optional[str] = None,
+             label_weights: Optional[dict] = None,
+             shuffle: str = 'fetch',
+             window_size: int = 256,
+             buffer_size: int = 1024,
+             batch_buffers: int = 0,
+             memmap: bool = False,
+             transform_batch_x: Optional[Callable[[Any], Any]] = None,
+             transform_batch_y: Optional[Callable[[Any], Any]] = None,
+             transform_on_pump: bool = False):
 
         """
         :param split: The split to load. One of "train", "val", "test".
@@ -227,10 +337,65 @@ class Data:
 
         :param transform_y: a function that takes x as an argument and
                             returns a transformed version.
-                            Defaults to no transformation."""
+                            Defaults to no transformation.
+
+        :param sampler: How to resample the split. One of "weighted",
+                        "balanced", "stratified" or None (default) to
+                        read every sample once. See vergeml.views.Sampler.
+
+        :param label_weights: A dict mapping label names to weights for
+                              the "weighted" sampler.
+
+        :param shuffle: How "batch" and "iter" views randomize the order
+                        of samples. "fetch" (default) shuffles blocks of
+                        fetch_size samples, which is faster to read.
+                        "sample" shuffles every sample individually.
+                        "buffer" reads windows of window_size samples
+                        sequentially (in random order) and shuffles the
+                        samples in a buffer of buffer_size samples.
+
+        :param window_size: The number of consecutive samples read at
+                            once when shuffle is "buffer".
+
+        :param buffer_size: The number of samples held in memory when
+                            shuffle is "buffer". Larger buffers result
+                            in better randomization.
+
+        :param batch_buffers: Applies to the "batch" view with layout
+                              "arrays". When greater than 0, batches
+                              are assembled in a ring of batch_buffers
+                              reused arrays instead of new arrays. A
+                              batch is overwritten batch_buffers
+                              batches later, so use this only when
+                              batches are copied or consumed before
+                              (e.g. Keras fit_generator, which holds
+                              up to max_queue_size batches).
+
+        :param memmap: Applies to the "list" view with layout "arrays".
+                       If True, x and y are returned as np.memmap arrays
+                       backed by files in cache-dir, for splits which
+                       don't fit into memory.
+
+        :param transform_batch_x: a function that takes all x of a batch
+                                  and returns a transformed version,
+                                  e.g. lambda xs: xs / 255. It receives
+                                  a numpy array when layout is "arrays"
+                                  and a list otherwise. Applies to the
+                                  "batch" view and to the "list" view,
+                                  where the whole split is one batch.
+                                  Defaults to no transformation.
+
+        :param transform_batch_y: like transform_batch_x for all y of a
+                                  batch.
+
+        :param transform_on_pump: Applies to the "batch" view. If True,
+                                  batches are read, transformed and
+                                  assembled in a background thread."""
 
         assert view in ('list', 'batch', 'iter')
         assert layout in ('tuples', 'lists', 'arrays')
+        assert sampler in (None,) + SAMPLERS
+        assert shuffle in SHUFFLES
         fetch_size = fetch_size or 8
 
         if view == 'list':
@@ -241,7 +406,12 @@ class Data:
                               randomize=randomize,
                               random_seed=self.random_seed,
                               transform_x=transform_x,
-                              transform_y=transform_y)
+                              transform_y=transform_y,
+                              sampler=sampler,
+                              label_weights=label_weights,
+                              memmap_dir=self.cache_dir if memmap else None,
+                              transform_batch_x=transform_batch_x,
+                              transform_batch_y=transform_batch_y)
 
         if view == 'batch':
 
@@ -255,7 +425,16 @@ class Data:
                              randomize=randomize,
                              random_seed=self.random_seed,
                              transform_x=transform_x,
-                             transform_y=transform_y)
+                             transform_y=transform_y,
+                             sampler=sampler,
+                             label_weights=label_weights,
+                             shuffle=shuffle,
+                             window_size=window_size,
+                             buffer_size=buffer_size,
+                             batch_buffers=batch_buffers,
+                             transform_batch_x=transform_batch_x,
+                             transform_batch_y=transform_batch_y,
+                             transform_on_pump=transform_on_pump)
 
         if view == 'iter':
             return IteratorView(loader=self.loader,
@@ -266,7 +445,12 @@ class Data:
                                 randomize=randomize,
                                 random_seed=self.random_seed,
                                 transform_x=transform_x,
-                                transform_y=transform_y)
+                                transform_y=transform_y,
+                                sampler=sampler,
+                                label_weights=label_weights,
+                                shuffle=shuffle,
+                                window_size=window_size,
+                                buffer_size=buffer_size)
 
 
         # never runs in this code, make the linter happy
@@ -276,8 +460,14 @@ class Data:
     def _base_env_config(self):
         """Get the base configuration values from env (splits etc.)
         """
-        keys = ('val-split', 'test-split', 'samples-dir', 'random-seed', 'trainings-dir')
-        return {k: self.env.get(k) for k in keys}
+        keys = ('val-split', 'test-split', 'samples-dir', 'cache-dir', 'random-seed', 'trainings-dir')
+        res = {k: self.env.get(k) for k in keys}
+
+        # only pass the rng when configured, since it is part of the cache hash
+        if self.env.get('data.rng') is not None:
+            res['rng'] = self.env.get('data.rng')
+
+        return res
 
     def _setup_input(self):
         """Set up input from env.
@@ -380,6 +570,10 @@ class Data:
             self.cache_input, self.cache_output = False, 'mem'
         elif cache in ('disk', 'auto'):
             self.cache_input, self.cache_output = False, 'disk'
+        elif cache == 'hybrid':
+            self.cache_input, self.cache_output = False, 'hybrid'
+        elif cache == 'pyramid':
+            self.cache_input, self.cache_output = 'pyramid', False
         elif cache == 'none':
             self.cache_input, self.cache_output = False, False
 
@@ -396,6 +590,12 @@ class Data:
         self._setup_output()
         self._setup_cache()
 
+        if self.env.get('data.fuse-ops') is not None:
+            self.fuse_ops = self.env.get('data.fuse-ops')
+
+        if self.env.get('data.cache-dtypes') is not None:
+            self.cache_dtypes = self.env.get('data.cache-dtypes')
+
         self.loader = self._get_loader(self.cache_input, self.cache_output)
 
     def num_samples(self, split):
@@ -407,6 +607,18 @@ class Data:
         self.loader.end_read_samples()
         return res
 
+    def query(self, split: str = 'train', label=None, **conditions) -> np.ndarray:
+        """Return the indices of the samples in split matching label and the metadata conditions.
+
+        For example, data.query('val', label='cat', filename='*/cats/*.png').
+        See vergeml.cache.MetaStore.query() for the kinds of conditions.
+        """
+
+        self.loader.begin_read_samples()
+        res = self.loader.query(split, label, **conditions)
+        self.loader.end_read_samples()
+        return res
+
     def _progress_callback(self, current, total):
         if total:
 
@@ -418,8 +630,12 @@ class Data:
                     msg = "Caching output samples in memory ..."
                 elif self.cache_input == 'disk':
                     msg = "Caching input samples on disk ..."
+                elif self.cache_input == 'pyramid':
+                    msg = "Caching input samples at several resolutions on disk ..."
                 elif self.cache_output == 'disk':
                     msg = "Caching output samples on disk ..."
+                elif self.cache_output == 'hybrid':
+                    msg = "Caching preprocessed samples on disk ..."
                 else:
                     msg = None
 
@@ -448,15 +664,35 @@ def _load_list(loader,  # pylint: disable=R0914,R0913
                transform_y,
                with_meta,
                randomize,
-               layout):
+               layout,
+               sampler=None,
+               label_weights=None,
+               memmap_dir=None,
+               transform_batch_x=None,
+               transform_batch_y=None):
     # pylint: disable=C0103
     res = []
+    sampler = Sampler(loader, split, sampler, label_weights, False, random_seed)
+
+    if layout == 'arrays':
+        ixs = next(sampler.plans()) if sampler.resamples else sampler.base
+
+        if randomize:
+            # shuffling a list of positions yields the same order as shuffling the samples
+            order = list(range(len(ixs)))
+            random.Random(random_seed).shuffle(order)
+            ixs = ixs[order]
+
+        xs, ys, *meta = _load_arrays(loader, split, ixs, transform_x, transform_y, with_meta, memmap_dir)
+        xs = transform_batch_x(xs) if transform_batch_x else xs
+        ys = transform_batch_y(ys) if transform_batch_y else ys
+        return tuple([xs, ys] + meta)
+
     loader.begin_read_samples()
 
     num_samples = loader.num_samples(split)
 
-    for sample in loader.read_samples(split, 0, num_samples):
-        x, y, m = sample.x, sample.y, sample.meta
+    for x, y, m in _iter_items(loader, split, 0, num_samples, with_meta):
         x, y = transform_x(x), transform_y(y)
         if with_meta:
             res.append((x, y, m))
@@ -465,15 +701,161 @@ def _load_list(loader,  # pylint: disable=R0914,R0913
 
     loader.end_read_samples()
 
+    if sampler.resamples:
+        res = [res[i] for i in next(sampler.plans())]
+
     if randomize:
         random.Random(random_seed).shuffle(res)
 
-    if layout in ('lists', 'arrays'):
-        res = tuple(map(list, zip(*res)))
-        if not res:
-            res = ([], [], []) if with_meta else ([], [])
+    if layout == 'tuples' and not (transform_batch_x or transform_batch_y):
+        return res
+
+    xs, ys, *meta = tuple(map(list, zip(*res))) or (([], [], []) if with_meta else ([], []))
+    xs = transform_batch_x(xs) if transform_batch_x else xs
+    ys = transform_batch_y(ys) if transform_batch_y else ys
+
+    if layout == 'lists':
+        return tuple([xs, ys] + meta)
+
+    return list(zip(xs, ys, *meta))
+
+
+# number of samples read at once when streaming a split into arrays
+_LIST_CHUNK_SIZE = 256
+
+def _iter_items(loader, split, index, n_samples, with_meta):
+    """Yield (x, y, meta) for n_samples samples of split starting at index.
+
+    Without meta, chunks are read with read_arrays() when the loader supports it,
+    so no sample objects are created.
+    """
+    for start in range(index, index + n_samples, _LIST_CHUNK_SIZE):
+        count = min(_LIST_CHUNK_SIZE, index + n_samples - start)
+        arrays = None if with_meta else loader.read_arrays(split, start, count)
+
+        if arrays is not None:
+            # the loader reads arrays directly, e.g. from a memory mapped file
+            xbatch, ybatch = arrays
+            yield from zip(xbatch, itertools.repeat(None) if ybatch is None else ybatch,
+                           itertools.repeat(None))
+        else:
+            yield from ((sample.x, sample.y, sample.meta)
+                        for sample in loader.read_samples(split, start, count))
+
+
+def _load_arrays(loader, split, ixs, transform_x, transform_y, with_meta, memmap_dir=None): # pylint: disable=R0913,R0914
+    """Stream the samples of split into arrays, placing sample ixs[i] at position i.
+
+    Samples are read in order and every sample is transformed once, even if it
+    appears at several positions.
+    """
+    # pylint: disable=C0103
+
+    # the positions of each sample in the result
+    positions = np.argsort(ixs, kind='stable')
+    bounds = np.searchsorted(ixs[positions], np.arange(int(ixs.max(initial=-1)) + 2))
+
+    xs, ys = None, None
+    meta = [None] * len(ixs)
+
+    loader.begin_read_samples()
+
+    items = _iter_items(loader, split, 0, len(bounds) - 1, with_meta)
+
+    for i, (x, y, sample_meta) in enumerate(items):
+        pos = positions[bounds[i]:bounds[i + 1]]
+        if not len(pos):
+            continue
+
+        x, y = np.asarray(transform_x(x)), np.asarray(transform_y(y))
+
+        if xs is None:
+            xs = _alloc_array(len(ixs), x, memmap_dir, split + "-x-")
+            ys = _alloc_array(len(ixs), y, memmap_dir, split + "-y-")
+        else:
+            # the positions of the samples read before
+            filled = positions[:bounds[i]]
+            xs = _fit_array(xs, x, filled, memmap_dir, split + "-x-")
+            ys = _fit_array(ys, y, filled, memmap_dir, split + "-y-")
+
+        if xs.dtype == object:
+            for p in pos:
+                xs[p] = x
+        else:
+            xs[pos] = x
+
+        if ys.dtype == object:
+            for p in pos:
+                ys[p] = y
+        else:
+            ys[pos] = y
+
+        for p in pos:
+            meta[p] = sample_meta
+
+    loader.end_read_samples()
+
+    if xs is None:
+        xs, ys = np.array([]), np.array([])
+
+    if xs.dtype == object:
+        xs = np.array(xs.tolist())
+
+    if ys.dtype == object:
+        ys = np.array(ys.tolist())
+
+    return (xs, ys, meta) if with_meta else (xs, ys)
+
+
+def _fit_array(arr, item, filled, memmap_dir, prefix):
+    """Return arr, or a copy of arr with a dtype which holds item without loss.
+
+    Numeric items are upcast like np.array() does. filled are the positions of arr
+    which already hold items.
+    """
+    if arr.dtype == object or (np.can_cast(item.dtype, arr.dtype) and item.shape == arr.shape[1:]):
+        return arr
+
+    if item.dtype.kind in 'biufc':
+        if item.shape != arr.shape[1:]:
+            raise VergeMLError("Can't load samples of shape {} and {} as one array.".format(
+                arr.shape[1:], item.shape), "Please make sure all samples have the same shape.")
+        item = np.empty(item.shape, dtype=np.result_type(arr.dtype, item.dtype))
+
+    res = _alloc_array(len(arr), item, memmap_dir, prefix)
+
+    if res.dtype == object:
+        for pos in filled:
+            res[pos] = arr[pos]
+    else:
+        res[filled] = arr[filled]
+
+    return res
+
+
+def _alloc_array(n_samples, item, memmap_dir, prefix):
+    """Allocate an array for n_samples items like item.
+
+    Items which are not numeric are collected in an object array. When memmap_dir
+    is set, numeric arrays are memory mapped to a file in memmap_dir.
+    """
+    if item.dtype.kind not in 'biufc':
+        return np.empty(n_samples, dtype=object)
+
+    shape = (n_samples,) + item.shape
+
+    if memmap_dir is None:
+        return np.empty(shape, dtype=item.dtype)
+
+    os.makedirs(memmap_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(suffix=".npy", prefix=prefix, dir=memmap_dir)
+    os.close(fd)
+    res = np.lib.format.open_memmap(path, mode='w+', dtype=item.dtype, shape=shape)
+
+    try:
+        # the data stays accessible until the array is closed
+        os.remove(path)
+    except OSError:
+        pass
 
-    if layout == 'arrays':
-        xs, ys, *meta = res
-        res = tuple([np.array(xs), np.array(ys)] + meta)
     return res
@@ -1,5 +1,6 @@
 import os.path
 import math
+import numpy as np
 from PIL import Image
 from PIL.Image import Image as ImageType
 
@@ -45,7 +46,7 @@ def resize_image(img, width, height, method, mode, bg_color=(0, 0, 0, 0)):
     # https://github.com/charlesthk/python-resize-image/blob/master/resizeimage/resizeimage.py
     # Thank you!
     img = img.copy()
-    pil_method = getattr(Image, method.upper())
+    pil_method = _pil_method(method)
 
     if mode == 'fill':
         img = img.resize((width, height), pil_method)
@@ -59,7 +60,7 @@ def resize_image(img, width, height, method, mode, bg_color=(0, 0, 0, 0)):
         top = (h - height) / 2
         right = w - left
         bottom = h - top
-        rect = (int(math.ceil(x)) for x in (left, top, right, bottom))
+        rect = tuple(int(math.ceil(x)) for x in (left, top, right, bottom))
         img = img.crop(rect)
     elif mode == 'aspect-fit':
         img.thumbnail((width, height), pil_method)
@@ -71,4 +72,344 @@ def resize_image(img, width, height, method, mode, bg_color=(0, 0, 0, 0)):
         background.paste(img, img_position)
         img = background.convert('RGB')
     
-    return img
\ No newline at end of file
+    return img
+
+def _pil_method(method):
+    # 'antialias' is the old name of the lanczos filter and was removed in Pillow 10
+    name = 'LANCZOS' if method == 'antialias' else method.upper()
+    return getattr(getattr(Image, 'Resampling', Image), name)
+
+
+def is_image_array(arr):
+    """Return True when arr is an array holding an image of shape (H, W) or (H, W, C)."""
+    return isinstance(arr, np.ndarray) and arr.ndim in (2, 3)
+
+def is_image(obj):
+    """Return True when obj is an image or an image array."""
+    return isinstance(obj, ImageType) or is_image_array(obj)
+
+def image_size(img):
+    """Return the (width, height) of an image or an image array."""
+    if isinstance(img, np.ndarray):
+        return img.shape[1], img.shape[0]
+    return img.size
+
+
+# the lengths of the shorter side of the downscaled images stored in a pyramid cache
+PYRAMID_LEVELS = (512, 256, 128, 64)
+
+def pyramid_levels(img, levels=PYRAMID_LEVELS):
+    """Return downscaled copies of img for each level smaller than img, largest first.
+
+    The shorter side of each copy has the length of its level."""
+    res = []
+    width, height = img.size
+
+    for level in sorted(levels, reverse=True):
+        if level >= min(width, height):
+            continue
+
+        ratio = level / min(width, height)
+        size = (max(1, int(round(width * ratio))), max(1, int(round(height * ratio))))
+
+        # downscale from the previous level, which is faster and close enough
+        res.append((res[-1] if res else img).resize(size, _pil_method('lanczos')))
+
+    return res
+
+def pyramid_level(sizes, width, height, mode):
+    """Return the index of the smallest of the image sizes which can be resized to
+    width and height without upscaling, or 0 (the original) if there is none.
+
+    :param sizes: the (width, height) of the original image followed by its levels
+    """
+    for index in reversed(range(1, len(sizes))):
+        level_width, level_height = sizes[index]
+
+        if mode == 'aspect-fit':
+            large_enough = level_width >= width or level_height >= height
+        else:
+            large_enough = level_width >= width and level_height >= height
+
+        if large_enough:
+            return index
+
+    return 0
+
+
+def _cubic(x, a=-0.5):
+    x = np.abs(x)
+    return np.where(x < 1., ((a + 2.) * x - (a + 3.)) * x * x + 1.,
+                    np.where(x < 2., (((x - 5.) * x + 8.) * x - 4.) * a, 0.))
+
+# support and filter function of the resampling methods, as used by PIL
+_FILTERS = {
+    'box': (0.5, lambda x: ((x > -0.5) & (x <= 0.5)).astype(np.float64)),
+    'bilinear': (1., lambda x: np.maximum(0., 1. - np.abs(x))),
+    'hamming': (1., lambda x: np.where(np.abs(x) < 1., np.sinc(x) * (0.54 + 0.46 * np.cos(np.pi * x)), 0.)),
+    'bicubic': (2., _cubic),
+    'lanczos': (3., lambda x: np.where(np.abs(x) < 3., np.sinc(x) * np.sinc(x / 3.), 0.)),
+}
+
+def _resample_weights(in_size, out_size, method, start=0., end=None):
+    """Return the indices and weights of the input pixels of each output pixel when
+    resampling the range start:end of an axis of in_size to out_size.
+
+    Both are arrays of shape (out_size, support), where support is the largest number
+    of input pixels an output pixel is computed from.
+    """
+    end = in_size if end is None else end
+    scale = (end - start) / out_size
+    centers = start + (np.arange(out_size) + 0.5) * scale
+
+    if method == 'nearest':
+        # PIL adds up the source coordinates step by step, which matters for ties
+        ixs = np.cumsum(np.concatenate([[start + scale * 0.5], np.full(out_size - 1, scale)]))
+        ixs = np.clip(ixs.astype(np.int64), 0, in_size - 1)
+        return ixs[:, np.newaxis], np.ones((out_size, 1))
+
+    support, fun = _FILTERS['lanczos' if method == 'antialias' else method]
+
+    # when downscaling, the filter is stretched to cover all input pixels
+    fscale = max(scale, 1.)
+    first = np.maximum((centers - support * fscale + 0.5).astype(np.int64), 0)
+    last = np.minimum((centers + support * fscale + 0.5).astype(np.int64), in_size)
+
+    indices = first[:, np.newaxis] + np.arange(max(int((last - first).max()), 1))
+    weights = fun((indices + 0.5 - centers[:, np.newaxis]) * (1. / fscale))
+
+    # pixels past the end of the support of an output pixel don't contribute
+    weights[indices >= last[:, np.newaxis]] = 0.
+    indices = np.minimum(indices, in_size - 1)
+
+    return indices, weights / weights.sum(axis=1, keepdims=True)
+
+def _resample(batch, width, height, method, box=None):
+    _, in_height, in_width = batch.shape[:3]
+    x0, y0, x1, y1 = box or (0, 0, in_width, in_height)
+    res = batch
+
+    # like PIL, resample horizontally first and round integer images after each pass.
+    # Each output pixel is the weighted sum of the input pixels in its support.
+    if (x0, x1, width) != (0, in_width, in_width):
+        indices, weights = _resample_weights(in_width, width, method, x0, x1)
+        res = _round(np.einsum('nhos...,os->nho...', res[:, :, indices], weights), batch.dtype)
+
+    if (y0, y1, height) != (0, in_height, in_height):
+        indices, weights = _resample_weights(in_height, height, method, y0, y1)
+        res = _round(np.einsum('nos...,os->no...', res[:, indices], weights), batch.dtype)
+
+    return res
+
+def _round(arr, dtype):
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        arr = np.clip(np.rint(arr), info.min, info.max)
+    return arr.astype(dtype)
+
+def resize_batch(batch, width, height, method, mode):
+    """Resize an array of images of shape (N, H, W) or (N, H, W, C).
+
+    Works like resize_image, except that aspect-fit keeps the channels of the images."""
+    _, h, w = batch.shape[:3]
+
+    if mode == 'fill':
+        return _resample(batch, width, height, method)
+
+    elif mode == 'aspect-fill':
+        ratio = max(width / w, height / h)
+        batch = _resample(batch, int(math.ceil(w * ratio)), int(math.ceil(h * ratio)), method)
+        _, h, w = batch.shape[:3]
+        left = int(math.ceil((w - width) / 2))
+        top = int(math.ceil((h - height) / 2))
+        return batch[:, top:top + height, left:left + width]
+
+    else:
+        # like PIL.Image.thumbnail, only ever scale down
+        ratio = min(width / w, height / h, 1.)
+        nwidth, nheight = max(1, int(round(w * ratio))), max(1, int(round(h * ratio)))
+        batch = _resample(batch, nwidth, nheight, method)
+        res = np.zeros((len(batch), height, width) + batch.shape[3:], dtype=batch.dtype)
+        left = int(math.ceil((width - nwidth) / 2))
+        top = int(math.ceil((height - nheight) / 2))
+        res[:, top:top + nheight, left:left + nwidth] = batch
+        return res
+
+def grayscale_batch(batch):
+    """Convert an array of images of shape (N, H, W) or (N, H, W, C) to grayscale.
+
+    Images with 3 or 4 channels are converted with the ITU-R 601-2 luma transform
+    like PIL does and keep a single channel."""
+    if batch.ndim == 3 or batch.shape[3] == 1:
+        return batch
+
+    if batch.shape[3] == 2:
+        # drop the alpha channel
+        return batch[:, :, :, :1]
+
+    if batch.dtype == np.uint8:
+        # the same fixed point arithmetic as PIL
+        rgb = batch.astype(np.uint32)
+        luma = (rgb[:, :, :, 0] * 19595 + rgb[:, :, :, 1] * 38470 + rgb[:, :, :, 2] * 7471 + 0x8000) >> 16
+    else:
+        luma = batch[:, :, :, 0] * 0.299 + batch[:, :, :, 1] * 0.587 + batch[:, :, :, 2] * 0.114
+
+        if np.issubdtype(batch.dtype, np.integer):
+            luma = np.rint(luma)
+
+    return luma.astype(batch.dtype)[:, :, :, np.newaxis]
+
+def rgb_batch(batch):
+    """Convert an array of images of shape (N, H, W) or (N, H, W, C) to 3 channels.
+
+    Like PIL, grayscale images are repeated and the alpha channel is dropped."""
+    if batch.ndim == 3:
+        batch = batch[:, :, :, np.newaxis]
+
+    if batch.shape[3] < 3:
+        return np.repeat(batch[:, :, :, :1], 3, axis=3)
+
+    return batch[:, :, :, :3]
+
+
+class Geometry:
+    """The crops, flips and resizing of an image, collected to be applied in one step.
+
+    The region box of the source image is scaled to size and then flipped.
+    Coordinates passed to crop() refer to the image as transformed so far.
+    """
+
+    def __init__(self, width, height):
+        self.box = (0, 0, width, height)
+        self.size = (width, height)
+        self.flip_h = False
+        self.flip_v = False
+
+        # the resampling method and the region of the source image in whole
+        # pixels once the image is resized
+        self.method = None
+        self.bounds = None
+
+        # the number of channels to convert to
+        self.channels = None
+
+    def crop(self, x, y, width, height):
+        """Crop the rectangle at x, y with width and height."""
+        (x0, y0, x1, y1), (cur_width, cur_height) = self.box, self.size
+
+        # map the rectangle back to the unflipped image
+        if self.flip_h:
+            x = cur_width - x - width
+        if self.flip_v:
+            y = cur_height - y - height
+
+        if self.method is None:
+            # the image is not scaled, so the box stays in whole pixels
+            self.box = (x0 + x, y0 + y, x0 + x + width, y0 + y + height)
+        else:
+            scale_x, scale_y = (x1 - x0) / cur_width, (y1 - y0) / cur_height
+            self.box = (x0 + x * scale_x, y0 + y * scale_y,
+                        x0 + (x + width) * scale_x, y0 + (y + height) * scale_y)
+        self.size = (width, height)
+
+    def resize(self, width, height, method, mode='fill'):
+        """Resize like resize_image() in mode 'fill' or 'aspect-fill'."""
+        assert self.method is None, "can only resize once"
+        assert mode in ('fill', 'aspect-fill')
+        self.method = method
+
+        # pixels outside the region cropped so far must not be sampled
+        self.bounds = self.box
+
+        if mode == 'fill':
+            self.size = (width, height)
+        else:
+            cur_width, cur_height = self.size
+            ratio = max(width / cur_width, height / cur_height)
+            self.size = (int(math.ceil(cur_width * ratio)), int(math.ceil(cur_height * ratio)))
+            left = int(math.ceil((self.size[0] - width) / 2))
+            top = int(math.ceil((self.size[1] - height) / 2))
+            self.crop(left, top, width, height)
+
+    def apply(self, img):
+        """Transform the image or image array img."""
+        if isinstance(img, np.ndarray):
+            return self._apply_array(img)
+
+        bounds = self.bounds or self.box
+        if bounds != (0, 0) + img.size:
+            img = img.crop(bounds)
+
+        if self.method is not None:
+            img = img.resize(self.size, _pil_method(self.method), box=self._relative_box())
+
+        if self.flip_h and self.flip_v:
+            img = img.transpose(Image.ROTATE_180)
+        elif self.flip_h:
+            img = img.transpose(Image.FLIP_LEFT_RIGHT)
+        elif self.flip_v:
+            img = img.transpose(Image.FLIP_TOP_BOTTOM)
+
+        if self.channels == 1:
+            img = img.convert('L')
+        elif self.channels == 3:
+            img = img.convert('RGB')
+
+        return img
+
+    def _relative_box(self):
+        (x0, y0, x1, y1), (left, top) = self.box, self.bounds[:2]
+        return (x0 - left, y0 - top, x1 - left, y1 - top)
+
+    def _apply_array(self, arr):
+        x0, y0, x1, y1 = self.bounds or self.box
+        batch = arr[np.newaxis, y0:y1, x0:x1]
+
+        if self.method is not None:
+            batch = _resample(batch, self.size[0], self.size[1], self.method, self._relative_box())
+
+        batch = batch[:, :, ::-1] if self.flip_h else batch
+        batch = batch[:, ::-1] if self.flip_v else batch
+
+        if self.channels == 1:
+            batch = grayscale_batch(batch)
+        elif self.channels == 3:
+            batch = rgb_batch(batch)
+
+        return batch[0]
+
+
+# image modes which are converted to uint8 arrays and back without loss
+BATCH_MODES = ('L', 'RGB', 'RGBA')
+
+def images_to_batch(imgs):
+    """Stack images of the same size and mode into an array of shape (N, H, W, C).
+
+    Image arrays of the same shape and dtype are stacked as they are.
+    Returns None when the images can't be stacked."""
+    if imgs and all(is_image_array(img) for img in imgs):
+        shape, dtype = imgs[0].shape, imgs[0].dtype
+        if any(img.shape != shape or img.dtype != dtype for img in imgs):
+            return None
+        return np.stack(imgs)
+
+    if not imgs or not all(isinstance(img, ImageType) for img in imgs):
+        return None
+
+    mode, size = imgs[0].mode, imgs[0].size
+    if mode not in BATCH_MODES or any(img.mode != mode or img.size != size for img in imgs):
+        return None
+
+    batch = np.stack([np.asarray(img) for img in imgs])
+    return batch.reshape(batch.shape[:3] + (-1,))
+
+def batch_to_images(batch, like=None):
+    """Convert an uint8 array of shape (N, H, W, C) back to a list of images.
+
+    When like is an image array, return the rows of batch instead."""
+    if isinstance(like, np.ndarray):
+        return list(batch)
+
+    if batch.shape[3] == 1:
+        batch = batch[:, :, :, 0]
+    return [Image.fromarray(np.ascontiguousarray(arr)) for arr in batch]
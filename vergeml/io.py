@@ -1,4 +1,4 @@
-from vergeml.utils import parse_split, VergeMLError
+from vergeml.utils import parse_split, VergeMLError, file_state
 import random
 from typing import Optional, Any, List, Tuple
 import hashlib
@@ -10,6 +10,7 @@ from operator import methodcaller
 import io
 from vergeml.option import Option
 from vergeml.plugins import PLUGINS
+from vergeml.rng import RNG_MODES, sample_rng
 from copy import deepcopy
 from functools import reduce
 
@@ -50,6 +51,7 @@ class SourcePlugin:
     | test_num           | None          | test-split [2]     | --test         |
     | test_perc          | 10 [1]        | test-split [2]     | --test         |
     | input_patterns     | */**          | input-patterns [3] | N/A            |
+    | rng_mode           | compat        | data.rng [4]       | N/A            |
 
     [1] val_perc and test_perc are set to 10 only when the corresponding _dir and _val values are not set.
 
@@ -64,6 +66,8 @@ class SourcePlugin:
 
     [3] input-patterns is available to be set in YAML file when the SourcePlugin subclass defines input_patterns
         via @source
+
+    [4] the kind of per sample random generators, see sample_rng().
     """
 
 
@@ -78,10 +82,15 @@ class SourcePlugin:
         self.samples_dir = args.get('samples-dir', 'samples')
         self.cache_dir = args.get('cache-dir', '.cache')
         self.random_seed = args.get('random-seed', 42)
+        self.rng_mode = args.get('rng', 'compat')
         self.trainings_dir = args.get('trainings-dir', './trainings')
 
         self._cached_file_state = None
 
+        if self.rng_mode not in RNG_MODES:
+            raise VergeMLError("Invalid rng: {}".format(self.rng_mode),
+                               "Possible values are: {}.".format(", ".join(RNG_MODES)))
+
         spltype, splval = parse_split(args.get('val-split', '10%'))
         self.val_dir = splval if spltype == 'dir' else None
         self.val_num = splval if spltype == 'num' else None
@@ -99,6 +108,30 @@ class SourcePlugin:
         """Returns the total number of samples available in the split."""
         raise NotImplementedError
 
+    def sample_labels(self, split: str):
+        """Return the class ids of all samples in split or None when not known.
+
+        Used by samplers to balance or stratify samples by label. The class ids are
+        returned as a tuple (ids, offsets), where the ids of sample i are
+        ids[offsets[i]:offsets[i+1]] (see vergeml.utils.pack_rows).
+        """
+        return None
+
+    def sample_meta(self, split: str):
+        """Return the metadata of all samples in split as a MetaStore or None when not known.
+
+        Used to query samples by their metadata without reading them
+        (see vergeml.cache.MetaStore).
+        """
+        return None
+
+    def sample_repeats(self, split: str):
+        """Return how many times each sample in split is read per epoch or None.
+
+        Override this to oversample samples without duplicating them in the cache.
+        """
+        return None
+
     def read_samples(self, split: str, index: int, n: int=1) -> Sample:
         """Read a sample.
 
@@ -137,10 +170,29 @@ class SourcePlugin:
         """Return the sample with x and y transformed to its final form."""
         raise NotImplementedError
 
+    def transform_samples(self, samples):
+        """Transform an iterable of samples, yielding them in the same order.
+
+        The default implementation calls transform() for every sample. Override this
+        when samples can be transformed more efficiently as a group, e.g. by passing
+        them through a neural network in batches.
+        """
+        for sample in samples:
+            yield self.transform(sample)
+
     def output_shape(self):
         """Return the output shape after transform or None"""
         return None
 
+    def sample_rng(self, sample_id, compat_seed=None) -> random.Random:
+        """Return the random generator of the sample identified by sample_id (an int or string).
+
+        With rng 'counter', a vergeml.rng.CounterRandom keyed by the random seed and
+        sample_id is returned. Otherwise, the generator is seeded with compat_seed,
+        by default str(random_seed) + str(sample_id).
+        """
+        return sample_rng(self.rng_mode, self.random_seed, sample_id, compat_seed)
+
     def hash(self, state: str) -> str:
         """Generate a hash representing the current sample state.
 
@@ -276,7 +328,7 @@ class SourcePlugin:
 
             for (split, files) in files.items():
                 for path, _ in files:
-                    fstate = "{}{}{}{}".format(split, path, os.path.getmtime(path), os.path.getsize(path))
+                    fstate = split + file_state(path)
                     self._cached_file_state.write(fstate.encode('utf-8'))
 
         return self._cached_file_state.getvalue().decode("utf-8")
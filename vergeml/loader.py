@@ -6,13 +6,32 @@ import operator
 import os.path
 import threading
 import queue
+import hashlib
+import itertools
+import pickle
 
+from copy import copy
 from functools import reduce
 from typing import List
 
+import numpy as np
+
 from vergeml.io import Sample
-from vergeml.utils import SPLITS
-from vergeml.cache import MemoryCache, SerializedFileCache
+from vergeml.utils import SPLITS, VergeMLError, take_rows
+from vergeml.cache import MemoryCache, SerializedFileCache, MetaStore, SampleMeta
+from vergeml.operation import Pipeline
+from vergeml.rng import CounterRandom, rng_state, rng_from_state
+from vergeml.display import DISPLAY
+
+# number of samples read and processed at once when filling a cache
+_CHUNK_SIZE = 64
+
+class _PumpError: # pylint: disable=R0903
+    """Wraps an exception raised in the pump thread."""
+
+    def __init__(self, error):
+        self.error = error
+
 
 class _Pump(threading.Thread):
     """Continuously perform data loading in a background thread like a
@@ -26,31 +45,51 @@ class _Pump(threading.Thread):
     samples.
     """
 
-    def __init__(self, loader, split, ix_gen, max_items):
+    def __init__(self, loader, split, ix_gen, max_items, read_fn=None): # pylint: disable=R0913
         """
         :param loader: Object responsible for loading samples.
         :param split: train, val or test.
         :param ix_gen: An infinite generator yielding tuples (ix, n).
         :param max_items: The maximum number of samples to have in the
                           queue.
+        :param read_fn: A function (split, ix, n) called instead of the
+                        loader's perform_read.
         """
         super().__init__()
         self.ix_gen = ix_gen
+        self.read_fn = read_fn or loader.perform_read
         self.outq = queue.Queue(max_items)
         self.split = split
         self.loader = loader
         self.daemon = True
+        self.stopped = threading.Event()
 
 
     def run(self):
         self.loader.begin_read_samples()
 
-        while True:
-            index, n_samples = next(self.ix_gen)
-            samples = self.loader.perform_read(self.split, index, n_samples)
-
-            # Blocks when the queue is full (until samples are read).
-            self.outq.put((index, n_samples, samples))
+        for index, n_samples in self.ix_gen:
+            try:
+                samples = self.read_fn(self.split, index, n_samples)
+            except Exception as err: # pylint: disable=W0703
+                # raise the error in the thread reading from the pump
+                samples = _PumpError(err)
+
+            # Blocks when the queue is full (until samples are read or the
+            # pump is stopped).
+            while not self.stopped.is_set():
+                try:
+                    self.outq.put((index, n_samples, samples), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            if self.stopped.is_set():
+                break
+
+    def stop(self):
+        """Stop loading samples."""
+        self.stopped.set()
 
     def perform_read(self, _split: str, index: int, n_samples: int = 1):
         """Read samples from the queue which were previously read in the
@@ -65,6 +104,9 @@ class _Pump(threading.Thread):
         # block until the background thread puts samples in the queue)
         index_, n_samples_, samples = self.outq.get()
 
+        if isinstance(samples, _PumpError):
+            raise samples.error
+
         # Sanity check
         assert index_ == index
         assert n_samples_ == n_samples
@@ -84,9 +126,14 @@ class Loader:
         self.cache_dir = cache_dir
         self.input = input
         self.ops = ops or []
+        self.pipeline = Pipeline(self.ops)
         self.output = output
+
+        # when False, samples are not transformed to output after applying ops
+        self.transform = transform
         self.cache = {}
         self.pumps = {}
+        self._pump_keys = itertools.count()
 
         self._progress_callback = lambda n, t: None
 
@@ -109,8 +156,8 @@ class Loader:
         self._progress_callback = value
 
 
-    def pump(self, split, ix_gen, max_items=100):
-        """Set up the pump for a split.
+    def pump(self, split, ix_gen, max_items=100, read_fn=None):
+        """Set up a pump for a split and return its key.
 
         Typically used by a view to set up the pumping mechanism. This
         will start a background thread which will continuously load
@@ -118,12 +165,30 @@ class Loader:
 
         It works by receiving a generator which provides the pump with
         the index and number of the next samples to load. When
-        read_samples is called later, samples must be read in the same
-        order as previously returned by the generator.
+        read_samples is called later with the key of the pump, samples
+        must be read in the same order as previously returned by the
+        generator. Call stop_pump when the pump is no longer needed.
+
+        Optionally, read_fn(split, index, n_samples) replaces reading
+        samples, e.g. to build whole batches in the background. Its
+        results are returned by read_pump.
         """
-        if not split in self.pumps:
-            self.pumps[split] = _Pump(self, split, ix_gen, max_items)
-            self.pumps[split].start()
+        key = next(self._pump_keys)
+        self.pumps[key] = _Pump(self, split, ix_gen, max_items, read_fn)
+        self.pumps[key].start()
+        return key
+
+    def read_pump(self, key, index, n_samples):
+        """Return the next result of the pump with key unchanged.
+        """
+        return self.pumps[key].perform_read(None, index, n_samples)
+
+    def stop_pump(self, key):
+        """Stop the pump with key and discard the samples it has loaded.
+        """
+        pump = self.pumps.pop(key, None)
+        if pump:
+            pump.stop()
 
     def begin_read_samples(self):
         """Prepare to start reading samples.
@@ -135,22 +200,98 @@ class Loader:
         """
         return len(self.cache[split])
 
-    def read_samples(self, split: str, index: int, n_samples: int = 1) -> Sample:
+    def sample_labels(self, split: str):
+        """Get the class ids of the samples in split after applying ops.
+        """
+        labels = self.input.sample_labels(split)
+
+        if labels is None:
+            return None
+
+        ids, offsets = labels
+        rows = np.repeat(np.arange(len(offsets) - 1), self._integer_multiplier(split))
+        return take_rows(ids, offsets, rows)
+
+    def sample_repeats(self, split: str):
+        """Get the number of times each sample in split is read per epoch after applying ops.
+        """
+        repeats = self.input.sample_repeats(split)
+
+        if repeats is None:
+            return None
+
+        return np.repeat(repeats, self._integer_multiplier(split))
+
+    def sample_meta(self, split: str):
+        """Get the metadata of the samples in split after applying ops as a MetaStore or None.
+        """
+        metas = self.input.sample_meta(split)
+
+        if metas is None:
+            return None
+
+        return metas.take(np.repeat(np.arange(len(metas)), self._integer_multiplier(split)))
+
+    def query(self, split: str, label=None, **conditions) -> np.ndarray:
+        """Return the indices of the samples in split matching label and the metadata conditions.
+
+        label is a label name or a list of names, and conditions are passed to
+        MetaStore.query(), e.g. loader.query('val', label='cat', filename='*.png').
+        Samples are not read.
+        """
+        res = np.arange(self.num_samples(split))
+
+        if conditions:
+            metas = self.sample_meta(split)
+
+            if metas is None:
+                raise VergeMLError("The data source does not support querying sample metadata.")
+
+            res = metas.query(**conditions)
+
+        if label is not None:
+            labels = self.sample_labels(split)
+
+            if labels is None:
+                raise VergeMLError("Can't query by label with a data source without labels.")
+
+            ids, offsets = labels
+            names = [label] if isinstance(label, str) else list(label)
+            label_ids = [i for i, name in enumerate(self.meta.get('labels') or []) if name in names]
+
+            # a sample matches when it has any of the labels
+            owners = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            res = np.intersect1d(res, owners[np.isin(ids, label_ids)])
+
+        return res
+
+    def read_samples(self, split: str, index: int, n_samples: int = 1, pump=None) -> Sample:
         """Read n_samples starting at index from the cache.
+
+        When the key of a pump is given, the samples are taken from the pump.
         """
         samples = []
 
         # either read from a pump or directly from self.
-        reader = self.pumps.get(split, self)
+        reader = self.pumps[pump] if pump is not None else self
 
         for item in reader.perform_read(split, index, n_samples):
             x, y = item[0] # pylint: disable=C0103
 
             meta, rng = item[1]
+            if isinstance(meta, SampleMeta):
+                meta = meta.copy()
             samples.append(Sample(x, y, meta, rng))
 
         return samples
 
+    def read_arrays(self, split: str, index: int, n_samples: int = 1):
+        """Read n_samples starting at index as a tuple of arrays (xs, ys) without creating samples.
+
+        Returns None when the samples can't be read as arrays.
+        """
+        return None
+
     def perform_read(self, split: str, index: int, n_samples: int = 1):
         """Perform the actual read operation on the cache object.
         """
@@ -171,6 +312,16 @@ class Loader:
 
         return int(num_samples * multiplier)
 
+    def _integer_multiplier(self, split):
+        """Get the multiplier of ops, which must be a whole number for per sample data.
+        """
+        multiplier = reduce(operator.mul, map(lambda op: _get_multiplier(split, op), self.ops), 1)
+
+        if multiplier != int(multiplier):
+            raise VergeMLError("Can't sample with operations that change the number of samples by a fraction.")
+
+        return int(multiplier)
+
     def _calculate_hashed_state(self):
         """Get a hash representing the set of samples and the configuration.
         """
@@ -185,37 +336,245 @@ class Loader:
             out_state = self.output.__class__.__name__ + \
                 str(sorted(self.output.configuration().items()))
 
+            if not self.transform:
+                out_state += "-untransformed"
+
             # and append it to state
             state = "-".join([state, ops_state, out_state])
 
         # input will handle hashing the state of sample data
         return self.input.hash(state)
 
-    def _iter_samples(self, split, raw=False):
-        """Iterate samples possibly applying operations.
-        """
+    def _pipeline(self, split, raw=False):
+        """Return the functions (readfn, opfn, tffn) to read, process and transform samples.
 
-        num_samples = self.input.num_samples(split)
-        readfn = lambda i: self.input.read_samples(split, i)[0]
-        opfn = lambda s: [s]
-        tffn = lambda s: s
+        opfn takes a list of samples and returns a list of output samples for each.
+        """
+        readfn = lambda i, n: self.input.read_samples(split, i, n)
+        opfn = lambda samples: [[sample] for sample in samples]
+        tffn = lambda samples: samples
 
         # apply operations
         if self.ops:
-            op1, *oprest = self.ops
-            opfn = lambda s: op1.process(s, oprest)
+            opfn = lambda samples: _process_samples(self.pipeline, samples, split)
 
         if raw and not self.output:
         # read raw samples
-            readfn = lambda i: self.input.read_raw_samples(split, i)[0]
-        elif self.output:
-        # transform the sample to output
-            tffn = self.output.transform
+            readfn = lambda i, n: self.input.read_raw_samples(split, i, n)
+        elif self.output and self.transform:
+        # transform the samples to output
+            tffn = self.output.transform_samples
+
+        return readfn, opfn, tffn
+
+    def _iter_samples(self, split, raw=False):
+        """Iterate samples possibly applying operations.
+        """
+
+        num_samples = self.input.num_samples(split)
+        readfn, opfn, tffn = self._pipeline(split, raw)
+
+        def _processed():
+            for start in range(0, num_samples, _CHUNK_SIZE):
+                samples = readfn(start, min(_CHUNK_SIZE, num_samples - start))
+                yield from itertools.chain.from_iterable(opfn(samples))
+
+        yield from tffn(_processed())
+
+    def _iter_unique_samples(self, split, raw=False):
+        """Iterate samples like _iter_samples, but process identical input samples only once.
+
+        Yields tuples (sample, first). For a duplicate, first is the position of the
+        identical output sample yielded earlier and sample only carries meta and rng.
+        Otherwise first is None.
+
+        Duplicates are only detected when all ops are deterministic, since the output of
+        random operations differs even for identical input. Samples are identical when x
+        has the same content and y is equal. Identical x with different labels are
+        processed separately and reported with a warning.
+        """
+        if not (self.ops or self.output) or not all(getattr(op, 'deterministic', False) for op in self.ops):
+            for sample in self._iter_samples(split, raw):
+                yield sample, None
+            return
+
+        num_samples = self.input.num_samples(split)
+        readfn, opfn, tffn = self._pipeline(split, raw)
+
+        # maps the keys of input samples to the position and number of their output samples
+        entries = _DigestIndex(2)
+        # maps the content of x to the label digest of its first occurrence
+        labels = _DigestIndex(2)
+        conflicts, example = 0, None
+        pos = 0
+
+        # read samples in chunks so that the output can transform unique samples together
+        for start in range(0, num_samples, _CHUNK_SIZE):
+            samples = readfn(start, min(_CHUNK_SIZE, num_samples - start))
+            pairs = [(_content_key(sample.x), _label_key(sample.y)) for sample in samples]
+
+            # the label digests of the contents seen in earlier chunks
+            contents = list({x_key for x_key, y_key in pairs if x_key is not None and y_key is not None})
+            first_labels = {x_key: value.tobytes() for x_key, value in zip(contents, labels.lookup(contents))
+                            if value is not None}
+            new_labels = {}
+            keys = []
+
+            for sample, (x_key, y_key) in zip(samples, pairs):
+                if x_key is None or y_key is None:
+                    # samples which can't be compared are always processed
+                    keys.append(object())
+                    continue
+
+                y_digest = _digest(pickle.dumps(y_key))
+
+                if x_key not in first_labels:
+                    first_labels[x_key] = new_labels[x_key] = y_digest
+                elif first_labels[x_key] != y_digest:
+                    conflicts += 1
+                    example = example or sample.meta.get('filename')
+
+                keys.append(_digest(x_key + y_digest))
+
+            labels.add(list(new_labels), [np.frombuffer(digest, dtype='int64') for digest in new_labels.values()])
+
+            digests = [key for key in keys if isinstance(key, bytes)]
+            seen = {key: tuple(value) for key, value in zip(digests, entries.lookup(digests))
+                    if value is not None}
+
+            new = {}
+            for key, sample in zip(keys, samples):
+                if key not in seen and key not in new:
+                    new[key] = sample
+
+            unique = dict(zip(new.keys(), opfn(list(new.values()))))
+            outputs = iter(tffn(itertools.chain.from_iterable(unique.values())))
+            added = {}
+
+            for key, sample in zip(keys, samples):
+                if key in unique and key not in seen:
+                    seen[key] = added[key] = (pos, len(unique[key]))
+                    for _ in range(len(unique[key])):
+                        yield next(outputs), None
+                else:
+                    first, count = seen[key]
+                    for position in range(first, first + count):
+                        yield Sample(None, None, sample.meta, sample.rng), position
+
+                pos += seen[key][1]
+
+            added = {key: value for key, value in added.items() if isinstance(key, bytes)}
+            entries.add(list(added), list(added.values()))
+
+        if conflicts:
+            # identical content with different labels is kept as separate samples
+            DISPLAY.print("Warning: {} {} samples have the same content as a sample with a different label,"
+                          " e.g. {}.".format(conflicts, split, example))
+
+
+class _DigestIndex:
+    """Map 16 byte digests to rows of int64 values in sorted arrays.
+
+    Used instead of a dict when there is an entry per sample of a split.
+    """
+
+    def __init__(self, width):
+        self.keys = np.zeros(0, dtype='S16')
+        self.values = np.zeros((0, width), dtype='int64')
+
+    def lookup(self, keys):
+        """Return a list of the value rows of keys, with None for missing keys."""
+        if not len(self.keys) or not keys:
+            return [None] * len(keys)
+
+        arr = np.array(keys, dtype='S16')
+        pos = np.minimum(np.searchsorted(self.keys, arr), len(self.keys) - 1)
+        found = self.keys[pos] == arr
+        return [self.values[p] if f else None for p, f in zip(pos, found)]
+
+    def add(self, keys, values):
+        """Add keys which are not in the index yet."""
+        if not keys:
+            return
+
+        keys = np.concatenate([self.keys, np.array(keys, dtype='S16')])
+        values = np.concatenate([self.values, np.array(values, dtype='int64')])
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.values = keys[order], values[order]
+
+
+def _process_samples(pipeline, samples, split):
+    """Process samples of split with pipeline, returning a list of output samples for each sample.
+
+    The samples are processed as one batch when every operation supports it.
+    """
+    processed = _process_batch(pipeline.ops, samples, split)
+
+    if processed is not None:
+        return [[sample] for sample in processed]
+
+    return [pipeline.process(sample, split) for sample in samples]
+
+
+def _process_batch(ops, samples, split):
+    """Process the images of samples as one array, or return None when not possible.
+    """
+    if len(samples) < 2 or not all(op.supports_batch() for op in ops):
+        return None
 
-        for index in range(num_samples):
-            sample = readfn(index)
-            for sample_ in opfn(sample):
-                yield tffn(sample_)
+    # Pillow is only required when processing images
+    from vergeml.img import is_image, images_to_batch, batch_to_images
+
+    xs = images_to_batch([sample.x for sample in samples])
+
+    if xs is None or any(is_image(sample.y) for sample in samples):
+        return None
+
+    rngs = [sample.rng for sample in samples]
+
+    for op in ops:
+        xs = op.process_batch(xs, rngs, split)
+
+    return [Sample(x, sample.y, sample.meta, sample.rng)
+            for x, sample in zip(batch_to_images(xs, samples[0].x), samples)]
+
+
+def _content_key(x):
+    """Return a digest of the payload x, or None when x can't be compared.
+
+    Arrays, images and bytes are hashed directly, other payloads are pickled.
+    """
+    if isinstance(x, np.ndarray):
+        prefix, data = "{}{}".format(x.dtype.str, x.shape), np.ascontiguousarray(x)
+    elif hasattr(x, 'tobytes') and hasattr(x, 'mode'):
+        # a PIL image
+        prefix, data = "{}{}".format(x.mode, x.size), x.tobytes()
+    elif isinstance(x, (bytes, bytearray, memoryview)):
+        prefix, data = "", x
+    else:
+        try:
+            prefix, data = "", pickle.dumps(x)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return None
+
+    digest = hashlib.blake2b(prefix.encode('utf-8'), digest_size=16)
+    digest.update(data)
+    return digest.digest()
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def _label_key(y):
+    """Return a hashable key of the label y, or None when y can't be compared."""
+    if y is None or isinstance(y, (str, int, float)):
+        return (y,)
+
+    if isinstance(y, np.ndarray):
+        return (y.dtype.str, y.shape, y.tobytes())
+
+    return _content_key(y)
 
 
 def _get_multiplier(split, operation):
@@ -247,19 +606,34 @@ class MemoryCachedLoader(Loader):
         self._progress_callback(-1, total)
         for split in SPLITS:
             cache = self.cache[split]
-            for sample in self._iter_samples(split):
-                cache.write((sample.x, sample.y), (sample.meta, sample.rng))
+            for sample, first in self._iter_unique_samples(split):
+                if first is None:
+                    cache.write((sample.x, sample.y), (sample.meta, sample.rng))
+                else:
+                    cache.link(first, (sample.meta, sample.rng))
                 self._progress_callback(i, total)
                 i = i + 1
 
         self.input.end_read_samples()
 
+    def sample_meta(self, split: str):
+        return MetaStore(meta for _, (meta, _) in self.cache[split].data)
+
 
 
 class FileCachedLoader(Loader):
     """Cache sample data in a file cache.
     """
 
+    def __init__(self, cache_dir, input, ops=None, output=None, transform=True, # pylint: disable=W0622,R0913
+                 dtypes=None):
+        """
+        :param dtypes: a dict of the storage dtypes of x and y arrays, e.g.
+                       {'x': 'float16', 'y': 'class-ids'} (see vergeml.cache.STORAGE_DTYPES)
+        """
+        super().__init__(cache_dir, input, ops, output, transform)
+        self.dtypes = dtypes or {}
+
     def begin_read_samples(self):
         if self.cache:
             return
@@ -287,10 +661,12 @@ class FileCachedLoader(Loader):
                 for split, path in paths:
                     if not os.path.exists(path):
                         # we compress output data since its likely to be numpy arrays
-                        cache = SerializedFileCache(path, "w", compress=bool(self.output))
+                        dtypes = (self.dtypes.get('x'), self.dtypes.get('y'))
+                        cache = SerializedFileCache(path, "w", compress=bool(self.output), dedup=True,
+                                                    dtypes=dtypes)
 
-                        for sample in self._iter_samples(split, raw=True):
-                            cache.write((sample.x, sample.y), (sample.meta, sample.rng))
+                        for sample, first in self._iter_unique_samples(split, raw=True):
+                            self._write_sample(cache, sample, first)
                             self._progress_callback(i, total)
                             i += 1
                         cache.close()
@@ -320,8 +696,34 @@ class FileCachedLoader(Loader):
 
 
 
-    def read_samples(self, split: str, index: int, n_samples: int = 1) -> List[Sample]:
-        samples = super().read_samples(split, index, n_samples)
+    def sample_meta(self, split: str):
+        metas = self.cache[split].cnt.meta
+
+        # caches written by earlier versions store metadata in a list
+        if isinstance(metas, list):
+            return MetaStore(entry[0] if entry else None for entry in metas)
+
+        return metas.store
+
+    def _calculate_hashed_state(self):
+        hashed_state = super()._calculate_hashed_state()
+
+        # arrays stored with less precision change the cached data
+        if self.dtypes:
+            hashed_state += "-" + "-".join("{}-{}".format(k, v) for k, v in sorted(self.dtypes.items()))
+
+        return hashed_state
+
+    def _write_sample(self, cache, sample, first):
+        """Write sample to cache, or link it to the identical sample at first.
+        """
+        if first is None:
+            cache.write((sample.x, sample.y), (sample.meta, sample.rng))
+        else:
+            cache.link(first, (sample.meta, sample.rng))
+
+    def read_samples(self, split: str, index: int, n_samples: int = 1, pump=None) -> List[Sample]:
+        samples = super().read_samples(split, index, n_samples, pump)
         if not self.output:
             samples = [self.input.recover_raw_sample(sample) for sample in samples]
         return samples
@@ -330,13 +732,80 @@ class FileCachedLoader(Loader):
         return os.path.join(self.cache_dir, "{}-{}.cache".format(hashed_state, split))
 
 
+class PyramidCachedLoader(FileCachedLoader):
+    """Cache input images on disk together with downscaled copies of them.
+
+    Each image is stored at its original size followed by one copy per level of
+    the pyramid (see vergeml.img.PYRAMID_LEVELS) smaller than the image. When
+    target is set to the (width, height, mode) images are resized to, samples are
+    read from the smallest copy which does not need to be upscaled.
+    Since the cache does not depend on the operations, changing the size images
+    are resized to does not require reading the original images again.
+    """
+
+    def __init__(self, cache_dir, input, levels=None, target=None): # pylint: disable=W0622
+        super().__init__(cache_dir, input)
+
+        # Pillow is only required when caching images
+        from vergeml.img import PYRAMID_LEVELS
+
+        self.levels = tuple(levels or PYRAMID_LEVELS)
+        self.target = target
+
+        # the positions of the entries holding the original samples in each split
+        self.entries = None
+
+    def begin_read_samples(self):
+        super().begin_read_samples()
+
+        if self.entries is None:
+            self.entries = {split: [i for i, meta in enumerate(self.cache[split].cnt.meta) if meta]
+                            for split in SPLITS}
+
+    def num_samples(self, split: str) -> int:
+        return len(self.entries[split])
+
+    def sample_meta(self, split: str):
+        return super().sample_meta(split).take(self.entries[split])
+
+    def perform_read(self, split: str, index: int, n_samples: int = 1):
+        from vergeml.img import pyramid_level
+
+        cache = self.cache[split]
+        res = []
+
+        for entry in self.entries[split][index:index+n_samples]:
+            meta, rng, sizes = cache.cnt.meta[entry]
+            level = pyramid_level(sizes, *self.target) if self.target else 0
+            data, _ = cache.read(entry + level, 1)[0]
+            res.append((data, (meta, rng)))
+
+        return res
+
+    def _write_sample(self, cache, sample, first):
+        from vergeml.img import ImageType, pyramid_levels
+
+        levels = pyramid_levels(sample.x, self.levels) if isinstance(sample.x, ImageType) else []
+        sizes = [getattr(sample.x, 'size', None)] + [img.size for img in levels]
+
+        # only the original carries meta data, so its entry can be told from the levels
+        cache.write((sample.x, sample.y), (sample.meta, sample.rng, sizes))
+
+        for img in levels:
+            cache.write((img, sample.y), None)
+
+    def _calculate_hashed_state(self):
+        return super()._calculate_hashed_state() + "-pyramid-" + \
+            "-".join(map(str, sorted(self.levels)))
+
+
 class LiveLoader(Loader):
     """Load live sample data without caching.
     """
 
     multipliers = None
     rngs = None
-    transform = True
+    epochs = None
 
     def begin_read_samples(self):
         if self.cache:
@@ -349,6 +818,7 @@ class LiveLoader(Loader):
 
         self.multipliers = {}
         self.rngs = {}
+        self.epochs = {}
 
         def _mul(split):
             return reduce(operator.mul, map(lambda op: _get_multiplier(split, op), self.ops), 1)
@@ -357,6 +827,7 @@ class LiveLoader(Loader):
             self.multipliers[split] = _mul(split)
             self.cache[split] = self._calculate_num_samples(split)
             self.rngs[split] = self.cache[split] * [None]
+            self.epochs[split] = np.zeros(self.cache[split], dtype='uint32')
 
         self.input.end_read_samples()
 
@@ -368,32 +839,102 @@ class LiveLoader(Loader):
     def perform_read(self, split: str, index: int, n_samples: int = 1): # pylint: disable=R0914
 
         mul = self.multipliers[split]
-        offset = int(index % mul)
-        start_index = int(index/mul)
-        end_index = int((index+n_samples)/mul)
-        read = max(1, int(n_samples/mul) + int(min(1, index%mul)))
+        variants = self.pipeline.num_variants(split) if self.output and self.ops else None
 
-        res = []
+        if variants and variants > 1:
+            res = self._read_variants(split, index, n_samples, variants)
+
+        else:
+            offset = int(index % mul)
+            start_index = int(index/mul)
+            read = max(1, int(n_samples/mul) + int(min(1, index%mul)))
 
-        samples = self.input.read_samples(split, start_index, read)
-        if self.output and self.ops:
-            op1, *oprest = self.ops
+            samples = self.input.read_samples(split, start_index, read)
 
-            for sample in samples:
-                res.extend(op1.process(sample, oprest))
+            if mul == 1:
+                for i, sample in enumerate(samples, index):
+                    sample.rng = self._epoch_rng(split, i, sample.rng)
 
-        else:
-            res = samples
+            if self.output and self.ops:
+                res = list(itertools.chain.from_iterable(_process_samples(self.pipeline, samples, split)))
+
+            else:
+                res = samples
+
+            res = res[offset: offset+n_samples]
 
         if self.output and self.transform:
-            res = [self.output.transform(sample) for sample in res]
+            res = list(self.output.transform_samples(res))
 
-        for sample, i in zip(res, range(start_index, end_index)):
+        # counter generators are stored as their state of two integers
+        for i, sample in enumerate(res, index):
             if self.rngs[split][i] is None:
-                self.rngs[split][i] = sample.rng
+                self.rngs[split][i] = rng_state(sample.rng)
             else:
-                sample.rng = self.rngs[split][i]
-
-        res = res[offset: offset+n_samples]
+                sample.rng = rng_from_state(self.rngs[split][i])
 
         return list(map(lambda s: ((s.x, s.y), (s.meta, s.rng)), res))
+
+    def read_arrays(self, split: str, index: int, n_samples: int = 1):
+        # without operations, sources which read arrays are read without creating samples
+        if self.ops or not hasattr(self.input, 'read_arrays'):
+            return None
+
+        transform = None
+
+        if self.output and self.transform:
+            transform = getattr(self.output, 'transform_arrays', None)
+
+            if transform is None:
+                return None
+
+        arrays = self.input.read_arrays(split, index, n_samples)
+        return transform(*arrays) if transform and arrays is not None else arrays
+
+    def _read_variants(self, split, index, n_samples, variants):
+        """Read the augmented samples at index, running the pipeline once per sample.
+
+        The variants of samples with 'compat' generators draw from one shared generator
+        in turn, so all variants are produced in order and the requested ones are picked.
+        """
+        start_index = index // variants
+        end_index = (index + n_samples - 1) // variants + 1
+        samples = self.input.read_samples(split, start_index, end_index - start_index)
+
+        res = []
+        processed = {}
+
+        for i in range(index, index + n_samples):
+            sample = samples[i // variants - start_index]
+            rng = sample.rng
+
+            if not isinstance(rng, CounterRandom):
+                outputs = processed.get(i // variants)
+                if outputs is None:
+                    outputs = processed[i // variants] = self.pipeline.process(sample, split)
+                if i % variants < len(outputs):
+                    res.append(outputs[i % variants])
+                continue
+
+            # each variant of a sample starts with the same random numbers
+            if i + 1 < index + n_samples and (i + 1) % variants:
+                rng = copy(rng)
+
+            rng = self._epoch_rng(split, i, rng)
+
+            sample = self.pipeline.process_variant(Sample(sample.x, sample.y, sample.meta, rng),
+                                                   split, i % variants)
+            if sample is not None:
+                res.append(sample)
+
+        return res
+
+    def _epoch_rng(self, split, index, rng):
+        """Return the generator of the sample at index for the epoch it is read in.
+
+        Counter generators get a stream of their own each time the sample is read,
+        derived from their key and the number of earlier reads.
+        """
+        epoch = int(self.epochs[split][index])
+        self.epochs[split][index] += 1
+        return rng.derive(epoch=epoch) if epoch and isinstance(rng, CounterRandom) else rng
@@ -1,11 +1,14 @@
-from typing import List, Generator, Any, Tuple, Union
+from typing import List, Generator, Any, Tuple, Union, Optional
+import itertools
 import operator
 import random
+import numpy as np
 from vergeml.io import Sample
 from vergeml.utils import VergeMLError, SPLITS
 from copy import copy
 from vergeml.option import option, Option
 from vergeml.plugins import PLUGINS
+from vergeml.rng import op_rng, replay
 
 _OPERATION_META_KEY = '__vergeml_operation__'
 
@@ -62,8 +65,29 @@ class BaseOperation:
 
     When an operation changes the number of output samples, it must return the
     factor in multiplier().
+
+    When the output of an operation only depends on its input and not on random
+    numbers, it should set deterministic to True. This allows the data loader to
+    process identical samples only once.
+
+    Operations which only crop, flip or resize images can set geometric to True
+    and implement transform_geometry(), so that consecutive geometric operations
+    are fused into one step (see fuse_ops()). Operations which resample the image
+    must also set resamples to True.
+
+    Operations whose output does not depend on the resolution of images, like
+    flips, can set scale_invariant to True. Images may then be read from a pyramid
+    cache at a lower resolution before running them (see pyramid_target()).
     """
 
+    deterministic = False
+
+    geometric = False
+
+    resamples = False
+
+    scale_invariant = False
+
     def configuration(self):
         """Return the configuration of the BaseOperation instance.
 
@@ -91,6 +115,29 @@ class BaseOperation:
         """Return the factor by which the operation changes the number of output samples"""
         return 1.0
 
+    def supports_batch(self) -> bool:
+        """Return True when the operation can process a batch of images with process_batch()."""
+        return False
+
+    def resize_target(self) -> Optional[Tuple[int, int, str]]:
+        """Return (width, height, mode) when the operation resizes every image x to a fixed size."""
+        return None
+
+    def process_batch(self, xs: np.ndarray, rngs: List[random.Random], split: str) -> np.ndarray:
+        """Process the images of a batch of samples at once.
+
+        :param xs: An array of shape (N, H, W, C) holding the images of N samples
+        :param rngs: The random generators of the samples
+        :param split: The split of the samples
+
+        :return: The processed array of shape (N, H', W', C')
+
+        Only called when supports_batch() returns True for every operation in the
+        pipeline and the ground truth of the samples is not an image. It must yield
+        the same result as processing the samples one at a time with process().
+        """
+        raise NotImplementedError
+
 
 class OperationPlugin(BaseOperation):
     """Simplified Operations.
@@ -167,18 +214,16 @@ class OperationPlugin(BaseOperation):
         when they are images with different sizes and they need to be resized to have
         the same size, override this method.
         """
-        rngstate = rng.getstate()
+        rewind = replay(rng)
         appxy = self.apply.intersection({'x', 'y'})
 
         if not appxy or 'x' in self.apply:
             if _type_good(self.type, type(x)):
-                rng.setstate(rngstate)
-                x = self.transform(x, rng)
+                x = self.transform(x, rewind())
 
         if not appxy or 'y' in self.apply:
             if _type_good(self.type, type(y)):
-                rng.setstate(rngstate)
-                y = self.transform(y, rng)
+                y = self.transform(y, rewind())
 
         return x, y
 
@@ -195,9 +240,56 @@ class OperationPlugin(BaseOperation):
                 and sample.meta['split'] not in self.apply:
             yield sample
         else:
-            x, y = self.transform_xy(sample.x, sample.y, sample.rng)
+            x, y = self.transform_xy(sample.x, sample.y, op_rng(sample.rng))
             yield Sample(x, y, sample.meta, sample.rng)
 
+    def transform_batch(self, xs: np.ndarray, rngs: List[random.Random]) -> np.ndarray:
+        """Transform the images of a batch of samples at once.
+
+        :param xs: An array of shape (N, H, W, C)
+        :param rngs: The random generators of the samples
+
+        :return: The transformed array
+
+        Implementing this method is optional. Draw random parameters from each rng
+        in the same order as transform_xy() does and collect them in arrays, so that
+        a batch is transformed exactly like its samples one at a time.
+        """
+        raise NotImplementedError
+
+    def transform_geometry(self, geos: List[Any], rng: random.Random) -> None:
+        """Record the transformation of x and y in their geometries.
+
+        :param geos: a list [geo_x, geo_y] of vergeml.img.Geometry objects, or None
+                     when x or y is not an image
+        :param rng: random generator
+
+        Only called when geometric is True. Draw random parameters from rng in the
+        same order as transform_xy() does.
+        """
+        raise NotImplementedError
+
+    def transform_variant(self, sample: Sample, index: int) -> Sample:
+        """Return the output at index of transform_sample() without producing the others.
+
+        :param sample: the sample to transform
+        :param index: the index of the output sample
+
+        Implementing this method is optional. It lets a live loader read single
+        variants of samples produced by operations like augment.
+        """
+        raise NotImplementedError
+
+    def supports_batch(self):
+        # apply x or y is only supported per sample
+        return type(self).transform_batch is not OperationPlugin.transform_batch \
+            and not self.apply.intersection({'x', 'y'})
+
+    def process_batch(self, xs, rngs, split):
+        if self.apply.intersection(set(SPLITS)) and split not in self.apply:
+            return xs
+        return self.transform_batch(xs, [op_rng(rng) for rng in rngs])
+
     def process(self, sample: Sample, ops=List[BaseOperation]) -> Generator[Sample, None, None]:
 
         for s1 in self.transform_sample(sample):
@@ -215,6 +307,281 @@ class OperationPlugin(BaseOperation):
         return self.__dict__.copy()
 
 
+class FusedOperation(BaseOperation):
+    """Run consecutive geometric operations as a single crop or resize per image.
+    """
+
+    def __init__(self, ops):
+        self.ops = ops
+
+    @property
+    def deterministic(self):
+        return all(op.deterministic for op in self.ops)
+
+    def configuration(self):
+        return {'fused': [sorted(op.configuration().items()) for op in self.ops]}
+
+    def process(self, sample: Sample, ops=List[BaseOperation]) -> Generator[Sample, None, None]:
+        s1 = self.process_sample(sample)
+
+        if not ops:
+            yield s1
+        else:
+            nextop, *rest = ops
+            yield from nextop.process(s1, rest)
+
+    def process_sample(self, sample: Sample) -> Sample:
+        """Return the transformed sample."""
+        # Pillow is only required when processing images
+        from vergeml.img import Geometry, is_image, image_size
+
+        data = (sample.x, sample.y)
+        geos = [Geometry(*image_size(d)) if is_image(d) else None for d in data]
+
+        for op in self.ops:
+            if not op.apply.intersection(set(SPLITS)) or sample.meta['split'] in op.apply:
+                op.transform_geometry(geos, op_rng(sample.rng))
+
+        x, y = [geo.apply(d) if geo else d for geo, d in zip(geos, data)]
+        return Sample(x, y, sample.meta, sample.rng)
+
+
+def fuse_ops(ops):
+    """Return ops with each run of consecutive geometric operations replaced by a FusedOperation.
+
+    A run holds at most one operation which resamples the image. Nothing is fused when
+    all operations can process batches, because batches are processed as one array.
+    """
+    if all(op.supports_batch() for op in ops):
+        return list(ops)
+
+    res, run = [], []
+
+    def _end_run():
+        res.extend([FusedOperation(run)] if len(run) > 1 else run)
+
+    for op in ops:
+        # apply x or y is only supported per operation
+        fusable = op.geometric and not op.apply.intersection({'x', 'y'})
+
+        if not fusable or (op.resamples and any(other.resamples for other in run)):
+            _end_run()
+            run = []
+
+        if fusable:
+            run.append(op)
+        else:
+            res.append(op)
+
+    _end_run()
+    return res
+
+
+def pyramid_target(ops):
+    """Return the (width, height, mode) images are resized to by ops, or None.
+
+    Only a resize which is preceded by scale invariant operations counts, since
+    images can then be downscaled before running ops without changing the result
+    much.
+    """
+    for op in ops:
+        target = op.resize_target()
+
+        if target:
+            return target
+
+        if not op.scale_invariant:
+            return None
+
+    return None
+
+
+def split_ops(ops):
+    """Split ops into the longest prefix of deterministic operations and the remaining ops.
+
+    Operations which change the number of samples end the prefix, so that the output
+    of the prefix holds one sample per input sample.
+    """
+    pos = 0
+
+    while pos < len(ops) and ops[pos].deterministic and ops[pos].multiplier() == 1:
+        pos += 1
+
+    return list(ops[:pos]), list(ops[pos:])
+
+
+class Pipeline:
+    """Run samples through a list of operations in a flat loop.
+
+    For each split, the pipeline is compiled once into a list of stages: operations
+    which are not applied to the split are left out and it is precomputed whether
+    an operation is applied to x and y. Only operations which produce several
+    samples from one, like augment, are run through transform_sample() or process().
+    """
+
+    def __init__(self, ops):
+        self.ops = list(ops)
+        self.stages = {}
+        self.variants = {}
+
+    def _stages(self, split):
+        if split not in self.stages:
+            self.stages[split] = [stage for stage in map(lambda op: _compile(op, split), self.ops)
+                                  if stage]
+        return self.stages[split]
+
+    def process(self, sample: Sample, split: str) -> List[Sample]:
+        """Return the list of output samples for sample of split."""
+        stages = self._stages(split)
+        res = []
+
+        # samples from operations with several outputs are processed depth first,
+        # because their outputs may share the same random generator
+        todo = [(iter((sample,)), 0)]
+
+        while todo:
+            samples, pos = todo[-1]
+            sample = next(samples, None)
+
+            if sample is None:
+                todo.pop()
+                continue
+
+            while pos < len(stages) and not stages[pos][0]:
+                sample = stages[pos][1](sample)
+                pos += 1
+
+            if pos == len(stages):
+                res.append(sample)
+            else:
+                todo.append((iter(stages[pos][1](sample)), pos + 1))
+
+        return res
+
+    def num_variants(self, split: str) -> Optional[int]:
+        """Return the number of output samples per input sample of split.
+
+        Returns None when the operations change the number of samples by a fraction,
+        in which case process_variant() can't be used.
+        """
+        self._variant_stages(split)
+        return self.variants[split][0]
+
+    def process_variant(self, sample: Sample, split: str, index: int) -> Optional[Sample]:
+        """Return the output sample at index of process(), or None if there is none.
+
+        Operations implementing transform_variant() only produce the requested
+        sample. Other operations with several outputs are run in full.
+        """
+        stages = self._variant_stages(split)
+        assert stages is not None, "num_variants() is fractional"
+
+        for fan_out, fun, variant, radix in stages:
+            if not fan_out:
+                sample = fun(sample)
+                continue
+
+            pos, index = divmod(index, radix)
+
+            if variant:
+                sample = variant(sample, pos)
+            else:
+                sample = next(itertools.islice(fun(sample), pos, None), None)
+
+            if sample is None:
+                return None
+
+        return sample
+
+    def _variant_stages(self, split):
+        if split in self.variants:
+            return self.variants[split][1]
+
+        stages, radix = [], 1
+
+        # the number of outputs per input of each stage, which must be whole numbers
+        for op in reversed(self.ops):
+            stage = _compile(op, split)
+
+            if not stage:
+                continue
+
+            fan_out, fun = stage
+            variant = None
+
+            if isinstance(op, OperationPlugin) \
+                    and type(op).transform_variant is not OperationPlugin.transform_variant:
+                variant = op.transform_variant
+
+            stages.insert(0, (fan_out, fun, variant, radix))
+
+            if fan_out:
+                mul = op.multiplier()
+
+                if getattr(op, 'apply', None) and op.apply.intersection(SPLITS) \
+                        and split not in op.apply:
+                    mul = 1
+
+                if mul != int(mul):
+                    self.variants[split] = None, None
+                    return None
+
+                radix *= int(mul)
+
+        self.variants[split] = radix, stages
+        return stages
+
+
+def _compile(op, split):
+    """Return a stage (fan_out, fun) running op on samples of split, or None to skip op.
+
+    When fan_out is False, fun returns a sample, otherwise an iterable of samples.
+    """
+    if isinstance(op, FusedOperation):
+        return False, op.process_sample
+
+    if not isinstance(op, OperationPlugin) or type(op).process is not OperationPlugin.process:
+        return True, lambda sample: op.process(sample, [])
+
+    if type(op).transform_sample is not OperationPlugin.transform_sample:
+        return True, op.transform_sample
+
+    if op.apply.intersection(SPLITS) and split not in op.apply:
+        return None
+
+    if type(op).transform_xy is not OperationPlugin.transform_xy:
+        return False, lambda sample: Sample(*op.transform_xy(sample.x, sample.y, op_rng(sample.rng)),
+                                            sample.meta, sample.rng)
+
+    appxy = op.apply.intersection({'x', 'y'})
+    apply_x, apply_y = not appxy or 'x' in op.apply, not appxy or 'y' in op.apply
+    type_good = {}
+
+    def _good(data):
+        if type(data) not in type_good:
+            type_good[type(data)] = _type_good(op.type, type(data))
+        return type_good[type(data)]
+
+    def _transform_xy(sample):
+        x, y, rng = sample.x, sample.y, op_rng(sample.rng)
+        good_x, good_y = apply_x and _good(x), apply_y and _good(y)
+
+        # like transform_xy, but only reset the random generator when it is used twice
+        if good_x and good_y:
+            rewind = replay(rng)
+            x = op.transform(x, rng)
+            y = op.transform(y, rewind())
+        elif good_x:
+            x = op.transform(x, rng)
+        elif good_y:
+            y = op.transform(y, rng)
+
+        return Sample(x, y, sample.meta, sample.rng)
+
+    return False, _transform_xy
+
+
 def _type_good(t1, t2):
-    return t1 == Any or t1 == t2 or \
-           (getattr(t1, '__origin__', None) == Union and t2 in t1.__args__)
+    types = t1.__args__ if getattr(t1, '__origin__', None) == Union else (t1,)
+    # subclasses like numpy memmaps or PIL image files are accepted as well
+    return t1 == Any or any(isinstance(t, type) and issubclass(t2, t) for t in types)
@@ -1,11 +1,15 @@
 from vergeml.operation import operation, OperationPlugin
 from vergeml.option import option
 from vergeml.utils import VergeMLError, SPLITS
+from vergeml.rng import CounterRandom, variant_rng
+from vergeml.io import Sample
 from copy import copy
 
 @operation('augment', descr="Augment a sample by producing multiple variants.", topic="general")
 @option('variants', validate='>0', type=int)
 class AugmentOperation(OperationPlugin):
+    deterministic = True
+    scale_invariant = True
 
     def __init__(self, variants, apply=None):
         super().__init__(apply)
@@ -19,9 +23,23 @@ class AugmentOperation(OperationPlugin):
         if self.apply.intersection(set(SPLITS)) \
                 and sample.meta['split'] not in self.apply:
             yield sample
+        elif isinstance(sample.rng, CounterRandom):
+            for index in range(self.variants):
+                yield self.transform_variant(sample, index)
         else:
+            # the variants share the generator of the sample and draw from it in turn
             for _ in range(self.variants):
                 yield copy(sample)
 
+    def transform_variant(self, sample, index):
+        if self.apply.intersection(set(SPLITS)) \
+                and sample.meta['split'] not in self.apply:
+            return sample
+
+        # with counter generators, each variant gets its own random generator, so that
+        # variants can be produced independent of each other
+        rng = sample.rng and variant_rng(sample.rng, index)
+        return Sample(sample.x, sample.y, sample.meta, rng)
+
     def multiplier(self):
         return self.variants
@@ -1,4 +1,6 @@
-from vergeml.img import ImageType
+from typing import Union
+import numpy as np
+from vergeml.img import ImageType, is_image_array
 from vergeml.operation import OperationPlugin, operation
 from vergeml.option import option
 from PIL import Image
@@ -13,7 +15,9 @@ import math
 @option('width', type=int, descr="Width of the rectangle.", validate='>0')
 @option('height', type=int, descr="Height of the rectangle.", validate='>0')
 class CropOperation(OperationPlugin):
-    type = ImageType
+    type = Union[ImageType, np.ndarray]
+    deterministic = True
+    geometric = True
 
     def __init__(self, width:int, height:int, x:int = None, y:int = None, position:str="center", apply=None):
 
@@ -34,7 +38,26 @@ class CropOperation(OperationPlugin):
         self.position = position
     
     def transform(self, img, rng):
-        width, height = img.size
+        if isinstance(img, np.ndarray):
+            if not is_image_array(img):
+                return img
+            x, y = self._position(img.shape[1], img.shape[0])
+            return img[y:y + self.height, x:x + self.width]
+
+        x, y = self._position(*img.size)
+        params = x, y, x + self.width, y + self.height
+        return img.crop(params)
+
+    def transform_batch(self, xs, rngs):
+        x, y = self._position(xs.shape[2], xs.shape[1])
+        return xs[:, y:y + self.height, x:x + self.width]
+
+    def transform_geometry(self, geos, rng):
+        for geo in filter(None, geos):
+            x, y = self._position(*geo.size)
+            geo.crop(x, y, self.width, self.height)
+
+    def _position(self, width, height):
 
         if width < self.width:
             raise VergeMLError("Can't crop sample with width {} to {}.".format(width, self.width))
@@ -63,5 +86,4 @@ class CropOperation(OperationPlugin):
         elif self.position == "center":
             x, y = math.floor(width/2 - self.width/2), math.floor(height/2 - self.height/2)
         
-        params = x, y, x + self.width, y + self.height
-        return img.crop(params)
\ No newline at end of file
+        return x, y
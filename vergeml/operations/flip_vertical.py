@@ -1,23 +1,46 @@
-from vergeml.img import ImageType
+from vergeml.img import ImageType, is_image_array
 from vergeml.operation import OperationPlugin, operation
 from vergeml.option import option
 from PIL import Image
+import numpy as np
 from vergeml.utils import VergeMLError
 
 @operation('flip-vertical', topic="image", descr="Vertically flip and image.")
 @option('chance', validate='>=0, <=1', default=1.)
 class FlipVerticalOperation(OperationPlugin):
+    geometric = True
+    scale_invariant = True
 
     def __init__(self, chance:float=1.0, apply=None):
         super().__init__(apply)
         self.chance = chance
-    
+
+    @property
+    def deterministic(self):
+        return self.chance in (0.0, 1.0)
 
     def transform_xy(self, x, y, rng):
       
         if rng.uniform(0.0, 1.0) < self.chance:
 
-            x = x if not isinstance(x, ImageType) else x.transpose(Image.FLIP_TOP_BOTTOM)
-            y = y if not isinstance(y, ImageType) else y.transpose(Image.FLIP_TOP_BOTTOM)
+            x = self._flip(x)
+            y = self._flip(y)
             
         return x, y
+
+    def transform_geometry(self, geos, rng):
+        if rng.uniform(0.0, 1.0) < self.chance:
+            for geo in filter(None, geos):
+                geo.flip_v = not geo.flip_v
+
+    @staticmethod
+    def _flip(img):
+        if isinstance(img, ImageType):
+            return img.transpose(Image.FLIP_TOP_BOTTOM)
+        elif is_image_array(img):
+            return img[::-1]
+        return img
+
+    def transform_batch(self, xs, rngs):
+        flip = np.array([rng.uniform(0.0, 1.0) < self.chance for rng in rngs])
+        return np.where(flip.reshape((-1,) + (1,) * (xs.ndim - 1)), xs[:, ::-1], xs)
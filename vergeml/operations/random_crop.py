@@ -1,14 +1,17 @@
-from vergeml.img import ImageType
+from typing import Union
+from vergeml.img import ImageType, is_image, image_size
 from vergeml.operation import OperationPlugin, operation
 from vergeml.option import option
 from PIL import Image
+import numpy as np
 from vergeml.utils import VergeMLError
 
 @operation('random-crop', topic="image", descr="Crop random regions of an image.")
 @option('width', type=int, descr="Width of the rectangle.", validate='>0')
 @option('height', type=int, descr="Height of the rectangle.", validate='>0')
 class RandomCropOperation(OperationPlugin):
-    type = ImageType
+    type = Union[ImageType, np.ndarray]
+    geometric = True
 
     def __init__(self, width:int, height:int, apply=None):
         super().__init__(apply)
@@ -16,13 +19,24 @@ class RandomCropOperation(OperationPlugin):
         self.height = height
 
     def transform_xy(self, x, y, rng):
-        imgs = [img for img in (x,y) if isinstance(img, ImageType)]
+        sizes = [image_size(img) for img in (x,y) if is_image(img)]
+        xco, yco = self._coords(sizes, rng)
+        return self._crop(x, xco, yco), self._crop(y, xco, yco)
 
-        if not len(imgs):
+    def transform_geometry(self, geos, rng):
+        geos = list(filter(None, geos))
+        xco, yco = self._coords([geo.size for geo in geos], rng)
+
+        for geo in geos:
+            geo.crop(xco, yco, self.width, self.height)
+
+    def _coords(self, sizes, rng):
+
+        if not len(sizes):
             raise VergeMLError("random_crop needs samples of type image")
 
-        maxwidth = min([img.size[0] for img in imgs])
-        maxheight = min([img.size[1] for img in imgs])
+        maxwidth = min([width for width, _ in sizes])
+        maxheight = min([height for _, height in sizes])
 
         if maxwidth < self.width:
             raise VergeMLError("Can't crop sample with width {} to {}.".format(maxwidth, self.width))
@@ -35,12 +49,32 @@ class RandomCropOperation(OperationPlugin):
 
         xco = rng.randint(0, maxx)
         yco = rng.randint(0, maxy)
-        params = xco, yco, xco + self.width, yco + self.height
 
-        if isinstance(x, ImageType):
-            x = x.crop(params)
-        
-        if isinstance(y, ImageType):
-            y = y.crop(params)
+        return xco, yco
+
+    def _crop(self, img, xco, yco):
+        if isinstance(img, ImageType):
+            return img.crop((xco, yco, xco + self.width, yco + self.height))
+        elif is_image(img):
+            return img[yco:yco + self.height, xco:xco + self.width]
+        return img
+
+    def transform_batch(self, xs, rngs):
+        _, maxheight, maxwidth = xs.shape[:3]
+
+        if maxwidth < self.width:
+            raise VergeMLError("Can't crop sample with width {} to {}.".format(maxwidth, self.width))
+
+        if maxheight < self.height:
+            raise VergeMLError("Can't crop sample with height {} to {}.".format(maxheight, self.height))
+
+        maxx = maxwidth - self.width
+        maxy = maxheight - self.height
+
+        # draw the coordinates of every sample in the same order as transform_xy
+        coords = np.array([(rng.randint(0, maxx), rng.randint(0, maxy)) for rng in rngs])
+        cols = coords[:, 0, np.newaxis] + np.arange(self.width)
+        rows = coords[:, 1, np.newaxis] + np.arange(self.height)
 
-        return x, y
\ No newline at end of file
+        ixs = np.arange(len(xs))[:, np.newaxis, np.newaxis]
+        return xs[ixs, rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
@@ -1,4 +1,7 @@
-from vergeml.img import ImageType, RESIZE_METHODS, RESIZE_MODES, resize_image
+from typing import Union
+import numpy as np
+from vergeml.img import ImageType, RESIZE_METHODS, RESIZE_MODES, resize_image, \
+    is_image_array, resize_batch, grayscale_batch, rgb_batch
 from vergeml.operation import OperationPlugin, operation
 from vergeml.option import option
 from PIL import Image
@@ -10,7 +13,9 @@ from PIL import Image
 @option('method', type=str, descr="Scaling Method.", default="antialias", validate=RESIZE_METHODS)
 @option('mode', type=str, descr="Scaling Mode.", default="fill", validate=RESIZE_MODES)
 class ResizeOperation(OperationPlugin):
-    type = ImageType
+    type = Union[ImageType, np.ndarray]
+    deterministic = True
+    resamples = True
     
 
     def __init__(self, width, height, channels=None, method='antialias', mode='fill', apply=None):
@@ -26,15 +31,42 @@ class ResizeOperation(OperationPlugin):
         self.method = method
         self.mode = mode
 
+    @property
+    def geometric(self):
+        # aspect-fit pads the image, which is done separately
+        return self.mode != 'aspect-fit'
+
+    def resize_target(self):
+        # applied to some splits or only to y
+        if self.apply - {'x'}:
+            return None
+        return self.width, self.height, self.mode
+
+    def transform_geometry(self, geos, rng):
+        for geo in filter(None, geos):
+            geo.resize(self.width, self.height, self.method, self.mode)
+            geo.channels = self.channels or geo.channels
+
     def transform(self, img, rng):
+
+        if isinstance(img, np.ndarray):
+            if not is_image_array(img):
+                return img
+            batch = resize_batch(img[np.newaxis], self.width, self.height, self.method, self.mode)
+
+            if self.channels == 1:
+                batch = grayscale_batch(batch)
+            elif self.channels == 3:
+                batch = rgb_batch(batch)
+            return batch[0]
         
         rimg = resize_image(img, self.width, self.height, self.method, self.mode)
         
         if self.channels is None:
-            if rimg.format != img.format:
-                rimg = rimg.convert(img.format)
+            if rimg.mode != img.mode:
+                rimg = rimg.convert(img.mode)
             return rimg
         elif self.channels == 1:
-            return rimg.convert('gray')
+            return rimg.convert('L')
         elif self.channels == 3:
             return rimg.convert('RGB')
\ No newline at end of file
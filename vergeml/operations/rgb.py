@@ -1,11 +1,20 @@
-from vergeml.img import ImageType
+from typing import Union
+import numpy as np
+from vergeml.img import ImageType, is_image_array, rgb_batch
 from vergeml.operation import OperationPlugin, operation
 from vergeml.option import option
 from PIL import Image
 
 @operation('rgb', topic="image", descr="Convert an image to RGB mode.")
 class RGBOperation(OperationPlugin):
-    type = ImageType
+    type = Union[ImageType, np.ndarray]
+    deterministic = True
+    scale_invariant = True
 
     def transform(self, img, rng):
-        return img.convert('RGB')
\ No newline at end of file
+        if isinstance(img, np.ndarray):
+            return rgb_batch(img[np.newaxis])[0] if is_image_array(img) else img
+        return img.convert('RGB')
+
+    def transform_batch(self, xs, rngs):
+        return rgb_batch(xs)
@@ -66,8 +66,9 @@ def option(name, default=None, descr=None, type=None, validate=None, transform=N
 
         assert getattr(o, _CMD_META_KEY, None) is None, _DECORATORS_WRONG_ORDER
 
-        if not hasattr(o, _OPTIONS_META_KEY):
-            setattr(o, _OPTIONS_META_KEY, [])
+        if _OPTIONS_META_KEY not in vars(o):
+            # copy inherited options so that a subclass does not add options to its parent
+            setattr(o, _OPTIONS_META_KEY, list(getattr(o, _OPTIONS_META_KEY, [])))
         options = getattr(o, _OPTIONS_META_KEY)
         option = Option(name=name,
                         default=default,
@@ -0,0 +1,218 @@
+"""
+Per sample random generators.
+"""
+import random
+import hashlib
+
+import numpy as np
+
+# 'compat' reproduces the string seeded Mersenne Twister streams of earlier versions.
+RNG_MODES = ('compat', 'counter')
+
+_MASK = 2**64 - 1
+
+_Random = random.Random
+
+# the increment of the SplitMix64 Weyl sequence
+_GOLDEN = 0x9e3779b97f4a7c15
+
+# multipliers of the epoch, op and variant parts of derived keys
+_EPOCH, _OP, _VARIANT = 0xd1b54a32d192ed03, 0xaef17502108ef2d9, 0xf58476d1ce4e5b9b
+
+
+def _to_word(value):
+    """Convert an int or string to a 64 bit key word."""
+    if isinstance(value, (int, np.integer)):
+        return int(value) & _MASK
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _mix(word):
+    """The SplitMix64 finalizer, which maps 64 bit words to well distributed words."""
+    word = ((word ^ (word >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+    word = ((word ^ (word >> 27)) * 0x94d049bb133111eb) & _MASK
+    return word ^ (word >> 31)
+
+
+def _child_key(key, epoch, op, variant):
+    # a different odd multiplier per part keeps e.g. epoch 1 and op 1 apart
+    parts = _to_word(epoch) * _EPOCH + _to_word(op) * _OP + _to_word(variant) * _VARIANT
+    return _mix((key ^ parts) & _MASK)
+
+
+class CounterRandom:
+    """A counter based random generator keyed by (seed, sample id, epoch, op, variant).
+
+    The n-th random number is computed from the key and n alone, so the whole state
+    of the generator is the two integers (key, counter). It has the methods of
+    random.Random which operations use, like random(), uniform() and randint().
+    """
+
+    __slots__ = ('key', 'counter')
+
+    def __init__(self, seed=0, sample_id=0, epoch=0, op=0, variant=0):
+        """
+        :param seed: the random seed
+        :param sample_id: an int or string identifying the sample
+        :param epoch: the epoch
+        :param op: the index of the operation
+        :param variant: the variant of an augmented sample
+        """
+        self.key = _mix(_mix((_to_word(seed) + _GOLDEN) & _MASK) ^ _to_word(sample_id))
+        self.counter = 0
+
+        if epoch or op or variant:
+            self.key = _child_key(self.key, epoch, op, variant)
+
+    @classmethod
+    def from_state(cls, state):
+        """Return a generator with the state returned by getstate()."""
+        res = cls.__new__(cls)
+        res.key, res.counter = state
+        return res
+
+    def __repr__(self):
+        return "CounterRandom.from_state({!r})".format(self.getstate())
+
+    def seed(self, a=None):
+        """Restart the stream, using a as the seed when given."""
+        if a is not None:
+            self.key = _mix((_to_word(a) + _GOLDEN) & _MASK)
+        self.counter = 0
+
+    def getstate(self):
+        return self.key, self.counter
+
+    def setstate(self, state):
+        self.key, self.counter = state
+
+    def derive(self, epoch=0, op=0, variant=0):
+        """Return the generator of a stream of the same sample for epoch, op and variant.
+
+        The result only depends on the key, so deriving twice gives the same stream.
+        """
+        return CounterRandom.from_state((_child_key(self.key, epoch, op, variant), 0))
+
+    def spawn(self):
+        """Return the generator of the next operation processing the sample.
+
+        Same as derive(op=n) for the n-th call.
+        """
+        self.counter += 1
+        return CounterRandom.from_state((_mix((self.key ^ self.counter * _OP) & _MASK), 0))
+
+    def random(self):
+        """Return the next random float in [0, 1)."""
+        # inlined _next_word(), since this is called for most random numbers
+        self.counter += 1
+        word = (self.key + self.counter * _GOLDEN) & _MASK
+        word = ((word ^ (word >> 30)) * 0xbf58476d1ce4e5b9) & _MASK
+        word = ((word ^ (word >> 27)) * 0x94d049bb133111eb) & _MASK
+        return ((word ^ (word >> 31)) >> 11) * (1. / 2**53)
+
+    def uniform(self, a, b):
+        """Return a random float between a and b."""
+        return a + (b - a) * self.random()
+
+    def randint(self, a, b):
+        """Return a random int in [a, b]."""
+        if b < a:
+            raise ValueError("empty range for randint({}, {})".format(a, b))
+        return a + self._randbelow(b - a + 1)
+
+    def getrandbits(self, k):
+        """Return an int with k random bits."""
+        if k < 0:
+            raise ValueError("number of bits must be non-negative")
+
+        res, bits = 0, 0
+        while bits < k:
+            res |= self._next_word() << bits
+            bits += 64
+        return res & ((1 << k) - 1)
+
+    def _randbelow(self, n):
+        bits = n.bit_length()
+        res = self.getrandbits(bits)
+        while res >= n:
+            res = self.getrandbits(bits)
+        return res
+
+    def _next_word(self):
+        # the SplitMix64 output at position counter of the stream starting at key
+        self.counter += 1
+        return _mix((self.key + self.counter * _GOLDEN) & _MASK)
+
+    # the distributions of random.Random only depend on random() and getrandbits()
+    randrange = _Random.randrange
+    choice = _Random.choice
+    choices = _Random.choices
+    shuffle = _Random.shuffle
+    sample = _Random.sample
+    triangular = _Random.triangular
+    normalvariate = _Random.normalvariate
+    gauss = _Random.normalvariate
+    lognormvariate = _Random.lognormvariate
+    expovariate = _Random.expovariate
+
+
+def sample_rng(mode, seed, sample_id, compat_seed=None):
+    """Return the random generator of a sample.
+
+    :param mode: one of RNG_MODES
+    :param seed: the random seed
+    :param sample_id: an int or string identifying the sample
+    :param compat_seed: the seed used in 'compat' mode, default: str(seed) + str(sample_id)
+    """
+    if mode == 'counter':
+        return CounterRandom(seed, sample_id)
+
+    return random.Random(str(seed) + str(sample_id) if compat_seed is None else compat_seed)
+
+
+def variant_rng(rng, variant):
+    """Return the random generator of a variant of the sample with random generator rng.
+
+    Counter generators derive a generator determined by rng and variant. Other
+    generators are shared by all variants, which keeps the random numbers of
+    'compat' mode unchanged.
+    """
+    return rng.derive(variant=variant) if isinstance(rng, CounterRandom) else rng
+
+
+def op_rng(rng):
+    """Return the random generator of the next operation processing a sample with rng.
+
+    Counter generators give each operation a stream of its own, derived from their
+    key and the position of the operation. Other generators are shared by all
+    operations of a sample.
+    """
+    return rng.spawn() if isinstance(rng, CounterRandom) else rng
+
+
+def replay(rng):
+    """Return a function which returns rng at its current position on every call.
+
+    Used to transform x and y of a sample with the same random numbers.
+    """
+    state = rng.getstate()
+
+    if isinstance(rng, CounterRandom):
+        return lambda: CounterRandom.from_state(state)
+
+    def _rewind():
+        rng.setstate(state)
+        return rng
+
+    return _rewind
+
+
+def rng_state(rng):
+    """Return rng, or the integers (key, counter) of a counter generator."""
+    return rng.getstate() if isinstance(rng, CounterRandom) else rng
+
+
+def rng_from_state(state):
+    """Return the random generator stored by rng_state()."""
+    return CounterRandom.from_state(state) if isinstance(state, tuple) else state
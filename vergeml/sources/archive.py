@@ -0,0 +1,235 @@
+from vergeml.img import INPUT_PATTERNS
+from vergeml.io import source, SourcePlugin, Sample
+from vergeml.data import Labels, LabelIndex
+from vergeml.utils import VergeMLError, pack_rows, file_state, zip_data_offset
+from vergeml.option import option
+import random
+import numpy as np
+from PIL import Image
+import os
+import os.path
+import io
+import hashlib
+import pickle
+import tarfile
+import threading
+import zipfile
+import zlib
+
+_ARCHIVE_PATTERNS = ["**/*.tar", "**/*.zip"]
+
+_IMAGE_EXTENSIONS = tuple(os.path.splitext(pat)[1] for pat in INPUT_PATTERNS)
+
+# consecutive members of a shard are read with a single read when the gap between them
+# is not larger than this
+_MAX_READ_GAP = 64 * 1024
+
+# increment when the layout of the index files changes
+_INDEX_VERSION = 1
+
+
+@source('image-archive', descr="Load images from tar or zip shards.", input_patterns=_ARCHIVE_PATTERNS)
+@option('labeled', default=False, type=bool,
+        descr="When true, the parent directory of an image in the archive is its label.")
+class ImageArchiveSource(SourcePlugin):
+    """Load images from uncompressed tar files or zip files without extracting them.
+
+    An index of the member offsets of each shard is stored in cache_dir, so samples can be
+    read with a single seek. The samples of a split are ordered by shard - the order of the
+    shards is shuffled once with random_seed, while the samples of a shard are read
+    sequentially. The order is the same in every epoch; loaders which randomize shuffle
+    the samples themselves.
+    """
+
+    def __init__(self, args: dict={}):
+        self.labeled = args.get('labeled', False)
+        self.shards = None
+        self.members = None
+        self.samples = None
+        self.label_index = None
+        self._files = {}
+        self._lock = threading.Lock()
+        super().__init__(args)
+
+    def begin_read_samples(self):
+        if self.samples:
+            return
+
+        train_shards, val_shards, test_shards = self.scan_dirs()
+
+        if not train_shards:
+            raise VergeMLError("No archives found in samples_dir.",
+                               "Please check the option input-patterns.")
+
+        self.shards = train_shards + val_shards + test_shards
+        self.members = []
+        shard_ids = {}
+
+        for shard_ix, path in enumerate(self.shards):
+            first = len(self.members)
+            self.members.extend((shard_ix,) + entry for entry in self._read_index(path))
+            shard_ids[path] = list(range(first, len(self.members)))
+
+        def _ids(shards):
+            return [i for path in shards for i in shard_ids[path]]
+
+        train = _ids(train_shards)
+        strain, sval, stest = self.split(len(train))
+
+        self.samples = dict(
+            train=[train[i] for i in strain],
+            val=_ids(val_shards) or [train[i] for i in sval],
+            test=_ids(test_shards) or [train[i] for i in stest])
+
+        # shuffle the shards with a fixed seed and read the samples in each shard in order
+        ranks = list(range(len(self.shards)))
+        random.Random(self.random_seed).shuffle(ranks)
+
+        for split, ids in self.samples.items():
+            self.samples[split] = sorted(ids, key=lambda i: (ranks[self.members[i][0]], i))
+
+        if self.labeled:
+            self.meta['labels'] = Labels(sorted(set(filter(None, map(self._label, self.members)))))
+
+    def end_read_samples(self):
+        with self._lock:
+            for file in self._files.values():
+                file.close()
+            self._files = {}
+
+    def num_samples(self, split: str) -> int:
+        return len(self.samples[split])
+
+    def sample_labels(self, split: str):
+        if not self.labeled:
+            return None
+
+        return pack_rows([self._label_ids(self.members[i]) for i in self.samples[split]])
+
+    def read_samples(self, split: str, index: int, n: int=1):
+        ids = self.samples[split][index:index+n]
+        res = []
+
+        for group in self._read_groups(ids):
+            for member_id, data in zip(group, self._read_group(group)):
+                member = self.members[member_id]
+                filename = os.path.join(os.path.basename(self.shards[member[0]]), member[1])
+                rng = self.sample_rng(filename)
+                img = Image.open(io.BytesIO(data))
+                img.load()
+                y = self._label_ids(member) if self.labeled else None
+                res.append(Sample(img, y, dict(split=split, filename=filename), rng))
+
+        return res
+
+    def transform(self, sample):
+        sample.x = np.asarray(sample.x)
+
+        if self.labeled:
+            sample.y = LabelIndex.of(self).onehot(sample.y)
+
+        return sample
+
+    def hash(self, state: str) -> str:
+        shards = self.shards or sum(self.scan_dirs(), [])
+        return super().hash(state + str(self.labeled) + "".join(map(file_state, shards)))
+
+    def _label_ids(self, member):
+        label = self._label(member)
+        return LabelIndex.of(self).encode([label] if label else [])
+
+    def _label(self, member):
+        dirname = os.path.dirname(member[1])
+        return os.path.basename(dirname) if dirname else None
+
+    def _read_groups(self, ids):
+        """Group member ids that can be read with a single read."""
+        group = []
+
+        for member_id in ids:
+            if group:
+                prev = self.members[group[-1]]
+                cur = self.members[member_id]
+                if cur[0] != prev[0] or not 0 <= cur[2] - (prev[2] + prev[3]) <= _MAX_READ_GAP:
+                    yield group
+                    group = []
+            group.append(member_id)
+
+        if group:
+            yield group
+
+    def _read_group(self, group):
+        first, last = self.members[group[0]], self.members[group[-1]]
+        start = first[2]
+
+        with self._lock:
+            path = self.shards[first[0]]
+            if path not in self._files:
+                self._files[path] = open(path, "rb")
+            file = self._files[path]
+            file.seek(start)
+            buffer = file.read(last[2] + last[3] - start)
+
+        res = []
+        for member_id in group:
+            _, _, offset, csize, compression = self.members[member_id]
+            data = buffer[offset - start:offset - start + csize]
+            if compression == zipfile.ZIP_DEFLATED:
+                data = zlib.decompress(data, -zlib.MAX_WBITS)
+            res.append(data)
+        return res
+
+    def _read_index(self, path):
+        """Return a list of (name, offset, size, compression) for the images in the archive at path.
+
+        The index is stored in cache_dir and rebuilt when the archive changes.
+        """
+        md5 = hashlib.md5("{}{}".format(_INDEX_VERSION, file_state(os.path.abspath(path))).encode('utf-8'))
+        index_path = os.path.join(self.cache_dir, "archive-{}.index".format(md5.hexdigest()))
+
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as file:
+                return pickle.load(file)
+
+        if zipfile.is_zipfile(path):
+            entries = _index_zip(path)
+        else:
+            entries = _index_tar(path)
+
+        entries = [entry for entry in entries if entry[0].lower().endswith(_IMAGE_EXTENSIONS)]
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        tmp_path = "{}.{}.tmp".format(index_path, os.getpid())
+        with open(tmp_path, "wb") as file:
+            pickle.dump(entries, file)
+        os.replace(tmp_path, index_path)
+
+        return entries
+
+
+def _index_tar(path):
+    try:
+        with tarfile.open(path, "r:") as archive:
+            return [(info.name, info.offset_data, info.size, zipfile.ZIP_STORED)
+                    for info in archive if info.isfile()]
+    except tarfile.ReadError:
+        raise VergeMLError("Can't read archive: {}".format(path),
+                           "Only uncompressed tar files and zip files are supported.")
+
+
+def _index_zip(path):
+    res = []
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as file:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise VergeMLError("Unsupported compression in archive: {}".format(path),
+                                   "Only stored and deflated zip members are supported.")
+
+            offset = zip_data_offset(file, info.header_offset)
+            res.append((info.filename, offset, info.compress_size, info.compress_type))
+    return res
@@ -0,0 +1,198 @@
+from vergeml.io import source, SourcePlugin, Sample
+from vergeml.option import option
+from vergeml.utils import VergeMLError, file_state, zip_data_offset
+import numpy as np
+import os.path
+import zipfile
+
+_HDF5_EXTENSIONS = ('.h5', '.hdf5', '.hdf')
+
+
+@source('array', descr="Load samples from .npy, .npz or HDF5 array files.")
+@option('path', type=str, descr="Path to a .npy, .npz or HDF5 file.")
+@option('x', default='x', type=str, descr="Name of the array holding the samples (.npz and HDF5 only).")
+@option('y', type='Optional[str]',
+        descr="Name of the array holding the labels or path to a .npy file with labels.")
+class ArraySource(SourcePlugin):
+    """Load samples from array files without reading them into memory.
+
+    .npy files and uncompressed members of .npz files are memory mapped, HDF5 datasets
+    are read through h5py. Splits are sorted index arrays, so reading a run of consecutive
+    samples results in a slice instead of a copy.
+
+    When the option y is not set, an array named 'y' is used as labels if it exists.
+    """
+
+    def __init__(self, args: dict={}):
+        self.file = args.get('path')
+        self.x_name = args.get('x', 'x')
+        self.y_name = args.get('y')
+        self.arrays = None
+        self.indices = None
+        self._h5file = None
+        super().__init__(args)
+
+    def begin_read_samples(self):
+        if self.indices:
+            return
+
+        if not self.file or not os.path.exists(self.file):
+            raise VergeMLError("File not found: {}".format(self.file),
+                               "Please check the option path of the array source.")
+
+        self.arrays = self._open_arrays()
+        xs, ys = self.arrays
+
+        if ys is not None and len(ys) != len(xs):
+            raise VergeMLError("The number of labels ({}) does not match the number of samples ({}).".format(
+                len(ys), len(xs)))
+
+        train, val, test = self.split(len(xs))
+        self.indices = dict(train=np.sort(np.array(train, dtype='int64')),
+                            val=np.sort(np.array(val, dtype='int64')),
+                            test=np.sort(np.array(test, dtype='int64')))
+
+    def end_read_samples(self):
+        if self._h5file:
+            self._h5file.close()
+            self._h5file = None
+            self.arrays = None
+            self.indices = None
+
+    def num_samples(self, split: str) -> int:
+        return len(self.indices[split])
+
+    def sample_labels(self, split: str):
+        ys = self.arrays[1]
+
+        if ys is None or ys.ndim != 1 or ys.dtype.kind not in 'iu':
+            # only integer class ids can be used as labels
+            return None
+
+        indices = self.indices[split]
+        return np.asarray(ys[indices], dtype='int32'), np.arange(len(indices) + 1)
+
+    def read_arrays(self, split: str, index: int, n: int=1):
+        """Read n samples starting at index as a tuple of arrays (xs, ys).
+
+        ys is None when the source has no labels.
+        """
+        ixs = self.indices[split][index:index+n]
+
+        if len(ixs) and ixs[-1] - ixs[0] + 1 == len(ixs):
+            # the samples are stored consecutively - return a view
+            ixs = slice(int(ixs[0]), int(ixs[-1]) + 1)
+
+        xs, ys = self.arrays
+        return xs[ixs], (ys[ixs] if ys is not None else None)
+
+    def read_samples(self, split: str, index: int, n: int=1):
+        xs, ys = self.read_arrays(split, index, n)
+        ixs = self.indices[split][index:index+n]
+
+        if ys is None:
+            ys = [None] * len(ixs)
+
+        return [Sample(x, y, dict(split=split, index=int(ix)), self.sample_rng(int(ix)))
+                for x, y, ix in zip(xs, ys, ixs)]
+
+    def transform(self, sample):
+        sample.x = np.asarray(sample.x)
+        return sample
+
+    def transform_arrays(self, xs, ys):
+        """Transform the arrays returned by read_arrays() like transform() does each sample."""
+        return np.asarray(xs), ys
+
+    def hash(self, state: str) -> str:
+        files = [self.file]
+
+        if self.y_name and self.y_name.endswith('.npy'):
+            files.append(self.y_name)
+
+        state += "".join(file_state(os.path.abspath(path)) for path in files if os.path.exists(path))
+        return super().hash(state + self.x_name + str(self.y_name))
+
+    def _open_arrays(self):
+        ext = os.path.splitext(self.file)[1].lower()
+
+        if ext == '.npy':
+            xs = np.load(self.file, mmap_mode='r')
+            ys = None
+            if self.y_name:
+                ys = np.load(self.y_name, mmap_mode='r')
+            return xs, ys
+
+        elif ext == '.npz':
+            return self._open_npz()
+
+        elif ext in _HDF5_EXTENSIONS:
+            return self._open_hdf5()
+
+        raise VergeMLError("Unsupported array file: {}".format(self.file),
+                           "The array source can read .npy, .npz and HDF5 files.")
+
+    def _open_npz(self):
+        with zipfile.ZipFile(self.file) as archive:
+            names = {os.path.splitext(name)[0]: name for name in archive.namelist()}
+            members = {}
+
+            for key in (self.x_name, self.y_name or 'y'):
+                if key not in names:
+                    members[key] = None
+                    continue
+
+                info = archive.getinfo(names[key])
+
+                if info.compress_type == zipfile.ZIP_STORED:
+                    members[key] = _memmap_npz_member(self.file, info)
+                else:
+                    # compressed members can't be memory mapped
+                    with archive.open(info) as file:
+                        members[key] = np.lib.format.read_array(file)
+
+        if members[self.x_name] is None:
+            raise VergeMLError("Array '{}' not found in {}.".format(self.x_name, self.file))
+
+        if self.y_name and members[self.y_name] is None:
+            raise VergeMLError("Array '{}' not found in {}.".format(self.y_name, self.file))
+
+        return members[self.x_name], members[self.y_name or 'y']
+
+    def _open_hdf5(self):
+        try:
+            import h5py
+        except ImportError:
+            raise VergeMLError("h5py is required to read HDF5 files.",
+                               "Please install h5py with: pip install h5py")
+
+        self._h5file = h5py.File(self.file, 'r')
+
+        if self.x_name not in self._h5file:
+            raise VergeMLError("Dataset '{}' not found in {}.".format(self.x_name, self.file))
+
+        if self.y_name and self.y_name not in self._h5file:
+            raise VergeMLError("Dataset '{}' not found in {}.".format(self.y_name, self.file))
+
+        y_name = self.y_name or 'y'
+        return self._h5file[self.x_name], (self._h5file[y_name] if y_name in self._h5file else None)
+
+
+def _memmap_npz_member(path, info):
+    """Memory map an uncompressed .npy member of a .npz file."""
+    with open(path, 'rb') as file:
+        file.seek(zip_data_offset(file, info.header_offset))
+
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+
+        offset = file.tell()
+
+    if dtype.hasobject:
+        raise VergeMLError("Can't read object arrays from {}.".format(path))
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
@@ -4,11 +4,148 @@ from vergeml.option import option
 from vergeml.sources.image import ImageSource
 from vergeml.sources.labeled_image import LabeledImageSource
 from vergeml.img import INPUT_PATTERNS, resize_image
+import os
 import os.path
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import uuid
+import weakref
 import numpy as np
 
 # TODO rename image-features
 
+# The number of images passed through the CNN at once.
+_BATCH_SIZE = 16
+
+# Options which control how features are computed, but not their values.
+_RUNTIME_OPTIONS = ('workers', 'threads', 'feature-store')
+
+# Increase when the way features are computed changes.
+_FEATURES_VERSION = 1
+
+# The number of feature vectors written to one shard of the feature store.
+_SHARD_SIZE = 4096
+
+# Keys of the feature store are md5 digests of the image content.
+_KEY_DTYPE = 'S16'
+
+_KEYS_SUFFIX, _VECTORS_SUFFIX = '.keys.npy', '.vectors.npy'
+
+
+class FeatureStore:
+    """A persistent store of feature vectors addressed by image content.
+
+    Feature vectors are stored per feature extractor configuration and keyed by a hash of
+    the image pixels. Because the key does not depend on file names, projects or training
+    configurations, vectors computed once are shared by everything that uses the store.
+
+    Vectors are written in batches to shards, pairs of .npy files holding the keys and
+    the vectors of the batch. The keys of all shards are kept in one sorted array, and
+    the vectors are memory mapped.
+    """
+
+    def __init__(self, path, config):
+        """
+        :param path: the directory of the store
+        :param config: a list of values describing the feature extractor
+        """
+        md5 = hashlib.md5(repr(config).encode('utf-8'))
+        self.path = os.path.join(path, md5.hexdigest())
+        self.shards = []
+        self.keys = np.zeros(0, dtype=_KEY_DTYPE)
+        self.locations = np.zeros((0, 2), dtype='int64')
+        self.pending = collections.OrderedDict()
+        self._vectors = {}
+
+        if os.path.isdir(self.path):
+            names = sorted(name[:-len(_KEYS_SUFFIX)] for name in os.listdir(self.path)
+                           if name.endswith(_KEYS_SUFFIX))
+            self._add_shards(names, [np.load(os.path.join(self.path, name + _KEYS_SUFFIX))
+                                     for name in names])
+
+    @staticmethod
+    def image_key(img):
+        """Return the content hash of an image."""
+        md5 = hashlib.md5("{}{}".format(img.mode, img.size).encode('utf-8'))
+        md5.update(img.tobytes())
+        return md5.digest()
+
+    def get(self, key):
+        """Return the feature vector stored under key or None."""
+        return self.get_many([key])[0]
+
+    def get_many(self, keys):
+        """Return a list of the feature vectors stored under keys, with None for missing keys."""
+        res = [self.pending.get(key) for key in keys]
+
+        if len(self.keys) and keys:
+            arr = np.array(keys, dtype=_KEY_DTYPE)
+            pos = np.minimum(np.searchsorted(self.keys, arr), len(self.keys) - 1)
+            found = self.keys[pos] == arr
+
+            for i in np.flatnonzero(found):
+                shard, row = self.locations[pos[i]]
+                res[i] = np.array(self._shard_vectors(shard)[row])
+
+        return res
+
+    def put(self, key, features):
+        """Store a feature vector under key."""
+        self.put_many([key], [features])
+
+    def put_many(self, keys, vectors):
+        """Store feature vectors under keys.
+
+        The vectors are written when enough vectors for a shard are collected, or
+        when flush() is called.
+        """
+        self.pending.update(zip(keys, vectors))
+
+        if len(self.pending) >= _SHARD_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Write the collected vectors to a new shard."""
+        if not self.pending:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        name = "{}-{}".format(os.getpid(), uuid.uuid4().hex)
+        keys = np.array(list(self.pending.keys()), dtype=_KEY_DTYPE)
+        vectors = np.stack(list(self.pending.values()))
+
+        # The keys are written last, so that readers only see complete shards.
+        for suffix, arr in ((_VECTORS_SUFFIX, vectors), (_KEYS_SUFFIX, keys)):
+            path = os.path.join(self.path, name + suffix)
+            tmp_path = "{}.tmp".format(path)
+            with open(tmp_path, "wb") as file:
+                np.save(file, arr)
+            os.replace(tmp_path, path)
+
+        self.pending.clear()
+        self._add_shards([name], [keys])
+
+    def _add_shards(self, names, shard_keys):
+        if not names:
+            return
+
+        locations = [np.stack([np.full(len(keys), len(self.shards) + i), np.arange(len(keys))], axis=1)
+                     for i, keys in enumerate(shard_keys)]
+        self.shards.extend(names)
+        keys = np.concatenate([self.keys] + shard_keys)
+        locations = np.concatenate([self.locations] + locations)
+        order = np.argsort(keys, kind='stable')
+        self.keys, self.locations = keys[order], locations[order]
+
+    def _shard_vectors(self, shard):
+        if shard not in self._vectors:
+            path = os.path.join(self.path, self.shards[shard] + _VECTORS_SUFFIX)
+            self._vectors[shard] = np.load(path, mmap_mode='r')
+        return self._vectors[shard]
+
+
 class ImageNetFeatures:
 
     def __init__(self, args: dict={}):
@@ -21,9 +158,102 @@ class ImageNetFeatures:
         self.size = args.get('size')
         self.output_layer = args.get('output-layer')
         self.architecture = args.get('architecture')
+        self.workers = args.get('workers') or 1
+        self.threads = args.get('threads')
+        self.feature_store = args.get('feature-store')
         trainings_dir = args.get('trainings-dir')
         evaluate_args(self.architecture, trainings_dir, self.variant, self.alpha, self.size)
         self.image_size = get_image_size(self.architecture, self.variant, self.size)
+        self._pool = None
+        self._store = None
+
+    def extract_features(self, samples):
+        """Compute the feature vectors of samples.
+
+        Yields tuples (sample, features) in the order of samples. Feature vectors found
+        in the feature store are reused. The remaining images are passed through the CNN,
+        sharded across worker processes when workers is greater than 1. The feature store
+        is only used when the option feature-store is set.
+        """
+        store = self._get_store()
+
+        # keep the workers busy while limiting the number of images in flight
+        max_pending = 2 * self.workers if self.workers > 1 else 0
+        pending = collections.deque()
+
+        for chunk in _chunks(samples, _BATCH_SIZE):
+            keys = [FeatureStore.image_key(sample.x) for sample in chunk] if store else None
+            features = store.get_many(keys) if store else [None] * len(chunk)
+            missing = [i for i, vec in enumerate(features) if vec is None]
+            result = self._compute([chunk[i].x for i in missing]) if missing else None
+            pending.append((chunk, keys, features, missing, result))
+
+            while len(pending) > max_pending:
+                yield from self._finish_chunk(store, *pending.popleft())
+
+        while pending:
+            yield from self._finish_chunk(store, *pending.popleft())
+
+        if store:
+            store.flush()
+
+    def _compute(self, images):
+        if self.workers > 1:
+            return self._get_pool().apply_async(_worker_features, (images,))
+
+        if not self.model:
+            self.preprocess_input, self.model = _load_model(*self._model_config())
+        return _compute_features(self.model, self.preprocess_input, images, self.image_size)
+
+    @staticmethod
+    def _finish_chunk(store, chunk, keys, features, missing, result): # pylint: disable=R0913
+        if missing:
+            computed = result.get() if hasattr(result, 'get') else result
+            for i, vec in zip(missing, computed):
+                features[i] = vec
+            if store:
+                store.put_many([keys[i] for i in missing], computed)
+        return zip(chunk, features)
+
+    def _get_store(self):
+        if self.feature_store in (None, False, 'off'):
+            # by default the loader caches the output and the features are not stored twice
+            return None
+
+        if not self._store:
+            path = self.feature_store
+            if path in (True, 'on'):
+                path = os.path.join(self.cache_dir, 'features')
+            self._store = FeatureStore(path, self._store_config())
+            # write the vectors of an incomplete shard when the source goes away
+            weakref.finalize(self, self._store.flush)
+        return self._store
+
+    def _store_config(self):
+        config = [_FEATURES_VERSION, self.architecture, self.variant, self.image_size,
+                  self.alpha, self.output_layer]
+        if self.architecture.startswith("@"):
+            # features of a custom model change when the model is retrained
+            path = os.path.join(self.trainings_dir, self.architecture.lstrip("@"), 'checkpoints', 'model.h5')
+            if not os.path.isfile(path):
+                raise VergeMLError("Can't find the model of {}: {}".format(self.architecture, path))
+            config.extend([os.path.getmtime(path), os.path.getsize(path)])
+        return config
+
+    def _get_pool(self):
+        if not self._pool:
+            threads = self.threads or max(1, (os.cpu_count() or 1) // self.workers)
+            # Use spawn, since forking a process which has already set up the deep
+            # learning backend is not safe.
+            ctx = multiprocessing.get_context('spawn')
+            self._pool = ctx.Pool(self.workers, initializer=_init_worker,
+                                  initargs=(self._model_config(), self.image_size, threads))
+            weakref.finalize(self, self._pool.terminate)
+        return self._pool
+
+    def _model_config(self):
+        return (self.architecture, self.variant, self.image_size, self.alpha,
+                self.output_layer, self.trainings_dir)
 
 @source('image-features', descr='Load Images and convert to feature vectors.', input_patterns=INPUT_PATTERNS)
 @option('output-layer', default='last', descr='Index or name of the output layer to use.', type="Union[str,int]")
@@ -31,6 +261,9 @@ class ImageNetFeatures:
 @option('variant', default='auto', descr='The variant of the CNN.', type=str)
 @option('size', default="auto", descr='The input size of the CNN.', type='Union[str, int]')
 @option('alpha', default=1.0, descr='MobileNet alpha value.', type=float)
+@option('workers', default=1, descr='Number of processes used to compute features.', type=int, validate='>=1')
+@option('threads', default=None, descr='Number of threads per worker process.', type='Optional[int]', validate='>=1')
+@option('feature-store', default=None, descr='Directory of a feature store shared between projects, or on for <cache-dir>/features [default: off].', type='Optional[Union[str, bool]]')
 class ImageFeaturesSource(ImageSource, ImageNetFeatures):
 
     def __init__(self, args: dict={}):
@@ -38,26 +271,16 @@ class ImageFeaturesSource(ImageSource, ImageNetFeatures):
         ImageNetFeatures.__init__(self, args)
 
     def transform(self, sample):
-        if not self.model:
-            if not self.architecture.startswith("@"):
-                _, self.preprocess_input, self.model = \
-                    get_imagenet_architecture(self.architecture, self.variant, self.size, self.alpha, self.output_layer)
-            else:
-                self.model = get_custom_architecture(self.architecture, self.trainings_dir, self.output_layer)
-                self.preprocess_input = generic_preprocess_input
-
-        x = sample.x
-        x = x.convert('RGB')
-        x = resize_image(x, self.image_size, self.image_size, 'antialias', 'aspect-fill')
-        #x = x.resize((self.image_size, self.image_size))
-        x = np.asarray(x)
-        x = np.expand_dims(x, axis=0)
-        x = self.preprocess_input(x)
-        features = self.model.predict(x)
-        features = features.flatten()
-        sample.x = features
-        sample.y = None
-        return sample
+        return next(self.transform_samples([sample]))
+
+    def transform_samples(self, samples):
+        for sample, features in self.extract_features(samples):
+            sample.x = features
+            sample.y = None
+            yield sample
+
+    def configuration(self):
+        return _hashed_configuration(super().configuration())
 
 @source('labeled-image-features', descr='Load labeled Images and convert to feature vectors.', input_patterns=INPUT_PATTERNS)
 @option('output-layer', default='last', descr='Index or name of the output layer to use.', type="Union[str,int]")
@@ -65,6 +288,9 @@ class ImageFeaturesSource(ImageSource, ImageNetFeatures):
 @option('variant', default='auto', descr='The variant of the CNN.', type=str)
 @option('size', default="auto", descr='The size of the CNN.', type='Union[str, int]')
 @option('alpha', default=1.0, descr='MobileNet alpha value.', type=float)
+@option('workers', default=1, descr='Number of processes used to compute features.', type=int, validate='>=1')
+@option('threads', default=None, descr='Number of threads per worker process.', type='Optional[int]', validate='>=1')
+@option('feature-store', default=None, descr='Directory of a feature store shared between projects, or on for <cache-dir>/features [default: off].', type='Optional[Union[str, bool]]')
 class LabeledImageFeaturesSource(LabeledImageSource, ImageNetFeatures):
 
     def __init__(self, args: dict={}):
@@ -72,28 +298,85 @@ class LabeledImageFeaturesSource(LabeledImageSource, ImageNetFeatures):
         ImageNetFeatures.__init__(self, args)
 
     def transform(self, sample):
-        if not self.model:
-            if not self.architecture.startswith("@"):
-                self.preprocess_input = get_preprocess_input(self.architecture)
-                self.model = get_imagenet_architecture(self.architecture, self.variant, self.image_size, self.alpha, self.output_layer)
-            else:
-                # TODO get image size!
-                self.model = get_custom_architecture(self.architecture, self.trainings_dir, self.output_layer)
-                self.preprocess_input = generic_preprocess_input
+        return next(self.transform_samples([sample]))
 
-        x = sample.x
+    def transform_samples(self, samples):
+        for sample, features in self.extract_features(samples):
+            sample.x = features
+            yield super().transform(sample)
+
+    def configuration(self):
+        return _hashed_configuration(super().configuration())
+
+
+def _hashed_configuration(conf):
+    """Remove options which don't change the computed features from conf."""
+    return {k: v for k, v in conf.items() if k not in _RUNTIME_OPTIONS}
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _load_model(architecture, variant, image_size, alpha, output_layer, trainings_dir):
+    """Return a tuple (preprocess_input, model)."""
+    if not architecture.startswith("@"):
+        preprocess_input = get_preprocess_input(architecture)
+        model = get_imagenet_architecture(architecture, variant, image_size, alpha, output_layer)
+    else:
+        # TODO get image size!
+        model = get_custom_architecture(architecture, trainings_dir, output_layer)
+        preprocess_input = generic_preprocess_input
+    return preprocess_input, model
+
+
+def _compute_features(model, preprocess_input, images, image_size):
+    """Run a list of images through the model and return one flat feature vector per image."""
+    xs = []
+    for img in images:
         # TODO better resize
-        x = x.convert('RGB')
-        x = resize_image(x, self.image_size, self.image_size, 'antialias', 'aspect-fill')
-        # x = x.resize((self.image_size, self.image_size))
-        x = np.asarray(x)
-        x = np.expand_dims(x, axis=0)
-        x = self.preprocess_input(x)
-        features = self.model.predict(x)
-        features = features.flatten()
-        sample.x = features
-        sample = super().transform(sample)
-        return sample
+        img = img.convert('RGB')
+        img = resize_image(img, image_size, image_size, 'antialias', 'aspect-fill')
+        xs.append(np.asarray(img))
+    x = preprocess_input(np.stack(xs))
+    features = model.predict(x)
+    return features.reshape(len(images), -1)
+
+
+# State of a feature extraction worker process.
+_WORKER = {}
+
+def _init_worker(model_config, image_size, threads):
+    # limit the threads used by the backend before it is imported
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    _WORKER.update(model_config=model_config, image_size=image_size, threads=threads, model=None)
+
+
+def _worker_features(images):
+    if _WORKER['model'] is None:
+        # Each worker lazily loads its own copy of the model.
+        _set_backend_threads(_WORKER['threads'])
+        _WORKER['preprocess_input'], _WORKER['model'] = _load_model(*_WORKER['model_config'])
+    return _compute_features(_WORKER['model'], _WORKER['preprocess_input'], images, _WORKER['image_size'])
+
+
+def _set_backend_threads(threads):
+    from keras import backend as K
+    if K.backend() == 'tensorflow':
+        import tensorflow as tf
+
+        if hasattr(tf, 'config') and hasattr(tf.config, 'threading'):
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        else:
+            # TensorFlow 1.x
+            config = tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=1)
+            K.set_session(tf.Session(config=config))
 
 
 
@@ -1,6 +1,6 @@
 from vergeml.img import INPUT_PATTERNS, open_image, fixext
 from vergeml.io import source, SourcePlugin, Sample
-import random
+from vergeml.cache import MetaStore
 import numpy as np
 from PIL import Image
 import os.path
@@ -11,6 +11,7 @@ class ImageSource(SourcePlugin):
 
     def __init__(self, config: dict={}):
         self.files = None
+        self.metas = None
         super().__init__(config)
             
     def begin_read_samples(self):
@@ -18,18 +19,22 @@ class ImageSource(SourcePlugin):
             return
         
         self.files = self.scan_and_split_files()
+        self.metas = {split: MetaStore(meta for _, meta in files) for split, files in self.files.items()}
 
     def num_samples(self, split: str) -> int:
         return len(self.files[split])
 
+    def sample_meta(self, split: str):
+        return self.metas[split]
+
     def read_samples(self, split, index, n=1):
         items = self.files[split][index:index+n]
-        items = [(open_image(filename), meta) for filename, meta in items]
+        items = [(open_image(filename), self.metas[split][i].copy()) for i, (filename, _) in enumerate(items, index)]
         
         res = []
         for img, meta in items:
-            rng = random.Random(str(self.random_seed) + meta['filename'])
-            res.append(Sample(img, None, meta.copy(), rng)) 
+            rng = self.sample_rng(meta['filename'])
+            res.append(Sample(img, None, meta, rng))
 
         return res
 
@@ -1,15 +1,14 @@
 from vergeml.img import INPUT_PATTERNS, open_image, fixext, ImageType
 from vergeml.io import source, SourcePlugin, Sample
-from vergeml.data import Labels
-from vergeml.utils import VergeMLError, xlink
+from vergeml.cache import MetaStore
+from vergeml.data import Labels, LabelIndex
+from vergeml.utils import VergeMLError, xlink, pack_rows
 from vergeml.option import option
-import random
 import numpy as np
 from PIL import Image
 import os.path
 import json
 from operator import methodcaller
-import io
 from copy import deepcopy
 
 
@@ -21,6 +20,8 @@ class LabeledImageSource(SourcePlugin):
 
     def __init__(self, config: dict={}):
         self.files = None
+        self.metas = None
+        self.label_index = None
         self.oversample = deepcopy(config.get('oversample', dict()))
         super().__init__(config)
 
@@ -42,32 +43,12 @@ class LabeledImageSource(SourcePlugin):
             raise VergeMLError("No labels found.")
 
         self.files = self.scan_and_split_files(self._scan_dirs(classes_are_directories))
+        self.metas = {split: MetaStore(meta for _, meta in files) for split, files in self.files.items()}
 
-
-        if self.oversample:
-
-            nfiles = {}
-
-            for split, filenames in self.files.items():
-
-                if split == 'test':
-                    # don't augment test samples
-                    nfiles['test'] = filenames
-                    continue
-
-                nfiles[split] = []
-                for filename, meta in filenames:
-                    # nfile = self.normalize_filename(split, filename)
-                    labels = self.classes["files"][filename]
-
-                    nfiles[split].append((filename, meta))
-                    for k, v in self.oversample.items():
-                        if k in labels:
-                            for _ in range(v-1):
-                                nfiles[split].append((filename, meta))
-
-            self.files = nfiles
-
+        # store the labels of each file as class ids
+        index = LabelIndex.of(self)
+        self.classes['files'] = {filename: index.encode([l for l in labels if l in index.ids])
+                                 for filename, labels in self.classes['files'].items()}
 
     def num_samples(self, split: str) -> int:
         return len(self.files[split])
@@ -149,28 +130,57 @@ class LabeledImageSource(SourcePlugin):
 
         return res['train'], res['val'], res['test']
 
+    def sample_labels(self, split: str):
+        return pack_rows([self.classes["files"][filename] for filename, _ in self.files[split]])
+
+    def sample_meta(self, split: str):
+        return self.metas[split]
+
+    def sample_repeats(self, split: str):
+        if not self.oversample or split == 'test':
+            # don't oversample test samples
+            return None
+
+        index = LabelIndex.of(self)
+        ids, offsets = self.sample_labels(split)
+        owners = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        repeats = np.ones(len(offsets) - 1, dtype='int64')
+
+        # a sample is read once more for each oversampled label it has
+        for label, times in self.oversample.items():
+            if label in index.ids:
+                has_label = np.zeros(len(repeats), dtype=bool)
+                has_label[owners[ids == index.ids[label]]] = True
+                repeats += has_label * (times - 1)
+
+        return repeats
+
     def read_samples(self, split, index, n=1):
         items = self.files[split][index:index+n]
-        items = [(open_image(filename), filename, meta) for filename, meta in items]
+        items = [(open_image(filename), filename, self.metas[split][i].copy())
+                 for i, (filename, _) in enumerate(items, index)]
 
         res = []
         for img, filename, meta in items:
-            rng = random.Random(str(self.random_seed) + meta['filename'])
-            y = Labels(self.classes["files"][filename])
-            res.append(Sample(img, y, meta.copy(), rng))
+            rng = self.sample_rng(meta['filename'])
+            y = self.classes["files"][filename]
+            res.append(Sample(img, y, meta, rng))
 
         return res
 
 
     def hash(self, state) -> str:
-        state = io.BytesIO(state.encode('utf8'))
-        state.write(str(self.oversample).encode('utf8'))
-        return super().hash(state.getvalue().decode('utf8') + self.hash_files(self.files))
+        return super().hash(state + self.hash_files(self.files))
+
+    def configuration(self):
+        # oversampling is done when reading samples and does not change the cached samples
+        return {k: v for k, v in super().configuration().items() if k != 'oversample'}
 
     def transform(self, sample):
-        onehot = np.array([float(label in sample.y) for label in self.meta['labels']])
+        index = LabelIndex.of(self)
+        ids = index.encode(sample.y) if isinstance(sample.y, Labels) else sample.y
         sample.x = np.asarray(sample.x)
-        sample.y = onehot
+        sample.y = index.onehot(ids)
         return sample
 
     def begin_preview(self, output_dir):
@@ -188,7 +198,11 @@ class LabeledImageSource(SourcePlugin):
         if not isinstance(sample.x, ImageType):
             raise VergeMLError("Can't write sample with type: {}".format(type(sample.x)))
 
-        if not isinstance(sample.y, Labels):
+        if isinstance(sample.y, np.ndarray) and sample.y.dtype.kind == 'i':
+            labels = LabelIndex.of(self).decode(sample.y)
+        elif isinstance(sample.y, Labels):
+            labels = sample.y
+        else:
             raise VergeMLError("Can't write ground truth with type: {}".format(type(sample.y)))
 
         # get the right filename in .data to write the sample to
@@ -199,7 +213,7 @@ class LabeledImageSource(SourcePlugin):
 
         # create directories and hyperlinks so that split and label are visible in a file
         # manager
-        for label in sample.y:
+        for label in labels:
             link_dir = os.path.join(output_dir, split, label)
             if not os.path.exists(link_dir):
                 os.makedirs(link_dir)
@@ -0,0 +1,194 @@
+from vergeml.img import open_image
+from vergeml.io import source, SourcePlugin, Sample
+from vergeml.data import Labels, LabelIndex
+from vergeml.utils import VergeMLError, SPLITS, take_rows, file_state
+from vergeml.option import option
+import numpy as np
+import os
+import os.path
+import csv
+import json
+import hashlib
+from array import array
+
+# increment when the layout of the index files changes
+_INDEX_VERSION = 2
+
+# the split of entries without a split column
+_AUTO_SPLIT = -1
+
+_LABEL_SEPARATOR = "|"
+
+
+@source('manifest', descr="Load labeled images listed in a CSV or JSONL file.")
+@option('manifest', type='Optional[str]',
+        descr="Path to the manifest, by default manifest.csv or manifest.jsonl in samples-dir.")
+class ManifestSource(SourcePlugin):
+    """Load labeled images from a manifest file.
+
+    Every entry of the manifest names an image path relative to samples_dir, its labels
+    and optionally its split. CSV manifests need a header with the columns 'path', 'labels'
+    and optionally 'split', where multiple labels are separated by '|'. JSONL manifests
+    contain one object per line with the keys 'path', 'labels' (a string or a list) and
+    optionally 'split'. When the manifest has splits, samples are not split automatically
+    and entries without a split are train samples.
+
+    The manifest is parsed line by line into compact arrays, which are stored in cache_dir
+    so later runs don't parse the manifest again.
+    """
+
+    def __init__(self, args: dict={}):
+        self.manifest = args.get('manifest')
+        self.index = None
+        self.samples = None
+        self.label_index = None
+        super().__init__(args)
+
+    def begin_read_samples(self):
+        if self.samples is not None:
+            return
+
+        path = self._manifest_path()
+        self.index = self._load_index(path)
+        self.meta['labels'] = Labels(self.index['labels'])
+
+        splits = self.index['split']
+
+        if self.index['has_split']:
+            # splits are determined by the manifest - turn off automatic split and
+            # treat entries without a split as train samples
+            splits = np.where(splits == _AUTO_SPLIT, SPLITS.index('train'), splits)
+            self.samples = {split: np.flatnonzero(splits == i) for i, split in enumerate(SPLITS)}
+        else:
+            train, val, test = self.split(len(splits))
+            self.samples = dict(train=np.array(train, dtype='int64'),
+                                val=np.array(val, dtype='int64'),
+                                test=np.array(test, dtype='int64'))
+
+    def num_samples(self, split: str) -> int:
+        return len(self.samples[split])
+
+    def sample_labels(self, split: str):
+        return take_rows(self.index['label_ids'], self.index['label_offsets'], self.samples[split])
+
+    def read_samples(self, split: str, index: int, n: int=1):
+        res = []
+        for entry in self.samples[split][index:index+n]:
+            filename = self._path(entry)
+            img = open_image(os.path.join(self.samples_dir, filename))
+            rng = self.sample_rng(filename)
+            res.append(Sample(img, self._label_ids(entry), dict(split=split, filename=filename), rng))
+        return res
+
+    def transform(self, sample):
+        sample.x = np.asarray(sample.x)
+        sample.y = LabelIndex.of(self).onehot(sample.y)
+        return sample
+
+    def hash(self, state: str) -> str:
+        path = self._manifest_path()
+        return super().hash(state + file_state(path))
+
+    def _path(self, entry):
+        offsets = self.index['path_offsets']
+        return self.index['paths'][offsets[entry]:offsets[entry+1]].tobytes().decode('utf-8')
+
+    def _label_ids(self, entry):
+        offsets = self.index['label_offsets']
+        return self.index['label_ids'][offsets[entry]:offsets[entry+1]]
+
+    def _manifest_path(self):
+        if self.manifest:
+            path = self.manifest
+        else:
+            candidates = [os.path.join(self.samples_dir, name) for name in ("manifest.csv", "manifest.jsonl")]
+            path = next(filter(os.path.exists, candidates), candidates[0])
+
+        if not os.path.exists(path):
+            raise VergeMLError("Manifest not found: {}".format(path),
+                               "Please check the option manifest of the data source.")
+        return path
+
+    def _load_index(self, path):
+        """Load the index of the manifest at path from cache_dir or build it."""
+        state = "{}{}".format(_INDEX_VERSION, file_state(os.path.abspath(path)))
+        md5 = hashlib.md5(state.encode('utf-8'))
+        index_path = os.path.join(self.cache_dir, "manifest-{}.npz".format(md5.hexdigest()))
+
+        if os.path.exists(index_path):
+            with np.load(index_path) as data:
+                index = dict(data)
+            index['labels'] = json.loads(index['labels'].tobytes().decode('utf-8'))
+            return index
+
+        index = _parse_manifest(path)
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        labels = np.frombuffer(json.dumps(index['labels']).encode('utf-8'), dtype='uint8')
+        tmp_path = "{}.{}.tmp.npz".format(index_path, os.getpid())
+        np.savez(tmp_path, **dict(index, labels=labels))
+        os.replace(tmp_path, index_path)
+
+        return index
+
+
+def _read_entries(path):
+    """Yield (path, labels, split) for every entry in the manifest."""
+    with open(path, newline='', encoding='utf-8') as file:
+        if path.lower().endswith(".jsonl"):
+            for lineno, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    labels = entry['labels']
+                    yield entry['path'], [labels] if isinstance(labels, str) else labels, entry.get('split')
+                except (ValueError, KeyError, TypeError):
+                    raise VergeMLError("Invalid entry in manifest {} on line {}.".format(path, lineno))
+        else:
+            reader = csv.DictReader(file)
+            if not reader.fieldnames or not {'path', 'labels'} <= set(reader.fieldnames):
+                raise VergeMLError("Invalid manifest: {}".format(path),
+                                   "The first row must name the columns path, labels and optionally split.")
+            for row in reader:
+                yield row['path'], list(filter(None, row['labels'].split(_LABEL_SEPARATOR))), row.get('split')
+
+
+def _parse_manifest(path):
+    paths = bytearray()
+    path_offsets = array('q', [0])
+    label_ids = array('i')
+    label_offsets = array('q', [0])
+    splits = array('b')
+    has_split = False
+    label_map = {}
+
+    for filename, labels, split in _read_entries(path):
+        if split and split not in SPLITS:
+            raise VergeMLError("Invalid split '{}' for {} in manifest {}.".format(split, filename, path))
+
+        paths.extend(filename.encode('utf-8'))
+        path_offsets.append(len(paths))
+        label_ids.extend(label_map.setdefault(label, len(label_map)) for label in labels)
+        label_offsets.append(len(label_ids))
+        splits.append(SPLITS.index(split) if split else _AUTO_SPLIT)
+        has_split = has_split or split is not None
+
+    if not label_map:
+        raise VergeMLError("No labels found in manifest: {}".format(path))
+
+    # number labels in alphabetical order
+    labels = sorted(label_map)
+    remap = np.empty(len(labels), dtype='int32')
+    for new_id, label in enumerate(labels):
+        remap[label_map[label]] = new_id
+
+    return dict(paths=np.frombuffer(bytes(paths), dtype='uint8'),
+                path_offsets=np.frombuffer(path_offsets, dtype='int64'),
+                label_ids=remap[np.frombuffer(label_ids, dtype='int32')],
+                label_offsets=np.frombuffer(label_offsets, dtype='int64'),
+                split=np.frombuffer(splits, dtype='int8'),
+                has_split=np.array(has_split),
+                labels=labels)
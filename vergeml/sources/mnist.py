@@ -1,16 +1,11 @@
-from vergeml.img import INPUT_PATTERNS, open_image, fixext, ImageType
 from vergeml.io import source, SourcePlugin, Sample
 from vergeml.data import Labels
-from vergeml.utils import VergeMLError
-from vergeml.sources.labeled_image import LabeledImageSource
+from vergeml.utils import VergeMLError, file_state
 import random
 import numpy as np
-from PIL import Image
+import os
 import os.path
-import json
-from operator import methodcaller
-import io
-from typing import List
+import struct
 import gzip
 import hashlib
 
@@ -44,21 +39,26 @@ def _md5(fname):
     return hash_md5.hexdigest()
 
 
-@source('image', descr="Load images in MNIST format.")
+@source('mnist', descr="Load images in MNIST format.")
 class InputMnist(SourcePlugin):
-    data = None
+    """Load samples from the IDX files of MNIST or Fashion-MNIST.
 
-    def num_samples(self, split: str) -> int:
-        return len(self.data[split])
+    The images of a file are decompressed once into cache_dir and memory mapped as a single
+    uint8 array. Splits are index arrays into these arrays, so reading samples does not
+    require to create an image object per sample. Without operations, loading a split
+    as arrays reads batches with read_arrays() and does not create samples at all.
+    """
 
-    def read_sample(self, split: str, index: int):
-        return self.data[split][index]
+    def __init__(self, args: dict={}):
+        self.arrays = None
+        self.indices = None
+        super().__init__(args)
 
-    def _check_files(self):
-        self.data = dict(train=[], val=[], test=[])
+    def begin_read_samples(self):
+        if self.indices:
+            return
 
-        samples_dir = self.config["samples_dir"]
-        files = [os.path.join(samples_dir, file) for file in _FILES]
+        files = self._files()
 
         for path in files:
             if not os.path.exists(path):
@@ -66,58 +66,113 @@ class InputMnist(SourcePlugin):
                     os.path.basename(path)))
 
         if _md5(files[0]) == _MD5_FASHION:
-            self.meta['labels'] = _FASHION_MNIST_LABELS
+            self.meta['labels'] = Labels(_FASHION_MNIST_LABELS)
         else:
-            self.meta['labels'] = _MNIST_LABELS
-
-        # preload
-        for split, images, labels in (('train', files[0], files[1]), ('test', files[2], files[3])):
-
-            with gzip.open(images) as f:
-                # First 16 bytes are magic_number, n_imgs, n_rows, n_cols
-                pixels = np.frombuffer(f.read(), 'B', offset=16)
-                pixels = pixels.reshape(-1, 28, 28)
-
-            with gzip.open(labels) as f:
-                # First 8 bytes are magic_number, n_labels
-                integer_labels = np.frombuffer(f.read(), 'B', offset=8)
-
-            n_cols = integer_labels.max() + 1
-
-            for ix, imagearr in enumerate(pixels):
-                label = integer_labels[ix]
-                onehot = np.zeros((n_cols), dtype='float32')
-                onehot[label] = 1.0
-                self.data[split].append((Image.fromarray(imagearr), onehot,
-                                         dict(labels=self.meta['labels'],
-                                              filename=images,
-                                              split=split,
-                                              types=('pil', 'labels'))))
-
-            if split == 'train':
-                n = self.config['val_num']
-
-                if self.config['val_perc'] is not None:
-                    n = int(len(self.data['train']) * self.config['val_perc'] // 100)
-                if n is not None:
-                    if n > len(self.data['train']):
-                        raise VergeMLError("number of test samples is greater than number of available samples.")
-
-                    rng = random.Random(self.config['random_seed'])
-                    count = len(self.data[split])
-                    indices = rng.sample(range(count), count)
-                    self.data['val'] = [self.data['train'][i] for i in indices[:n]]
-                    self.data['train'] = [self.data['train'][i] for i in indices[n:]]
-
-            else:
-
-                if self.config['test_num']:
-                    if self.config['test_num'] > len(self.data['test']):
-                        raise VergeMLError("number of test samples is greater than number of available samples.")
-
-                    rng = random.Random(self.config['random_seed'])
-                    indices = rng.sample(range(len(self.data[split])), len(pixels))
-                    self.data['test'] = [self.data['test'][i] for i in indices[:n]]
+            self.meta['labels'] = Labels(_MNIST_LABELS)
+
+        self.arrays = dict(train=(self._open_images(files[0]), self._read_labels(files[1])),
+                           test=(self._open_images(files[2]), self._read_labels(files[3])))
+
+        num_train = len(self.arrays['train'][1])
+        num_test = len(self.arrays['test'][1])
+
+        # samples in val are taken from the train file and samples in test from the t10k file.
+        self.indices = dict(train=('train', np.arange(num_train)),
+                            val=('train', np.arange(0)),
+                            test=('test', np.arange(num_test)))
+
+        n = self.val_num
+        if self.val_perc is not None:
+            n = int(num_train * self.val_perc // 100)
+
+        if n is not None:
+            if n > num_train:
+                raise VergeMLError("number of val samples is greater than number of available samples.")
+
+            rng = random.Random(self.random_seed)
+            indices = np.array(rng.sample(range(num_train), num_train))
+            self.indices['val'] = ('train', indices[:n])
+            self.indices['train'] = ('train', indices[n:])
+
+        if self.test_num:
+            if self.test_num > num_test:
+                raise VergeMLError("number of test samples is greater than number of available samples.")
+
+            rng = random.Random(self.random_seed)
+            indices = np.array(rng.sample(range(num_test), num_test))
+            self.indices['test'] = ('test', indices[:self.test_num])
+
+    def num_samples(self, split: str) -> int:
+        return len(self.indices[split][1])
+
+    def sample_labels(self, split: str):
+        name, indices = self.indices[split]
+        return self.arrays[name][1][indices], np.arange(len(indices) + 1)
+
+    def read_arrays(self, split: str, index: int, n: int=1):
+        """Read n samples starting at index as a tuple of arrays (xs, ys).
+
+        xs are uint8 images of shape (n, rows, cols) and ys are the class ids.
+        """
+        name, indices = self.indices[split]
+        images, labels = self.arrays[name]
+        ixs = indices[index:index+n]
+        return images[ixs], labels[ixs]
+
+    def read_samples(self, split: str, index: int, n: int=1):
+        xs, ys = self.read_arrays(split, index, n)
+        ixs = self.indices[split][1][index:index+n]
+        return [Sample(x, y, dict(split=split, index=ix),
+                       self.sample_rng(ix, compat_seed=self.random_seed + ix))
+                for x, y, ix in zip(xs, ys, ixs.tolist())]
+
+    def transform(self, sample):
+        onehot = np.zeros(len(self.meta['labels']), dtype='float32')
+        onehot[sample.y] = 1.0
+        sample.x = np.asarray(sample.x)
+        sample.y = onehot
+        return sample
+
+    def transform_arrays(self, xs, ys):
+        """Transform the arrays returned by read_arrays() like transform() does each sample."""
+        onehot = np.zeros((len(ys), len(self.meta['labels'])), dtype='float32')
+        onehot[np.arange(len(ys)), ys] = 1.0
+        return np.asarray(xs), onehot
+
+    def hash(self, state: str) -> str:
+        return super().hash(state + "".join(map(file_state, self._files())))
+
+    def _files(self):
+        return [os.path.join(self.samples_dir, file) for file in _FILES]
+
+    def _open_images(self, path):
+        """Decompress an IDX image file into cache_dir and memory map it."""
+        md5 = hashlib.md5(file_state(os.path.abspath(path)).encode('utf-8'))
+        idx_path = os.path.join(self.cache_dir, "mnist-{}.idx".format(md5.hexdigest()))
+
+        if not os.path.exists(idx_path):
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+
+            # decompress to a temporary file first so that an interrupted run does
+            # not leave a truncated file behind
+            tmp_path = "{}.{}.tmp".format(idx_path, os.getpid())
+            with gzip.open(path) as src, open(tmp_path, "wb") as dest:
+                for chunk in iter(lambda: src.read(1 << 20), b""):
+                    dest.write(chunk)
+            os.replace(tmp_path, idx_path)
+
+        with open(idx_path, "rb") as f:
+            # First 16 bytes are magic_number, n_imgs, n_rows, n_cols
+            _, n_imgs, n_rows, n_cols = struct.unpack('>IIII', f.read(16))
+
+        return np.memmap(idx_path, dtype='uint8', mode='r', offset=16, shape=(n_imgs, n_rows, n_cols))
+
+    @staticmethod
+    def _read_labels(path):
+        with gzip.open(path) as f:
+            # First 8 bytes are magic_number, n_labels
+            return np.frombuffer(f.read(), 'B', offset=8).astype('int32')
 
 
 plugin = InputMnist
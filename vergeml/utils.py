@@ -5,9 +5,15 @@ import textwrap
 from collections import namedtuple
 import re
 import os
+import struct
+
+import numpy as np
 
 SPLITS = ('train', 'val', 'test')
 
+# size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER_SIZE = 30
+
 
 class VergeMLError(Exception):
     """System error.
@@ -212,6 +218,44 @@ def parse_split(value):
         return ('num', int(value))
     return ('dir', value)
 
+def pack_rows(rows):
+    """Pack a list of int arrays into a ragged array.
+
+    Returns a tuple (values, offsets) where row i is values[offsets[i]:offsets[i+1]].
+    """
+    rows = [np.asarray(row, dtype='int32') for row in rows]
+    offsets = np.zeros(len(rows) + 1, dtype='int64')
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    values = np.concatenate(rows) if rows else np.zeros(0, dtype='int32')
+    return values.astype('int32', copy=False), offsets
+
+def take_rows(values, offsets, rows):
+    """Select rows of the ragged array (values, offsets).
+
+    Returns a new tuple (values, offsets).
+    """
+    rows = np.asarray(rows, dtype='int64')
+    lengths = offsets[1:][rows] - offsets[:-1][rows]
+    new_offsets = np.zeros(len(rows) + 1, dtype='int64')
+    np.cumsum(lengths, out=new_offsets[1:])
+    src = np.repeat(offsets[:-1][rows] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return values[src], new_offsets
+
+def file_state(path):
+    """Return a string which changes when the file at path is modified.
+    """
+    return "{}{}{}".format(path, os.path.getmtime(path), os.path.getsize(path))
+
+def zip_data_offset(file, header_offset):
+    """Return the offset of the data of the zip member whose local header is at header_offset.
+
+    The local header may have other extra fields than the central directory, so it
+    is read from file.
+    """
+    file.seek(header_offset)
+    name_len, extra_len = struct.unpack('<HH', file.read(_ZIP_LOCAL_HEADER_SIZE)[26:30])
+    return header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+
 def format_info_text(text, indent=0, width=70):
     """Return text formatted for readability.
     """
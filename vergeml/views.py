@@ -6,10 +6,209 @@ libraries.
 
 import random
 import itertools
-from typing import Callable, Any
+import collections
+import weakref
+from typing import Callable, Any, Optional
 
 import numpy as np
 
+from vergeml.utils import VergeMLError
+
+SAMPLERS = ('weighted', 'balanced', 'stratified')
+
+# How randomized views shuffle the samples: "fetch" shuffles blocks of fetch_size
+# consecutive samples (faster to read), "sample" shuffles individual samples and
+# "buffer" reads large windows sequentially and shuffles in a bounded buffer.
+SHUFFLES = ('fetch', 'sample', 'buffer')
+
+
+class Sampler:
+    """Decide which samples are read in each epoch and in which order.
+
+    Samplers resample the indices of a split instead of duplicating samples, so
+    oversampling does not increase the size of the cache. The following samplers are
+    supported:
+
+    - None: read every sample once per epoch (or as often as the source requests
+      via sample_repeats(), which implements oversampling).
+    - "weighted": draw samples with replacement, weighted by label_weights (a dict
+      mapping label names to weights).
+    - "balanced": draw samples with replacement so that every label is equally likely.
+    - "stratified": read every sample once, ordered so that each batch contains the
+      labels in about the same proportion as the split.
+    """
+
+    def __init__(self, # pylint: disable=R0913
+                 loader,
+                 split: str,
+                 sampler: Optional[str] = None,
+                 label_weights: Optional[dict] = None,
+                 randomize: bool = False,
+                 random_seed: int = 42):
+
+        if sampler not in (None,) + SAMPLERS:
+            raise VergeMLError("Invalid sampler: {}".format(sampler),
+                               "Valid samplers are: {}".format(", ".join(SAMPLERS)))
+
+        self.sampler = sampler
+        self.randomize = randomize
+        self.random_seed = random_seed
+
+        loader.begin_read_samples()
+        num_samples = loader.num_samples(split)
+        repeats = loader.sample_repeats(split)
+        labels = loader.sample_labels(split) if sampler else None
+        label_names = loader.meta.get('labels') or []
+        loader.end_read_samples()
+
+        # False when every sample is read once per epoch
+        self.resamples = sampler is not None or repeats is not None
+
+        if sampler and labels is None:
+            raise VergeMLError("The sampler '{}' requires a data source with labels.".format(sampler))
+
+        # the indices of one epoch before sampling
+        self.base = np.arange(num_samples)
+        if repeats is not None:
+            self.base = np.repeat(self.base, repeats)
+
+        if sampler:
+            ids, offsets = labels
+            lengths = np.diff(offsets)
+            owners = np.repeat(np.arange(num_samples), lengths)
+            num_labels = max(len(label_names), int(ids.max()) + 1 if len(ids) else 0)
+
+        if sampler == 'weighted':
+            weights = np.ones(num_labels)
+            for label, weight in (label_weights or {}).items():
+                if label not in label_names:
+                    raise VergeMLError("Invalid label in label_weights: {}".format(label))
+                weights[label_names.index(label)] = weight
+
+            # the weight of a sample is the largest weight of its labels
+            sample_weights = np.full(num_samples, -np.inf)
+            np.maximum.at(sample_weights, owners, weights[ids])
+            self.probs = self._normalize(np.where(lengths > 0, sample_weights, 1.))
+
+        elif sampler == 'balanced':
+            counts = np.bincount(ids, minlength=num_labels)
+            sample_weights = np.bincount(owners, weights=1. / counts[ids], minlength=num_samples)
+            self.probs = self._normalize(sample_weights / np.maximum(lengths, 1))
+
+        elif sampler == 'stratified':
+            # stratify by the first label; samples without labels form their own class
+            if len(ids):
+                self.classes = np.where(lengths > 0, ids[np.minimum(offsets[:-1], len(ids) - 1)], num_labels)
+            else:
+                self.classes = np.full(num_samples, num_labels)
+
+    def _normalize(self, sample_weights):
+        # repeated samples are drawn more often
+        probs = np.bincount(self.base, minlength=len(sample_weights)) * sample_weights
+        total = probs.sum()
+        if total <= 0:
+            raise VergeMLError("Can't sample - all samples have a weight of zero.")
+        return probs / total
+
+    def __len__(self):
+        """The number of samples read per epoch."""
+        return len(self.base)
+
+    def plans(self):
+        """Return an infinite generator yielding the sample indices of each epoch.
+
+        Every call returns a new generator yielding the same sequence.
+        """
+        rng = np.random.RandomState(self.random_seed)
+        while True:
+            yield self._plan(rng)
+
+    def _plan(self, rng):
+        if self.sampler in ('weighted', 'balanced'):
+            return rng.choice(len(self.probs), size=len(self.base), p=self.probs)
+
+        if self.sampler == 'stratified':
+            # group by class in random order, then interleave the classes by spreading
+            # each class evenly over the epoch
+            perm = rng.permutation(len(self.base))
+            classes = self.classes[self.base[perm]]
+            order = perm[np.argsort(classes, kind='stable')]
+            classes = self.classes[self.base[order]]
+            sizes = np.bincount(classes)
+            rank = np.arange(len(order)) - (np.cumsum(sizes) - sizes)[classes]
+            keys = (rank + rng.random_sample(len(order))) / sizes[classes]
+            return self.base[order[np.argsort(keys, kind='stable')]]
+
+        return rng.permutation(self.base) if self.randomize else self.base
+
+
+def _plan_batch_ixs(plans, batch_size: int):
+    """A generator which yields a list of tuples (offset, size) following sample plans.
+
+    :param plans: An infinite generator yielding an array of sample indices per epoch.
+    :param batch_size: The size of the batch to fill.
+
+    Runs of consecutive indices are fetched together.
+    """
+    buffer = np.arange(0)
+
+    while True:
+        while len(buffer) < batch_size:
+            plan = next(plans)
+            if not len(plan):
+                return
+            buffer = np.concatenate((buffer, plan))
+
+        batch, buffer = buffer[:batch_size], buffer[batch_size:]
+        yield _index_runs(batch)
+
+
+def _index_runs(ixs, max_size=None):
+    """Split an array of indices into a list of (offset, size) runs of consecutive indices.
+
+    When max_size is given, longer runs are split into runs of at most max_size.
+    """
+    breaks = np.flatnonzero(np.diff(ixs) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(ixs)]))
+
+    if max_size:
+        parts = -(-(ends - starts) // max_size)
+        first = np.repeat(np.cumsum(parts) - parts, parts)
+        starts = np.repeat(starts, parts) + (np.arange(parts.sum()) - first) * max_size
+        ends = np.minimum(starts + max_size, np.repeat(ends, parts))
+
+    return [(int(ixs[start]), int(end - start)) for start, end in zip(starts, ends)]
+
+
+def _plan_fetches(plans, fetch_size: int):
+    """A generator which yields tuples (offset, size) reading sample plans in order.
+
+    :param plans: An infinite generator yielding an array of sample indices per epoch.
+    :param fetch_size: The maximum number of consecutive samples read at once.
+    """
+    for plan in plans:
+        if not len(plan):
+            return
+        yield from _index_runs(plan, fetch_size)
+
+
+def _block_plans(num_samples: int, fetch_size: int, random_seed: int):
+    """An infinite generator yielding the sample indices of each epoch in random order.
+
+    When randomizing sample order, samples are laid out according to fetch size to
+    improve performance.
+    """
+    rng = random.Random(random_seed)
+
+    while True:
+        order = list(range(len(range(0, num_samples, fetch_size))))
+        rng.shuffle(order)
+        ixs = (np.array(order, dtype=np.int64)[:, np.newaxis] * fetch_size
+               + np.arange(fetch_size)).ravel()
+        yield ixs[ixs < num_samples]
+
+
 def _rand_batch_ixs(num_samples: int, batch_size: int, fetch_size: int, random_seed: int):
     """A generator which yields a list of tuples (offset, size) in random order.
 
@@ -21,8 +220,16 @@ def _rand_batch_ixs(num_samples: int, batch_size: int, fetch_size: int, random_s
     :param fetch_size: Desired fetch_size.
     :param random_seed: RNG seed.
     """
+    return _pack_fetches(_rand_fetches(num_samples, fetch_size, random_seed), batch_size)
+
+
+def _rand_fetches(num_samples: int, fetch_size: int, random_seed: int):
+    """A generator which yields the fetches of each epoch as arrays (offsets, sizes).
+
+    The fetch blocks are shuffled with python's random module, so a seed always
+    results in the same order of fetches.
+    """
     rng = random.Random(random_seed)
-    batch, batch_count = [], 0
 
     while True:
         if fetch_size * 3 < num_samples:
@@ -32,26 +239,48 @@ def _rand_batch_ixs(num_samples: int, batch_size: int, fetch_size: int, random_s
         else:
             offset = 0
 
-        ixs = list(range(offset, num_samples - offset, fetch_size))
-        rng.shuffle(ixs)
+        order = list(range(len(range(offset, num_samples - offset, fetch_size))))
+        rng.shuffle(order)
 
-        # collect enough samples to fill the batch
+        offsets = np.array(order, dtype=np.int64) * fetch_size + offset
+        yield offsets, np.minimum(fetch_size, num_samples - offsets)
 
-        while ixs:
-            next_fetch = ixs.pop(0)
 
-            # calculate the next fetch size depending on the samples remaining
-            # and the number of samples required to fill the batch
+def _pack_fetches(fetches, batch_size: int):
+    """A generator which packs the fetches of each epoch into batches of batch_size.
 
-            next_fetch_size = min(fetch_size,
-                                  num_samples - next_fetch, batch_size - batch_count)
+    :param fetches: An infinite generator yielding arrays (offsets, sizes) per epoch.
+    :param batch_size: The size of the batch to fill.
+
+    When a fetch does not fit into the batch, it is truncated and the next batch
+    starts with the next fetch. Batches may span the boundary between two epochs.
+    """
+    batch, batch_count = [], 0
+
+    for offsets, sizes in fetches:
+        if not len(offsets):
+            return
+
+        ends = np.cumsum(sizes)
+        pos, consumed = 0, 0
+
+        while pos < len(offsets):
+            # find the fetch which fills the batch
+            target = consumed + batch_size - batch_count
+            last = int(np.searchsorted(ends, target))
+
+            if last == len(offsets):
+                # not enough samples left in this epoch to fill the batch
+                batch.extend(zip(offsets[pos:].tolist(), sizes[pos:].tolist()))
+                batch_count += int(ends[-1]) - consumed
+                break
 
-            batch.append((next_fetch, next_fetch_size))
-            batch_count += next_fetch_size
+            batch.extend(zip(offsets[pos:last].tolist(), sizes[pos:last].tolist()))
+            batch.append((int(offsets[last]), int(sizes[last] - (ends[last] - target))))
+            yield batch
 
-            if batch_count == batch_size:
-                yield batch
-                batch, batch_count = [], 0
+            batch, batch_count = [], 0
+            pos, consumed = last + 1, int(ends[last])
 
 def _ser_batch_ixs(num_samples, batch_size):
     """A generator which yields a list of tuples (offset, size) in serial order.
@@ -83,9 +312,71 @@ def _ser_batch_ixs(num_samples, batch_size):
 
 
 
-def _pumpfn(ix_gen):
+def _window_fetches(num_samples: int, window_size: int, fetch_size: int, random_seed: int):
+    """A generator which yields tuples (offset, size) reading windows sequentially.
+
+    :param num_samples: Number of available samples.
+    :param window_size: The number of consecutive samples in a window.
+    :param fetch_size: The number of samples read at once.
+    :param random_seed: RNG seed.
+
+    The order of the windows is randomized in every epoch, while the samples of a
+    window are read in order.
+    """
+    rng = np.random.RandomState(random_seed)
+    starts = np.arange(0, num_samples, window_size)
+
     while True:
-        yield from next(ix_gen, None)
+        for start in rng.permutation(starts).tolist():
+            end = min(start + window_size, num_samples)
+            for offset in range(start, end, fetch_size):
+                yield offset, min(fetch_size, end - offset)
+
+
+class _ShuffleBuffer:
+    """Return samples in random order from a bounded buffer.
+
+    The buffer is filled with samples read in the order given by an infinite
+    generator of (offset, size) tuples. Every sample taken from the buffer is
+    replaced by the next sample read.
+    """
+
+    def __init__(self, read_fn, fetches, buffer_size: int, random_seed: int):
+        """
+        :param read_fn: A function taking index and n_samples, returning samples.
+        :param fetches: An infinite generator yielding tuples (offset, size).
+        :param buffer_size: The number of samples to keep in memory.
+        :param random_seed: RNG seed.
+        """
+        self.read_fn = read_fn
+        self.fetches = fetches
+        self.buffer_size = buffer_size
+        self.rng = random.Random(random_seed)
+        self.buffer = []
+
+    def take(self, n_samples: int):
+        """Take n_samples random samples from the buffer."""
+        res = []
+
+        for _ in range(n_samples):
+            while len(self.buffer) < self.buffer_size:
+                index, size = next(self.fetches)
+                self.buffer.extend(self.read_fn(index, size))
+
+            # swap a random sample to the end to remove it in constant time
+            i = self.rng.randrange(len(self.buffer))
+            self.buffer[i], self.buffer[-1] = self.buffer[-1], self.buffer[i]
+            res.append(self.buffer.pop())
+
+        return res
+
+
+# the number of batches built ahead when transforming on the pump thread
+_PUMP_BATCHES = 4
+
+def _pumpfn(ix_gen):
+    for batch in ix_gen:
+        yield from batch
 
 class BatchView: # pylint: disable=R0902
     """Generator that returns data as batches (optionally infinite).
@@ -102,24 +393,53 @@ class BatchView: # pylint: disable=R0902
                  randomize: bool = False,
                  random_seed: int = 42,
                  transform_x: Callable[[Any], Any] = lambda x: x,
-                 transform_y: Callable[[Any], Any] = lambda y: y):
+                 transform_y: Callable[[Any], Any] = lambda y: y,
+                 sampler: Optional[str] = None,
+                 label_weights: Optional[dict] = None,
+                 shuffle: str = 'fetch',
+                 window_size: int = 256,
+                 buffer_size: int = 1024,
+                 batch_buffers: int = 0,
+                 transform_batch_x: Optional[Callable[[Any], Any]] = None,
+                 transform_batch_y: Optional[Callable[[Any], Any]] = None,
+                 transform_on_pump: bool = False):
+
+        assert shuffle in SHUFFLES
 
         self.loader = loader
         self.split = split
 
-        self.loader.begin_read_samples()
-        num_samples = self.loader.num_samples(self.split)
-        self.loader.end_read_samples()
+        sampler = Sampler(loader, split, sampler, label_weights, randomize, random_seed)
+        num_samples = len(sampler)
 
         self.infinite = infinite
         self.with_meta = with_meta
         self.transform_x = transform_x
         self.transform_y = transform_y
+        self.transform_batch_x = transform_batch_x
+        self.transform_batch_y = transform_batch_y
+        self.transform_on_pump = transform_on_pump
         self.layout = layout
+        self.batch_size = batch_size
         self.num_batches = num_samples // batch_size
         self.current_batch = 0
-
-        if randomize:
+        self.batches_read = 0
+
+        # a ring of preallocated (xs, ys) arrays reused for the arrays layout
+        if batch_buffers and transform_on_pump:
+            # account for the batches waiting in the queue and the batch in progress
+            batch_buffers += _PUMP_BATCHES + 1
+        self.batch_buffers = [None] * batch_buffers
+        self.current_buffer = 0
+
+        buffered = randomize and shuffle == 'buffer' and not sampler.resamples
+        self.buffer = None
+
+        if sampler.resamples or (randomize and shuffle == 'sample'):
+            ix_fn = lambda: _plan_batch_ixs(sampler.plans(), batch_size)
+        elif buffered:
+            ix_fn = lambda: _window_fetches(num_samples, window_size, fetch_size, random_seed)
+        elif randomize:
             ix_fn = lambda: _rand_batch_ixs(num_samples, batch_size, fetch_size, random_seed)
         else:
             ix_fn = lambda: _ser_batch_ixs(num_samples, batch_size)
@@ -127,12 +447,40 @@ class BatchView: # pylint: disable=R0902
         # We generate two identical ix generators - one for the view and
         # one for the loader
         self.ix_gen = ix_fn()
-        self.loader.pump(self.split, _pumpfn(ix_fn()))
+
+        if transform_on_pump:
+            # samples are read directly by the thread which builds the batches
+            self.fetch_pump = None
+        elif buffered:
+            # the loader reads windows in order, which the view shuffles in a buffer
+            self.fetch_pump = self.loader.pump(self.split, ix_fn())
+        else:
+            self.fetch_pump = self.loader.pump(self.split, _pumpfn(ix_fn()))
+
+        if buffered:
+            read_fn = lambda index, n_samples: self.loader.read_samples(self.split, index, n_samples,
+                                                                        self.fetch_pump)
+            self.buffer = _ShuffleBuffer(read_fn, self.ix_gen, min(buffer_size, num_samples), random_seed)
+
+        self.pump = self.fetch_pump
+
+        if transform_on_pump:
+            # build whole batches, including all transformations, in the background
+            # (referencing the view weakly, so the pump stops when the view is deleted)
+            view = weakref.ref(self)
+            batch_ixs = ((i, batch_size) for i in itertools.count())
+            self.pump = self.loader.pump(self.split, batch_ixs, _PUMP_BATCHES,
+                                         read_fn=lambda *_: view()._read_batch())
 
     def __iter__(self):
         self.current_batch = 0
         return self
 
+    def __del__(self):
+        # stop loading samples in the background
+        if getattr(self, 'pump', None) is not None:
+            self.loader.stop_pump(self.pump)
+
     def __len__(self):
         return self.num_batches
 
@@ -141,36 +489,105 @@ class BatchView: # pylint: disable=R0902
         if self.current_batch >= self.num_batches and not self.infinite:
             raise StopIteration
 
+        if self.transform_on_pump:
+            res = self.loader.read_pump(self.pump, self.batches_read, self.batch_size)
+        else:
+            res = self._read_batch()
+
+        self.batches_read += 1
+        self.current_batch += 1
+        return res
+
+    def _read_batch(self):
+        """Read the next batch and arrange it according to the configured layout.
+        """
+
         # BEGIN loading samples from the data loader
         self.loader.begin_read_samples()
 
-        res = []
-        for index, n_samples in next(self.ix_gen):
-
-            samples = self.loader.read_samples(self.split, index, n_samples)
-            for sample in samples:
+        if self.buffer is not None:
+            batches = [self.buffer.take(self.batch_size)]
+        else:
+            batches = (self.loader.read_samples(self.split, index, n_samples, self.fetch_pump)
+                       for index, n_samples in next(self.ix_gen))
 
-                # pylint: disable=C0103
-                x, y, m = sample.x, sample.y, sample.meta
-                x, y = self.transform_x(x), self.transform_y(y)
-                res.append((x, y, m) if self.with_meta else (x, y))
+        samples = [sample for samples in batches for sample in samples]
 
         self.loader.end_read_samples()
         # END loading samples
 
-        self.current_batch += 1
+        # pylint: disable=C0103
+        xys = [(self.transform_x(sample.x), self.transform_y(sample.y)) for sample in samples]
+        meta = [sample.meta for sample in samples]
+
+        if self.layout == 'tuples' and not (self.transform_batch_x or self.transform_batch_y):
+            return [xy + (m,) for xy, m in zip(xys, meta)] if self.with_meta else xys
+
+        res = self._assemble_arrays(xys) if self.layout == 'arrays' else None
+
+        if res is None:
+            xs, ys = [x for x, _ in xys], [y for _, y in xys]
+            if self.layout == 'arrays':
+                xs, ys = np.array(xs), np.array(ys)
+        else:
+            xs, ys = res
+
+        xs = self.transform_batch_x(xs) if self.transform_batch_x else xs
+        ys = self.transform_batch_y(ys) if self.transform_batch_y else ys
 
         # rearrange the result according to the configured layout
-        if self.layout in ('lists', 'arrays'):
-            res = tuple(map(list, zip(*res)))
+        if self.layout == 'tuples':
+            return list(zip(xs, ys, meta)) if self.with_meta else list(zip(xs, ys))
 
-        if self.layout == 'arrays':
+        return (xs, ys, meta) if self.with_meta else (xs, ys)
 
-            # pylint: disable=C0103
-            xs, ys, *meta = res
-            res = tuple([np.array(xs), np.array(ys)] + meta)
+    def _assemble_arrays(self, xys):
+        """Copy (x, y) pairs straight into numpy arrays.
 
-        return res
+        Returns None when the pairs can't be stored in numeric arrays of the
+        shape and type of the first pair.
+        """
+        if not xys:
+            return None
+
+        # pylint: disable=C0103
+        x, y = np.asarray(xys[0][0]), np.asarray(xys[0][1])
+
+        if x.dtype.kind not in 'biufc' or y.dtype.kind not in 'biufc':
+            return None
+
+        xs, ys = self._get_arrays(len(xys), x, y)
+
+        try:
+            for i, (x, y) in enumerate(xys):
+                xs[i], ys[i] = x, y
+        except (ValueError, TypeError):
+            # samples differ in shape
+            return None
+
+        return xs, ys
+
+    def _get_arrays(self, n_samples, x, y):
+        """Return arrays to hold n_samples items like x and y.
+
+        When batch_buffers is set, the arrays are taken from a ring of reused
+        buffers, so a batch is only valid until the ring wraps around.
+        """
+        shapes = (n_samples,) + x.shape, (n_samples,) + y.shape
+
+        if not self.batch_buffers:
+            return np.empty(shapes[0], x.dtype), np.empty(shapes[1], y.dtype)
+
+        ix = self.current_buffer
+        self.current_buffer = (ix + 1) % len(self.batch_buffers)
+        buffers = self.batch_buffers[ix]
+
+        if buffers is None or (buffers[0].shape, buffers[1].shape) != shapes \
+           or (buffers[0].dtype, buffers[1].dtype) != (x.dtype, y.dtype):
+            buffers = np.empty(shapes[0], x.dtype), np.empty(shapes[1], y.dtype)
+            self.batch_buffers[ix] = buffers
+
+        return buffers
 
 class IteratorView: # pylint: disable=R0902
     """Generator that returns one sample at a time.
@@ -184,36 +601,53 @@ class IteratorView: # pylint: disable=R0902
                  randomize=False,
                  random_seed=42,
                  transform_x=lambda x: x,
-                 transform_y=lambda y: y):
+                 transform_y=lambda y: y,
+                 sampler=None,
+                 label_weights=None,
+                 shuffle='fetch',
+                 window_size=256,
+                 buffer_size=1024):
+
+        assert shuffle in SHUFFLES
 
         self.loader = loader
         self.split = split
 
-        self.loader.begin_read_samples()
-        self.num_samples = self.loader.num_samples(self.split)
-        self.loader.end_read_samples()
+        sampler = Sampler(loader, split, sampler, label_weights, randomize, random_seed)
+        num_samples = len(sampler)
 
+        self.num_samples = num_samples
         self.infinite = infinite
         self.with_meta = with_meta
         self.transform_x = transform_x
         self.transform_y = transform_y
         self.fetch_size = fetch_size
-        self.rng = random.Random(random_seed) if randomize else None
-        self.ixs = None
+        self.buffer = None
 
-        self.current_index = 0
-        self._shuffle()
+        # samples which were fetched but not yet returned
+        self.fetched = collections.deque()
+
+        buffered = randomize and shuffle == 'buffer' and not sampler.resamples
+
+        if sampler.resamples or (randomize and shuffle == 'sample'):
+            ix_fn = lambda: _plan_fetches(sampler.plans(), fetch_size)
+        elif buffered:
+            ix_fn = lambda: _window_fetches(num_samples, window_size, fetch_size, random_seed)
+        elif randomize:
+            ix_fn = lambda: _plan_fetches(_block_plans(num_samples, fetch_size, random_seed), fetch_size)
+        else:
+            ix_fn = lambda: _plan_fetches(itertools.repeat(np.arange(num_samples)), fetch_size)
+
+        # We generate two identical ix generators - one for the view and
+        # one for the loader
+        self.ix_gen = ix_fn()
+        self.pump = self.loader.pump(self.split, ix_fn())
 
-    def _shuffle(self):
-        self.ixs = range(0, self.num_samples)
+        if buffered:
+            read_fn = lambda index, n_samples: self.loader.read_samples(self.split, index, n_samples, self.pump)
+            self.buffer = _ShuffleBuffer(read_fn, self.ix_gen, min(buffer_size, num_samples), random_seed)
 
-        if self.rng:
-            # When randomizing sample order, make sure to lay out samples
-            # according to fetch size to improve performance.
-            self.ixs = [self.ixs[i:i + self.fetch_size]
-                        for i in range(0, len(self.ixs), self.fetch_size)]
-            self.rng.shuffle(self.ixs)
-            self.ixs = list(itertools.chain.from_iterable(self.ixs))
+        self.current_index = 0
 
     def __iter__(self):
         return self
@@ -221,16 +655,26 @@ class IteratorView: # pylint: disable=R0902
     def __len__(self):
         return self.num_samples
 
+    def __del__(self):
+        # stop loading samples in the background
+        if getattr(self, 'pump', None) is not None:
+            self.loader.stop_pump(self.pump)
+
     def __next__(self):
 
         if self.current_index >= self.num_samples:
             self.current_index = 0
-            self._shuffle()
             if not self.infinite:
                 raise StopIteration
 
-        index = self.ixs[self.current_index]
-        sample = self.loader.read_samples(self.split, index, 1)[0]
+        if self.buffer is not None:
+            sample = self.buffer.take(1)[0]
+        else:
+            if not self.fetched:
+                # read the next fetch_size samples at once
+                index, n_samples = next(self.ix_gen)
+                self.fetched.extend(self.loader.read_samples(self.split, index, n_samples, self.pump))
+            sample = self.fetched.popleft()
 
         # pylint: disable=C0103
         x, y, m = sample.x, sample.y, sample.meta